@@ -87,9 +87,11 @@ def register(event, context):
             'createdAt': timestamp
         }
         
-        # Guardar en DynamoDB
-        _get_dynamodb().put_item(os.environ['USERS_TABLE'], user_data)
-        _get_dynamodb().put_item(os.environ['CUSTOMERS_TABLE'], customer_data)
+        # Guardar en DynamoDB (una sola llamada para ambas tablas)
+        _get_dynamodb().batch_write_multi({
+            os.environ['USERS_TABLE']: {'puts': [user_data]},
+            os.environ['CUSTOMERS_TABLE']: {'puts': [customer_data]}
+        })
         
         return {
             'statusCode': 201,
@@ -1,68 +1,213 @@
 import json
-import boto3
 import os
 from datetime import datetime
 from boto3.dynamodb.conditions import Key
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
 
-stepfunctions = boto3.client('stepfunctions')
-dynamodb = boto3.resource('dynamodb')
-steps_table = dynamodb.Table(os.environ['STEPS_TABLE'])
+try:
+    from shared.clients import get_client, get_executor
+    from shared.database import DynamoDB, is_conditional_check_failed
+    from shared.outbox import pending_outbox, publish_outbox
+    from ms_restaurante.capacity import DeliveryCapacity, wake_waiting_order
+except ImportError:
+    from Lambdas.shared.clients import get_client, get_executor
+    from Lambdas.shared.database import DynamoDB, is_conditional_check_failed
+    from Lambdas.shared.outbox import pending_outbox, publish_outbox
+    from Lambdas.ms_restaurante.capacity import DeliveryCapacity, wake_waiting_order
+
+# Tokens que el barrido falla cuando pasan su expiresAt
+EXPIRABLE_STATUSES = ('PENDING_CONFIRMATION', 'WAITING_CAPACITY')
+TOKENS_EXPIRY_INDEX = 'status-expiresAt-index'
+SWEEP_PAGE_SIZE = 100
+SWEEP_SAFETY_MS = 5000  # Margen antes del timeout para guardar el checkpoint y salir
+SWEEP_CHECKPOINT_KEY = {'PK': 'SWEEPER#EXPIRED_TOKENS', 'SK': 'CHECKPOINT'}
+OUTBOX_RELAY_PAGE_SIZE = 100
+
+# Inicialización lazy: clientes y tablas salen del cache compartido por proceso
+dynamodb = None
+
+def _get_dynamodb():
+    global dynamodb
+    if dynamodb is None:
+        dynamodb = DynamoDB()
+    return dynamodb
+
+def _get_stepfunctions():
+    return get_client('stepfunctions')
 
 def cleanup_expired_tokens(event, context):
     """
-    Función programada para limpiar tokens expirados
+    Función programada para limpiar tokens expirados.
+    Recorre el GSI status-expiresAt por página, falla los tokens de cada
+    página en paralelo y deja un checkpoint por estado para que, si se corta
+    por tiempo, la próxima corrida siga desde ahí.
     """
     try:
-        current_time = datetime.now().timestamp()
-        
-        # Buscar tokens expirados usando GSI (necesitarías crearlo)
-        response = steps_table.scan(
-            FilterExpression='ttl < :current_time AND attribute_exists(taskToken)',
-            ExpressionAttributeValues={
-                ':current_time': int(current_time)
-            }
-        )
-        
-        expired_count = 0
+        db = _get_dynamodb()
+        now = datetime.now().isoformat()
+        cursors = dict(db.get_item(
+            os.environ['STEPS_TABLE'], SWEEP_CHECKPOINT_KEY
+        ).get('Item', {}).get('cursors') or {})
+
+        expired_count, failed_count, complete = 0, 0, True
+        for status in EXPIRABLE_STATUSES:
+            cursor = cursors.get(status)
+            while complete:
+                if context and context.get_remaining_time_in_millis() < SWEEP_SAFETY_MS:
+                    complete = False
+                    break
+                page = db.iter_query(
+                    table_name=os.environ['STEPS_TABLE'],
+                    index_name=TOKENS_EXPIRY_INDEX,
+                    key_condition_expression='#s = :status AND expiresAt < :now',
+                    expression_attribute_values={':status': status, ':now': now},
+                    expression_names={'#s': 'status'},
+                    max_items=SWEEP_PAGE_SIZE,
+                    cursor=cursor
+                )
+                expired, failed = _expire_tokens(list(page), now)
+                expired_count += expired
+                failed_count += failed
+
+                cursor = None if page.exhausted else page.cursor
+                if cursor:
+                    cursors[status] = cursor
+                else:
+                    cursors.pop(status, None)
+                db.put_item(os.environ['STEPS_TABLE'], {
+                    **SWEEP_CHECKPOINT_KEY, 'cursors': cursors, 'updatedAt': now
+                })
+                if not cursor:
+                    break
+
+        return {
+            "statusCode": 200,
+            "body": json.dumps({
+                "message": f"Limpieza completada. {expired_count} tokens expirados procesados",
+                "expired": expired_count,
+                "failed": failed_count,
+                "complete": complete
+            })
+        }
         
-        for item in response.get('Items', []):
+    except Exception as e:
+        return {
+            "statusCode": 500,
+            "body": json.dumps({
+                "error": str(e)
+            })
+        }
+
+def _expire_tokens(items, now):
+    """
+    Falla los tokens de una página en paralelo. Los de confirmación pasan a
+    EXPIRED con un update condicionado al estado y token leídos, para no pisar
+    una confirmación que llegó entre el query y la escritura; las entradas de
+    la cola de delivery se borran (si no, el despacho las tomaría como cabeza),
+    condicionadas al mismo token por si el workflow ya reencoló al pedido.
+    Devuelve (procesados, con error).
+    """
+    def expire(item):
+        try:
             try:
-                # Notificar fallo a Step Functions
-                stepfunctions.send_task_failure(
+                _get_stepfunctions().send_task_failure(
                     taskToken=item['taskToken'],
                     error='TokenExpired',
                     cause='El tiempo de espera para confirmación ha expirado'
                 )
-                
-                # Marcar como expirado
-                steps_table.update_item(
-                    Key={
-                        'PK': item['PK'],
-                        'SK': item['SK']
-                    },
-                    UpdateExpression="SET #status = :status, expiredAt = :expiredAt",
-                    ExpressionAttributeNames={
-                        '#status': 'status'
-                    },
-                    ExpressionAttributeValues={
-                        ':status': 'EXPIRED',
-                        ':expiredAt': datetime.now().isoformat()
-                    }
-                )
-                
-                expired_count += 1
-                
             except Exception as e:
-                print(f"Error procesando token {item.get('taskToken', 'unknown')}: {str(e)}")
-                continue
-        
+                # Un token que la ejecución ya no acepta igual se saca del índice
+                code = (getattr(e, 'response', None) or {}).get('Error', {}).get('Code')
+                if code not in ('TaskTimedOut', 'TaskDoesNotExist', 'InvalidToken'):
+                    raise
+            try:
+                if item['status'] == 'WAITING_CAPACITY':
+                    _get_dynamodb().delete_item(
+                        os.environ['STEPS_TABLE'],
+                        {'PK': item['PK'], 'SK': item['SK']},
+                        condition_expression='taskToken = :token',
+                        expression_values={':token': item['taskToken']}
+                    )
+                else:
+                    _get_dynamodb().update_item(
+                        os.environ['STEPS_TABLE'],
+                        {'PK': item['PK'], 'SK': item['SK']},
+                        'SET #s = :expired, expiredAt = :now',
+                        {':expired': 'EXPIRED', ':now': now, ':expected_status': item['status'],
+                         ':token': item['taskToken']},
+                        expression_names={'#s': 'status'},
+                        condition_expression='#s = :expected_status AND taskToken = :token'
+                    )
+            except Exception as e:
+                # Otro proceso ya movió el token: su escritura gana
+                if not is_conditional_check_failed(e):
+                    raise
+            return item, True
+        except Exception as e:
+            print(f"Error procesando token {item.get('orderId', 'unknown')}: {str(e)}")
+            return item, False
+
+    results = list(get_executor().map(expire, items)) if items else []
+    processed = sum(1 for _, ok in results if ok)
+    return processed, len(results) - processed
+
+def sweep_delivery_reservations(event, context):
+    """
+    Función programada: libera las reservas de capacidad de delivery vencidas
+    (pedidos cuyo workflow murió sin pasar por process_delivered) y despierta
+    a los que esperaban en la cola de esos locales
+    """
+    try:
+        capacity = DeliveryCapacity(_get_dynamodb())
+        released, stores = 0, set()
+        for slot in capacity.expired_reservations():
+            if capacity.release(slot['orderId'], slot.get('reservationId')):
+                released += 1
+                stores.add((slot['tenantId'], slot['storeId']))
+                print(f"Reserva vencida liberada: orden {slot['orderId']} ({slot['storeId']})")
+
+        woken = 0
+        for tenant_id, store_id in stores:
+            woken += capacity.dispatch(tenant_id, store_id, wake_waiting_order)
+
         return {
             "statusCode": 200,
             "body": json.dumps({
-                "message": f"Limpieza completada. {expired_count} tokens expirados procesados"
+                "message": f"Barrido completado. {released} reservas liberadas, {woken} pedidos despertados"
+            })
+        }
+    except Exception as e:
+        return {
+            "statusCode": 500,
+            "body": json.dumps({
+                "error": str(e)
+            })
+        }
+
+def relay_outbox(event, context):
+    """
+    Función programada: publica los eventos de transición que quedaron en el
+    outbox porque la Lambda que los escribió murió antes de publicarlos.
+    Va por páginas y corta antes del timeout; lo que falte sale en la próxima.
+    """
+    try:
+        db = _get_dynamodb()
+        relayed = 0
+        while not context or context.get_remaining_time_in_millis() >= SWEEP_SAFETY_MS:
+            page = list(pending_outbox(db, os.environ['STEPS_TABLE'], max_items=OUTBOX_RELAY_PAGE_SIZE))
+            if not page:
+                break
+            relayed += publish_outbox(db, os.environ['STEPS_TABLE'], page)
+            print(f"Outbox: {len(page)} eventos reenviados")
+
+        return {
+            "statusCode": 200,
+            "body": json.dumps({
+                "message": f"Relay completado. {relayed} eventos publicados",
+                "relayed": relayed
             })
         }
-        
     except Exception as e:
         return {
             "statusCode": 500,
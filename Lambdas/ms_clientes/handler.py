@@ -1,6 +1,9 @@
+import copy
 import json
 import uuid
 import os
+import threading
+from concurrent.futures import TimeoutError as FutureTimeoutError
 from datetime import datetime
 from decimal import Decimal
 from boto3.dynamodb.conditions import Key
@@ -8,11 +11,38 @@ import sys
 sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
 
 try:
-    from shared.database import DynamoDB
-    from shared.events import EventBridge
+    from shared.clients import get_executor
+    from shared.database import DynamoDB, add_operation, cancellation_reasons, is_conditional_check_failed
+    from shared.events import EventBridge, flush_events
+    from shared.orders import (
+        DEFAULT_STORE_ID, ORDER_INFO_SK, ORDER_STAGES, ORDER_VIEW_SK, STAGE_SEQUENCE,
+        apply_order_event, day_bucket, new_stage_durations, order_pk
+    )
+    from shared.sketch import latency_pk, latency_sk, sketch_increments
 except ImportError:
-    from Lambdas.shared.database import DynamoDB
-    from Lambdas.shared.events import EventBridge
+    from Lambdas.shared.clients import get_executor
+    from Lambdas.shared.database import DynamoDB, add_operation, cancellation_reasons, is_conditional_check_failed
+    from Lambdas.shared.events import EventBridge, flush_events
+    from Lambdas.shared.orders import (
+        DEFAULT_STORE_ID, ORDER_INFO_SK, ORDER_STAGES, ORDER_VIEW_SK, STAGE_SEQUENCE,
+        apply_order_event, day_bucket, new_stage_durations, order_pk
+    )
+    from Lambdas.shared.sketch import latency_pk, latency_sk, sketch_increments
+
+CUSTOMER_ORDERS_INDEX = 'customerId-createdAt-index'
+DEFAULT_ORDERS_PAGE = 20
+MAX_ORDERS_PAGE = 100
+FANOUT_TIMEOUT_SECONDS = float(os.environ.get('FANOUT_TIMEOUT_SECONDS', 3))
+ORDER_VIEW_MAX_ATTEMPTS = 5
+
+# Backfill de dayBucket: segmentos del scan (cada uno marca sus pedidos) y
+# margen antes del timeout de la Lambda
+BACKFILL_SEGMENTS = int(os.environ.get('BACKFILL_SEGMENTS', 16))
+BACKFILL_SAFETY_MS = 15000
+
+
+class _BackfillDeadline(Exception):
+    """Corta el scan del backfill cuando la Lambda se queda sin tiempo"""
 
 # Inicialización lazy: No crear globales en import time
 dynamodb = None
@@ -27,14 +57,17 @@ def _get_dynamodb():
 def _get_events():
     global events
     if events is None:
-        events = EventBridge()
+        # Buffered: los eventos de la invocación salen juntos al terminar (flush_events)
+        events = EventBridge(buffered=True)
     return events
 
+@flush_events(_get_events)
 def create_order(event, context):
     try:
         body = json.loads(event['body']) if isinstance(event['body'], str) else event['body']
         customer_id = body['customerId']
         tenant_id = body.get('tenantId', 'pardos')
+        store_id = body.get('storeId', DEFAULT_STORE_ID)  # Local que despacha (capacidad de delivery)
         order_id = str(uuid.uuid4())  # UUID para escalabilidad
         timestamp = datetime.utcnow().isoformat()
 
@@ -50,10 +83,12 @@ def create_order(event, context):
             'orderId': order_id,
             'customerId': customer_id,
             'tenantId': tenant_id,
+            'storeId': store_id,
             'status': 'CREATED',
             'items': body.get('items', []),  # Lista de {productId, qty, price} con Decimal
             'total': total,  # Decimal para total
             'createdAt': timestamp,
+            'dayBucket': day_bucket(tenant_id, timestamp),  # GSI por día (dashboard)
             'currentStep': 'CREATED'  # Inicia en CREATED, el workflow lo moverá a COOKING
         }
         _get_dynamodb().put_item(os.environ['ORDERS_TABLE'], order_metadata)
@@ -74,8 +109,10 @@ def create_order(event, context):
                 'orderId': order_id,
                 'tenantId': tenant_id,
                 'customerId': customer_id,
+                'storeId': store_id,
                 'total': float(total),
                 'items': items_for_event,
+                'sequence': STAGE_SEQUENCE['CREATED'],
                 'timestamp': timestamp
             }
         )
@@ -95,18 +132,50 @@ def create_order(event, context):
         }
 
 def get_orders_by_customer(event, context):
+    """
+    Pedidos de un cliente, más recientes primero
+    GET /orders/{customerId}?limit=&nextToken=&status=
+    """
     try:
         customer_id = event['pathParameters']['customerId']
         tenant_id = 'pardos'
-        response = _get_dynamodb().scan(
-            table_name=os.environ['ORDERS_TABLE'],
-            filter_expression='customerId = :cid',
-            expression_attribute_values={':cid': customer_id}
-        )
-        orders = [item for item in response.get('Items', []) if item.get('PK', '').startswith(f"TENANT#{tenant_id}")]
+        params = event.get('queryStringParameters') or {}
+        try:
+            limit = min(max(int(params.get('limit', DEFAULT_ORDERS_PAGE)), 1), MAX_ORDERS_PAGE)
+        except ValueError:
+            return {'statusCode': 400, 'body': json.dumps({'error': 'limit debe ser un entero'})}
+
+        # Query sobre el GSI (customerId, createdAt): el costo depende del historial del cliente
+        filter_expression = 'tenantId = :tid'
+        values = {':cid': customer_id, ':tid': tenant_id}
+        names = None
+        if params.get('status'):
+            filter_expression += ' AND #s = :status'
+            values[':status'] = params['status']
+            names = {'#s': 'status'}
+
+        try:
+            pages = _get_dynamodb().iter_query(
+                table_name=os.environ['ORDERS_TABLE'],
+                index_name=CUSTOMER_ORDERS_INDEX,
+                key_condition_expression='customerId = :cid',
+                expression_attribute_values=values,
+                filter_expression=filter_expression,
+                expression_names=names,
+                scan_index_forward=False,
+                max_items=limit,
+                cursor=params.get('nextToken')
+            )
+            orders = list(pages)
+        except ValueError as e:
+            return {'statusCode': 400, 'body': json.dumps({'error': str(e)})}
+
         return {
             'statusCode': 200,
-            'body': json.dumps({'orders': orders}, default=str)  # default=str para Decimal
+            'body': json.dumps({
+                'orders': orders,
+                'nextToken': pages.cursor
+            }, default=str)  # default=str para Decimal
         }
     except Exception as e:
         return {'statusCode': 500, 'body': json.dumps({'error': str(e)})}
@@ -133,39 +202,63 @@ def get_order(event, context):
     try:
         order_id = event['pathParameters']['orderId']
         tenant_id = 'pardos'
-        pk = f"TENANT#{tenant_id}#ORDER#{order_id}"
-        
-        # Obtener order metadata
-        order_response = _get_dynamodb().query(
+        pk = order_pk(tenant_id, order_id)
+        db = _get_dynamodb()
+
+        # Camino rápido: la vista materializada resuelve el pedido con un solo GetItem
+        view = db.get_item(
             table_name=os.environ['ORDERS_TABLE'],
-            key_condition_expression='PK = :pk AND SK = :sk',
-            expression_attribute_values={
-                ':pk': pk,
-                ':sk': 'INFO'
+            key={'PK': pk, 'SK': ORDER_VIEW_SK}
+        ).get('Item')
+        if view and view.get('createdAt'):
+            return {
+                'statusCode': 200,
+                'body': json.dumps(_order_view_response(order_id, view))
             }
+
+        # Sin vista (pedido anterior a la vista o evento aún en camino): join concurrente
+        pool = get_executor()
+
+        # Order y steps solo dependen del PK: se piden a la vez
+        order_future = pool.submit(
+            db.get_item,
+            table_name=os.environ['ORDERS_TABLE'],
+            key={'PK': pk, 'SK': 'INFO'}
         )
-        
-        items = order_response.get('Items', [])
-        if not items:
-            return {'statusCode': 404, 'body': json.dumps({'error': 'Order not found'})}
-        
-        order = items[0]
-        
-        # Join con customer
-        customer_pk = f"TENANT#{tenant_id}#CUSTOMER#{order['customerId']}"
-        customer_response = _get_dynamodb().get_item(
-            table_name=os.environ['CUSTOMERS_TABLE'],
-            key={'PK': customer_pk}
-        )
-        customer = customer_response.get('Item', {})
-        
-        # Join con steps
-        steps_response = _get_dynamodb().query(
+        steps_future = pool.submit(lambda: list(db.iter_query(
             table_name=os.environ['STEPS_TABLE'],
             key_condition_expression='PK = :pk',
             expression_attribute_values={':pk': pk}
+        )))
+
+        try:
+            order = order_future.result(timeout=FANOUT_TIMEOUT_SECONDS).get('Item')
+        except FutureTimeoutError:
+            return {'statusCode': 504, 'body': json.dumps({'error': 'Timeout leyendo el pedido'})}
+        if not order:
+            return {'statusCode': 404, 'body': json.dumps({'error': 'Order not found'})}
+
+        # Join con customer: apenas se conoce el customerId, en paralelo con steps
+        customer_future = pool.submit(
+            db.get_item,
+            table_name=os.environ['CUSTOMERS_TABLE'],
+            key={'PK': f"TENANT#{tenant_id}#CUSTOMER#{order['customerId']}"}
         )
-        steps = steps_response.get('Items', [])
+
+        # Si falla un join se responde igual, marcando qué parte vino incompleta
+        degraded = []
+        try:
+            customer = customer_future.result(timeout=FANOUT_TIMEOUT_SECONDS).get('Item', {})
+        except Exception as e:
+            print(f"get_order {order_id}: customer no disponible ({type(e).__name__}: {str(e)})")
+            customer = {}
+            degraded.append('customer')
+        try:
+            steps = steps_future.result(timeout=FANOUT_TIMEOUT_SECONDS)
+        except Exception as e:
+            print(f"get_order {order_id}: steps no disponibles ({type(e).__name__}: {str(e)})")
+            steps = []
+            degraded.append('steps')
         
         # Convertir items para JSON (Decimal to float)
         items_json = []
@@ -190,6 +283,8 @@ def get_order(event, context):
             },
             'steps': [s.get('stepName') for s in steps if s.get('stepName')]
         }
+        if degraded:
+            result['degraded'] = degraded
         
         return {
             'statusCode': 200,
@@ -198,3 +293,154 @@ def get_order(event, context):
     except Exception as e:
         print(f"Error en get_order: {str(e)}")
         return {'statusCode': 500, 'body': json.dumps({'error': str(e)})}
+
+def _order_view_response(order_id, view):
+    """Arma la respuesta de GET /order/{orderId} a partir de la vista materializada"""
+    customer = view.get('customer', {})
+    timeline = view.get('timeline', {})
+    return {
+        'orderId': order_id,
+        'status': view.get('status', 'CREATED'),
+        'currentStep': view.get('currentStep', 'CREATED'),
+        'total': float(view.get('total', 0)),
+        'items': [
+            {
+                'productId': item.get('productId', ''),
+                'qty': int(item.get('qty', 0)),
+                'price': float(item.get('price', 0))
+            }
+            for item in view.get('items', [])
+        ],
+        'createdAt': view.get('createdAt', ''),
+        'customer': {
+            'name': customer.get('name', 'N/A'),
+            'email': customer.get('email', 'N/A'),
+            'phone': customer.get('phone', 'N/A')
+        },
+        'steps': [stage for stage in ORDER_STAGES[1:] if timeline.get(stage, {}).get('startedAt')],
+        'timeline': [
+            {'stage': stage, **timeline[stage]}
+            for stage in ORDER_STAGES if timeline.get(stage)
+        ]
+    }
+
+def update_order_view(event, context):
+    """
+    Mantiene la vista materializada del pedido (SK=VIEW en ORDERS_TABLE)
+    Triggered por EventBridge (pardos.orders / pardos.etapas)
+    """
+    detail_type = event.get('detail-type', '')
+    detail = event.get('detail', {})
+    order_id = detail.get('orderId')
+    tenant_id = detail.get('tenantId', 'pardos')
+    if not order_id:
+        return {'statusCode': 400, 'body': json.dumps({'error': 'Evento sin orderId'})}
+
+    db = _get_dynamodb()
+    key = {'PK': order_pk(tenant_id, order_id), 'SK': ORDER_VIEW_SK}
+    try:
+        # Concurrencia optimista: si otro evento escribió en medio, se relee y se reaplica
+        for attempt in range(ORDER_VIEW_MAX_ATTEMPTS):
+            current = db.get_item(os.environ['ORDERS_TABLE'], key, consistent_read=True).get('Item')
+            previous_timeline = copy.deepcopy((current or {}).get('timeline', {}))
+            view, changed = apply_order_event(
+                dict(current) if current else {**key, 'orderId': order_id, 'tenantId': tenant_id},
+                detail_type,
+                detail
+            )
+            if not changed:
+                # Duplicado o evento ya reflejado: no se escribe nada
+                return {'statusCode': 200, 'body': json.dumps({'orderId': order_id, 'updated': False})}
+
+            customer = view.get('customer', {})
+            if customer.get('customerId') and 'name' not in customer:
+                customer_item = db.get_item(
+                    os.environ['CUSTOMERS_TABLE'],
+                    {'PK': f"TENANT#{tenant_id}#CUSTOMER#{customer['customerId']}"}
+                ).get('Item', {})
+                for field in ('name', 'email', 'phone'):
+                    customer[field] = customer_item.get(field, 'N/A')
+
+            revision = int(view.get('revision', 0))
+            view['revision'] = revision + 1
+            if current:
+                condition, condition_values = 'revision = :rev', {':rev': revision}
+            else:
+                condition, condition_values = 'attribute_not_exists(PK)', None
+            # Duraciones de etapas recién completadas: van a los sketches de latencia
+            # en la misma transacción que la vista, así se cuentan una sola vez
+            durations = new_stage_durations(previous_timeline, view.get('timeline', {}))
+            try:
+                if durations:
+                    put = {'TableName': os.environ['ORDERS_TABLE'], 'Item': view, 'ConditionExpression': condition}
+                    if condition_values:
+                        put['ExpressionAttributeValues'] = condition_values
+                    db.transact_write([{'Put': put}] + [
+                        add_operation(
+                            os.environ['COUNTERS_TABLE'],
+                            {'PK': latency_pk(tenant_id), 'SK': latency_sk(stage)},
+                            sketch_increments(seconds)
+                        )
+                        for stage, seconds in durations.items()
+                    ])
+                else:
+                    db.put_item(
+                        os.environ['ORDERS_TABLE'], view,
+                        condition_expression=condition,
+                        expression_values=condition_values
+                    )
+                return {'statusCode': 200, 'body': json.dumps({'orderId': order_id, 'updated': True})}
+            except Exception as e:
+                if not is_conditional_check_failed(e) and cancellation_reasons(e)[:1] != ['ConditionalCheckFailed']:
+                    raise
+                print(f"Vista de {order_id} modificada en paralelo, reintento {attempt + 1}")
+        raise RuntimeError(f"No se pudo actualizar la vista de {order_id} tras {ORDER_VIEW_MAX_ATTEMPTS} intentos")
+    except Exception as e:
+        # Se relanza para que EventBridge/Lambda reintenten el evento
+        print(f"Error en update_order_view: {str(e)}")
+        raise
+
+def backfill_day_buckets(event, context):
+    """
+    Backfill: agrega dayBucket a los pedidos creados antes del GSI por día.
+    Se invoca a mano (serverless invoke -f backfillDayBuckets). Es idempotente:
+    si se corta por tiempo basta con volver a correrlo.
+    """
+    db = _get_dynamodb()
+    lock = threading.Lock()
+    progress = {'updated': 0}
+
+    def tag(count, item):
+        # Cada segmento marca sus pedidos en su propio hilo: no se encolan
+        # tareas en el pool compartido mientras los segmentos lo ocupan
+        if context and context.get_remaining_time_in_millis() < BACKFILL_SAFETY_MS:
+            raise _BackfillDeadline()
+        tenant_id = item.get('tenantId') or item['PK'].split('#')[1]
+        db.update_item(
+            os.environ['ORDERS_TABLE'],
+            {'PK': item['PK'], 'SK': ORDER_INFO_SK},
+            'SET dayBucket = :bucket',
+            {':bucket': day_bucket(tenant_id, item['createdAt'])}
+        )
+        with lock:
+            progress['updated'] += 1
+        return count + 1
+
+    try:
+        db.parallel_scan(
+            table_name=os.environ['ORDERS_TABLE'],
+            reducer=tag,
+            initial=lambda: 0,
+            combine=lambda a, b: a + b,
+            filter_expression='SK = :sk AND attribute_exists(createdAt) AND attribute_not_exists(dayBucket)',
+            expression_attribute_values={':sk': ORDER_INFO_SK},
+            projection='PK, tenantId, createdAt',
+            total_segments=BACKFILL_SEGMENTS
+        )
+        return {'statusCode': 200, 'body': json.dumps({'updated': progress['updated'], 'complete': True})}
+    except _BackfillDeadline:
+        print(f"backfill_day_buckets: se corta por tiempo tras {progress['updated']} pedidos")
+        return {'statusCode': 200, 'body': json.dumps({'updated': progress['updated'], 'complete': False})}
+    except Exception as e:
+        print(f"Error en backfill_day_buckets: {str(e)}")
+        return {'statusCode': 500, 'body': json.dumps({'error': str(e), 'updated': progress['updated']})}
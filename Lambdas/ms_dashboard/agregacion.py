@@ -0,0 +1,124 @@
+from collections import Counter
+from datetime import datetime, timedelta
+
+ESTADOS_INICIALES = {'CREATED': 0, 'COOKING': 0, 'PACKAGING': 0, 'DELIVERY': 0, 'DELIVERED': 0, 'COMPLETED': 0}
+ETAPAS_ACTIVAS = ('CREATED', 'COOKING', 'PACKAGING', 'DELIVERY')
+DIAS_SEMANA = 7
+
+# Atributos de los items de contadores (COUNTERS_TABLE)
+CONTADORES_SK_TOTAL = 'TOTAL'
+ATRIBUTO_TOTAL = 'totalPedidos'
+ATRIBUTO_PEDIDOS_DIA = 'pedidos'
+PREFIJO_ETAPA = 'etapa_'
+PREFIJO_PRODUCTO = 'producto_'
+# Marca que deja reconstruir_contadores en el item TOTAL: sin ella los
+# contadores solo vieron los eventos posteriores al deploy y no se usan
+ATRIBUTO_RECONSTRUIDO = 'reconstruidoEn'
+
+
+def contadores_pk(tenant_id):
+    return f"TENANT#{tenant_id}#COUNTERS"
+
+
+def contadores_sk_dia(fecha):
+    return f"DAY#{fecha.isoformat()}"
+
+
+class AgregadoPedidos:
+    """
+    Acumuladores de todas las métricas de pedidos del dashboard, alimentados
+    en una sola pasada sobre los items INFO de ORDERS_TABLE. Cada segmento
+    del scan paralelo llena el suyo y luego se combinan con `combinar`.
+    `dias` limita el histograma diario (7 para el dashboard).
+    """
+
+    def __init__(self, hoy=None, dias=DIAS_SEMANA):
+        self.hoy = hoy or datetime.utcnow().date()
+        self.dias = dias
+        self.total = 0
+        self.hoy_count = 0
+        self.activos = 0
+        self.por_estado = Counter()
+        self.por_dia = Counter()
+        self.productos = Counter()
+
+    @classmethod
+    def desde_contadores(cls, total_item, dias_items, hoy=None):
+        """Arma el agregado a partir de los items de contadores mantenidos por eventos"""
+        agregado = cls(hoy)
+        agregado.total = int(total_item.get(ATRIBUTO_TOTAL, 0))
+        for atributo, valor in total_item.items():
+            if atributo.startswith(PREFIJO_ETAPA):
+                # Un evento de salida que llega antes que el de entrada deja la etapa
+                # transitoriamente en negativo
+                agregado.por_estado[atributo[len(PREFIJO_ETAPA):]] = max(int(valor), 0)
+            elif atributo.startswith(PREFIJO_PRODUCTO):
+                agregado.productos[atributo[len(PREFIJO_PRODUCTO):]] = int(valor)
+        agregado.activos = sum(agregado.por_estado.get(etapa, 0) for etapa in ETAPAS_ACTIVAS)
+        for fecha, pedidos in dias_items.items():
+            agregado.por_dia[fecha] = int(pedidos)
+        agregado.hoy_count = agregado.por_dia.get(agregado.hoy, 0)
+        return agregado
+
+    def agregar(self, pedido):
+        self.total += 1
+        # status queda en IN_PROGRESS durante todo el flujo: la etapa real está en currentStep
+        etapa = pedido.get('currentStep', pedido.get('status', 'CREATED'))
+        self.por_estado[etapa] += 1
+        if etapa in ETAPAS_ACTIVAS:
+            self.activos += 1
+
+        created_at = pedido.get('createdAt', '')
+        if created_at:
+            try:
+                fecha = datetime.fromisoformat(created_at.replace('Z', '+00:00')).date()
+                dias_diff = (self.hoy - fecha).days
+                if dias_diff == 0:
+                    self.hoy_count += 1
+                if 0 <= dias_diff < self.dias:
+                    self.por_dia[fecha] += 1
+            except ValueError:
+                pass
+
+        for item in pedido.get('items', []):
+            product_id = item.get('productId', '')
+            if product_id:
+                self.productos[product_id] += int(item.get('qty', 1))
+        return self
+
+    def combinar(self, otro):
+        self.total += otro.total
+        self.hoy_count += otro.hoy_count
+        self.activos += otro.activos
+        self.por_estado.update(otro.por_estado)
+        self.por_dia.update(otro.por_dia)
+        self.productos.update(otro.productos)
+        return self
+
+    def pedidos_por_estado(self):
+        distribucion = dict(ESTADOS_INICIALES)
+        distribucion.update(self.por_estado)
+        return distribucion
+
+    def pedidos_ultima_semana(self):
+        """Pedidos por día de los últimos 7 días, del más antiguo a hoy"""
+        return [self.por_dia.get(self.hoy - timedelta(days=i), 0) for i in range(DIAS_SEMANA - 1, -1, -1)]
+
+    def productos_populares(self, top=3):
+        return self.productos.most_common(top)
+
+    def items_contadores(self, tenant_id, reconstruido_en):
+        """Items absolutos de COUNTERS_TABLE equivalentes a este agregado (para el backfill)"""
+        pk = contadores_pk(tenant_id)
+        total_item = {'PK': pk, 'SK': CONTADORES_SK_TOTAL, ATRIBUTO_TOTAL: self.total,
+                      ATRIBUTO_RECONSTRUIDO: reconstruido_en}
+        for etapa, cantidad in self.por_estado.items():
+            total_item[f"{PREFIJO_ETAPA}{etapa}"] = cantidad
+        for product_id, cantidad in self.productos.items():
+            total_item[f"{PREFIJO_PRODUCTO}{product_id}"] = cantidad
+        dias_items = [
+            {'PK': pk, 'SK': contadores_sk_dia(fecha), ATRIBUTO_PEDIDOS_DIA: cantidad}
+            for fecha, cantidad in self.por_dia.items()
+        ]
+        return [total_item] + dias_items
+
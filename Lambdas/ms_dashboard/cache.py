@@ -0,0 +1,112 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# Configuración por variables de entorno (segundos / entradas / bytes)
+CACHE_TTL_SECONDS = float(os.environ.get('DASHBOARD_CACHE_TTL', 5))
+CACHE_STALE_SECONDS = float(os.environ.get('DASHBOARD_CACHE_STALE', 60))  # stale-if-error
+CACHE_MAX_ENTRADAS = int(os.environ.get('DASHBOARD_CACHE_MAX_ENTRIES', 256))
+CACHE_MAX_BYTES = int(os.environ.get('DASHBOARD_CACHE_MAX_BYTES', 16 * 1024 * 1024))
+
+HIT = 'HIT'
+MISS = 'MISS'
+STALE = 'STALE'
+
+
+class _Entrada:
+    __slots__ = ('valor', 'tamano', 'creado')
+
+    def __init__(self, valor, tamano, creado):
+        self.valor = valor
+        self.tamano = tamano
+        self.creado = creado
+
+
+class CacheRespuestas:
+    """
+    Cache en memoria del contenedor (sobrevive entre invocaciones "warm").
+
+    - Fresca (edad <= ttl): se sirve tal cual (HIT).
+    - Vencida o sin entrada: se recalcula en línea dentro de la misma
+      invocación (MISS). No hay refresco en segundo plano: Lambda congela el
+      contenedor al responder, así que ese trabajo quedaría a medias.
+    - Si el recálculo falla y la entrada vieja sigue dentro de `stale`, se
+      sirve la vieja (STALE) en vez del error.
+
+    Los valores son cuerpos ya serializados (str): el tamaño en bytes es
+    exacto y el límite `max_bytes` se respeta desalojando por LRU.
+    """
+
+    def __init__(self, ttl=CACHE_TTL_SECONDS, stale=CACHE_STALE_SECONDS,
+                 max_entradas=CACHE_MAX_ENTRADAS, max_bytes=CACHE_MAX_BYTES):
+        self.ttl = ttl
+        self.stale = stale
+        self.max_entradas = max_entradas
+        self.max_bytes = max_bytes
+        self._entradas = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stales = 0
+
+    def obtener(self, clave, calcular):
+        """Devuelve (valor, estado, edad_segundos). `calcular()` debe devolver un str"""
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            edad = time.monotonic() - entrada.creado if entrada is not None else None
+            if edad is not None and edad <= self.ttl:
+                self._entradas.move_to_end(clave)
+                self.hits += 1
+                return entrada.valor, HIT, edad
+
+        try:
+            valor = calcular()
+        except ValueError:
+            raise  # Error del pedido (p. ej. cursor inválido): no lo tapa una respuesta vieja
+        except Exception as e:
+            with self._lock:
+                entrada = self._entradas.get(clave)
+                edad = time.monotonic() - entrada.creado if entrada is not None else None
+                if edad is None or edad > self.ttl + self.stale:
+                    raise
+                self.stales += 1
+            print(f"Error recalculando cache {clave}, se sirve la anterior: {str(e)}")
+            return entrada.valor, STALE, edad
+
+        self._guardar(clave, valor)
+        with self._lock:
+            self.misses += 1
+        return valor, MISS, 0.0
+
+    def invalidar(self, clave=None):
+        with self._lock:
+            if clave is None:
+                self._entradas.clear()
+                self._bytes = 0
+            elif clave in self._entradas:
+                self._bytes -= self._entradas.pop(clave).tamano
+
+    def _guardar(self, clave, valor):
+        tamano = len(valor.encode('utf-8'))
+        if tamano > self.max_bytes:
+            return
+        with self._lock:
+            anterior = self._entradas.pop(clave, None)
+            if anterior is not None:
+                self._bytes -= anterior.tamano
+            self._entradas[clave] = _Entrada(valor, tamano, time.monotonic())
+            self._bytes += tamano
+            while len(self._entradas) > self.max_entradas or self._bytes > self.max_bytes:
+                _, desalojada = self._entradas.popitem(last=False)
+                self._bytes -= desalojada.tamano
+
+    def headers(self, estado, edad):
+        return {
+            'X-Cache': estado,
+            'X-Cache-Age': str(int(edad)),
+            'X-Cache-Hits': str(self.hits),
+            'X-Cache-Misses': str(self.misses),
+            'X-Cache-Stale': str(self.stales)
+        }
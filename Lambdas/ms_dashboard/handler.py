@@ -8,15 +8,51 @@ import sys
 sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
 
 try:
-    from shared.database import DynamoDB
+    from shared.clients import get_executor, in_worker_thread
+    from shared.database import DynamoDB, add_operation, cancellation_reasons, decode_cursor, encode_cursor
     from shared.events import EventBridge
+    from shared.orders import (
+        ORDER_DAY_INDEX, ORDER_TOTAL_STAGE, STAGE_SEQUENCE, day_bucket, event_stage, previous_stage
+    )
+    from shared.sketch import LatencySketch, latency_pk, latency_sk
+    from ms_dashboard.agregacion import (
+        ATRIBUTO_PEDIDOS_DIA, ATRIBUTO_RECONSTRUIDO, ATRIBUTO_TOTAL, CONTADORES_SK_TOTAL, DIAS_SEMANA,
+        PREFIJO_ETAPA, PREFIJO_PRODUCTO, AgregadoPedidos, contadores_pk, contadores_sk_dia
+    )
+    from ms_dashboard.cache import CacheRespuestas
 except ImportError:
-    from Lambdas.shared.database import DynamoDB
+    from Lambdas.shared.clients import get_executor, in_worker_thread
+    from Lambdas.shared.database import DynamoDB, add_operation, cancellation_reasons, decode_cursor, encode_cursor
     from Lambdas.shared.events import EventBridge
+    from Lambdas.shared.orders import (
+        ORDER_DAY_INDEX, ORDER_TOTAL_STAGE, STAGE_SEQUENCE, day_bucket, event_stage, previous_stage
+    )
+    from Lambdas.shared.sketch import LatencySketch, latency_pk, latency_sk
+    from Lambdas.ms_dashboard.agregacion import (
+        ATRIBUTO_PEDIDOS_DIA, ATRIBUTO_RECONSTRUIDO, ATRIBUTO_TOTAL, CONTADORES_SK_TOTAL, DIAS_SEMANA,
+        PREFIJO_ETAPA, PREFIJO_PRODUCTO, AgregadoPedidos, contadores_pk, contadores_sk_dia
+    )
+    from Lambdas.ms_dashboard.cache import CacheRespuestas
+
+# Días que se guardan los marcadores de idempotencia de los contadores
+CONTADORES_MARCADOR_DIAS = 30
+
+# Etapas con sketch de latencia que muestra el dashboard, y percentiles reportados
+ETAPAS_LATENCIA = ('COOKING', 'PACKAGING', 'DELIVERY')
+PERCENTILES = {'p50': 0.5, 'p90': 0.9, 'p99': 0.99}
+
+# Paginación de /dashboard/pedidos
+DEFAULT_PEDIDOS_PAGE = 50
+MAX_PEDIDOS_PAGE = 200
+# /dashboard/pedidos recorre el GSI por día hacia atrás hasta este límite de historial,
+# en bloques de días consultados en paralelo que se duplican hasta PEDIDOS_DIAS_BLOQUE_MAX
+PEDIDOS_DIAS_HISTORIAL = int(os.environ.get('DASHBOARD_HISTORY_DAYS', 730))
+PEDIDOS_DIAS_BLOQUE_MAX = 32
 
 # Inicialización lazy: No crear globales en import time
 dynamodb = None
 events = None
+cache = None
 
 def _get_dynamodb():
     global dynamodb
@@ -24,6 +60,12 @@ def _get_dynamodb():
         dynamodb = DynamoDB()
     return dynamodb
 
+def _get_cache():
+    global cache
+    if cache is None:
+        cache = CacheRespuestas()
+    return cache
+
 def _get_events():
     global events
     if events is None:
@@ -36,25 +78,7 @@ def obtener_resumen(event, context):
     """
     try:
         tenant_id = 'pardos'  # Por defecto
-        
-        # Obtener métricas REALES desde DynamoDB
-        total_pedidos = obtener_total_pedidos(tenant_id)
-        pedidos_hoy = obtener_pedidos_hoy(tenant_id)
-        pedidos_activos = obtener_pedidos_activos(tenant_id)
-        tiempo_promedio = obtener_tiempo_promedio_real(tenant_id)
-        
-        resumen = {
-            'totalPedidos': total_pedidos,
-            'pedidosHoy': pedidos_hoy,
-            'pedidosActivos': pedidos_activos,
-            'tiempoPromedioEntrega': tiempo_promedio,
-            'ultimaActualizacion': datetime.utcnow().isoformat()
-        }
-        
-        return {
-            'statusCode': 200,
-            'body': json.dumps(resumen, default=str)
-        }
+        return _respuesta_cacheada((tenant_id, 'resumen'), lambda: calcular_resumen(tenant_id))
         
     except Exception as e:
         return {
@@ -62,24 +86,32 @@ def obtener_resumen(event, context):
             'body': json.dumps({'error': str(e)})
         }
 
+def calcular_resumen(tenant_id):
+    # Contadores mantenidos por eventos (hoy); si faltan, una pasada sobre pedidos
+    agregado = obtener_agregado(tenant_id, dias=1)
+    sketches = leer_sketches_latencia(tenant_id)
+    total = sketches.get(ORDER_TOTAL_STAGE)
+    if total is not None and total.count:
+        tiempo_promedio = int(total.mean() / 60)
+    else:
+        tiempo_promedio = obtener_tiempo_promedio_real(tenant_id)
+
+    return {
+        'totalPedidos': agregado.total,
+        'pedidosHoy': agregado.hoy_count,
+        'pedidosActivos': agregado.activos,
+        'tiempoPromedioEntrega': tiempo_promedio,
+        'percentilesEntrega': resumen_percentiles(total) if total is not None else None,
+        'ultimaActualizacion': datetime.utcnow().isoformat()
+    }
+
 def obtener_metricas(event, context):
     """
     Obtiene métricas detalladas para gráficos - DATOS REALES
     """
     try:
         tenant_id = 'pardos'
-        
-        metricas = {
-            'pedidosPorEstado': obtener_pedidos_por_estado_real(tenant_id),
-            'tiemposPorEtapa': obtener_tiempos_por_etapa_real(tenant_id),
-            'pedidosUltimaSemana': obtener_pedidos_ultima_semana_real(tenant_id),
-            'productosPopulares': obtener_productos_populares_real(tenant_id)
-        }
-        
-        return {
-            'statusCode': 200,
-            'body': json.dumps(metricas, default=str)
-        }
+        return _respuesta_cacheada((tenant_id, 'metricas'), lambda: calcular_metricas(tenant_id))
         
     except Exception as e:
         return {
@@ -87,25 +119,55 @@ def obtener_metricas(event, context):
             'body': json.dumps({'error': str(e)})
         }
 
+def calcular_metricas(tenant_id):
+    agregado = obtener_agregado(tenant_id, dias=DIAS_SEMANA)
+    sketches = leer_sketches_latencia(tenant_id)
+    if any(sketches.get(etapa) is not None and sketches[etapa].count for etapa in ETAPAS_LATENCIA):
+        tiempos = {
+            etapa: int(sketches[etapa].mean() / 60) if sketches.get(etapa) is not None and sketches[etapa].count else 0
+            for etapa in ETAPAS_LATENCIA
+        }
+    else:
+        tiempos = obtener_tiempos_por_etapa_real(tenant_id)
+
+    return {
+        'pedidosPorEstado': agregado.pedidos_por_estado(),
+        'tiemposPorEtapa': tiempos,
+        'percentilesPorEtapa': {
+            etapa: resumen_percentiles(sketches.get(etapa)) for etapa in ETAPAS_LATENCIA
+        },
+        'pedidosUltimaSemana': agregado.pedidos_ultima_semana(),
+        'productosPopulares': obtener_productos_populares(agregado)
+    }
+
 def obtener_pedidos(event, context):
     """
-    Obtiene lista de pedidos REALES para el dashboard - DATOS REALES
+    Obtiene lista de pedidos REALES para el dashboard, más recientes primero
+    GET /dashboard/pedidos?limit=&cursor=
     """
     try:
         tenant_id = 'pardos'
-        limit = 50
-        
-        # Obtener pedidos REALES desde la tabla de orders
-        pedidos_reales = obtener_pedidos_reales(tenant_id, limit)
-        
-        return {
-            'statusCode': 200,
-            'body': json.dumps({
+        params = event.get('queryStringParameters') or {}
+        try:
+            limit = min(max(int(params.get('limit', DEFAULT_PEDIDOS_PAGE)), 1), MAX_PEDIDOS_PAGE)
+        except ValueError:
+            return {'statusCode': 400, 'body': json.dumps({'error': 'limit debe ser un entero'})}
+        cursor = params.get('cursor')
+
+        def calcular():
+            # Obtener pedidos REALES desde la tabla de orders
+            pedidos_reales, siguiente = obtener_pedidos_reales(tenant_id, limit, cursor)
+            return {
                 'pedidos': pedidos_reales,
                 'total': len(pedidos_reales),
+                'cursor': siguiente,
                 'message': 'Datos reales desde DynamoDB'
-            }, default=str)
-        }
+            }
+
+        try:
+            return _respuesta_cacheada((tenant_id, 'pedidos', limit, cursor), calcular)
+        except ValueError as e:
+            return {'statusCode': 400, 'body': json.dumps({'error': str(e)})}
         
     except Exception as e:
         return {
@@ -113,94 +175,187 @@ def obtener_pedidos(event, context):
             'body': json.dumps({'error': str(e)})
         }
 
-def obtener_total_pedidos(tenant_id):
-    """Obtiene el total de pedidos REALES"""
+def _respuesta_cacheada(clave, calcular):
+    """Respuesta 200 servida desde el cache del contenedor, con sus contadores en headers"""
+    cache = _get_cache()
+    cuerpo, estado, edad = cache.obtener(clave, lambda: json.dumps(calcular(), default=str))
+    return {
+        'statusCode': 200,
+        'headers': cache.headers(estado, edad),
+        'body': cuerpo
+    }
+
+def obtener_agregado(tenant_id, dias=DIAS_SEMANA):
+    """
+    Agregado para el dashboard: lee los contadores (TOTAL + últimos `dias`
+    días) y solo si todavía no fueron reconstruidos desde el historial
+    recurre a la pasada sobre pedidos
+    """
     try:
-        response = _get_dynamodb().scan(
-            table_name=os.environ['ORDERS_TABLE'],
-            filter_expression='begins_with(PK, :pk) AND SK = :sk',
-            expression_attribute_values={
-                ':pk': f"TENANT#{tenant_id}#ORDER#",
-                ':sk': 'INFO'
-            }
-        )
-        return response.get('Count', 0)
+        agregado = leer_agregado_contadores(tenant_id, dias)
+        if agregado is not None:
+            return agregado
     except Exception as e:
-        print(f"Error obteniendo total pedidos: {str(e)}")
-        return 0
+        print(f"Error leyendo contadores: {str(e)}")
+    try:
+        return calcular_agregado_pedidos(tenant_id)
+    except Exception as e:
+        print(f"Error calculando agregado de pedidos: {str(e)}")
+        return AgregadoPedidos()
+
+def leer_agregado_contadores(tenant_id, dias):
+    """Lee con un BatchGetItem el item TOTAL y los de los últimos `dias` días"""
+    hoy = datetime.utcnow().date()
+    pk = contadores_pk(tenant_id)
+    fechas = {contadores_sk_dia(hoy - timedelta(days=i)): hoy - timedelta(days=i) for i in range(dias)}
+    items = _get_dynamodb().batch_get(
+        os.environ['COUNTERS_TABLE'],
+        [{'PK': pk, 'SK': CONTADORES_SK_TOTAL}] + [{'PK': pk, 'SK': sk} for sk in fechas]
+    )
+    total_item = next((item for item in items if item['SK'] == CONTADORES_SK_TOTAL), None)
+    if total_item is None or ATRIBUTO_RECONSTRUIDO not in total_item:
+        # Contadores creados solo por eventos: no incluyen los pedidos anteriores
+        return None
+    dias_items = {fechas[item['SK']]: item.get(ATRIBUTO_PEDIDOS_DIA, 0) for item in items if item['SK'] in fechas}
+    return AgregadoPedidos.desde_contadores(total_item, dias_items, hoy)
 
-def obtener_pedidos_hoy(tenant_id):
-    """Obtiene pedidos creados hoy - REALES"""
+def calcular_agregado_pedidos(tenant_id, dias=DIAS_SEMANA):
+    """
+    Una sola pasada (scan paralelo) sobre los pedidos que alimenta todas las
+    métricas a la vez: total, hoy, activos, por estado, semana y productos
+    """
+    hoy = datetime.utcnow().date()
+    return _get_dynamodb().parallel_scan(
+        table_name=os.environ['ORDERS_TABLE'],
+        reducer=AgregadoPedidos.agregar,
+        initial=lambda: AgregadoPedidos(hoy, dias),
+        combine=AgregadoPedidos.combinar,
+        filter_expression='begins_with(PK, :pk) AND SK = :sk',
+        expression_attribute_values={
+            ':pk': f"TENANT#{tenant_id}#ORDER#",
+            ':sk': 'INFO'
+        },
+        # Solo los atributos que usan los acumuladores
+        expression_names={'#s': 'status', '#items': 'items'},
+        projection='#s, currentStep, createdAt, #items'
+    )
+
+def actualizar_contadores(event, context):
+    """
+    Mantiene los contadores del dashboard con ADD atómicos
+    Triggered por EventBridge (OrderCreated, OrderStageStarted, OrderDelivered)
+    """
     try:
-        hoy = datetime.utcnow().date().isoformat()
-        response = _get_dynamodb().scan(
-            table_name=os.environ['ORDERS_TABLE'],
-            filter_expression='begins_with(PK, :pk) AND SK = :sk',
-            expression_attribute_values={
-                ':pk': f"TENANT#{tenant_id}#ORDER#",
-                ':sk': 'INFO'
+        detail_type = event.get('detail-type', '')
+        detail = event.get('detail', {})
+        order_id = detail.get('orderId')
+        tenant_id = detail.get('tenantId', 'pardos')
+        etapa = event_stage(detail_type, detail)
+        if not order_id or etapa not in STAGE_SEQUENCE:
+            return {'statusCode': 200, 'body': json.dumps({'message': 'Evento ignorado'})}
+
+        tabla = os.environ['COUNTERS_TABLE']
+        pk = contadores_pk(tenant_id)
+
+        # Cada pedido entra una sola vez a cada etapa: restar de la anterior y sumar a la nueva
+        incrementos = {f"{PREFIJO_ETAPA}{etapa}": 1}
+        anterior = previous_stage(etapa)
+        if anterior:
+            incrementos[f"{PREFIJO_ETAPA}{anterior}"] = -1
+
+        # Marcador de idempotencia: un reintento o duplicado cancela toda la transacción
+        expira = datetime.utcnow() + timedelta(days=CONTADORES_MARCADOR_DIAS)
+        operaciones = [{
+            'Put': {
+                'TableName': tabla,
+                'Item': {'PK': pk, 'SK': f"EVENT#{order_id}#{etapa}", 'ttl': int(expira.timestamp())},
+                'ConditionExpression': 'attribute_not_exists(PK)'
             }
-        )
-        
-        pedidos_hoy = 0
-        for pedido in response.get('Items', []):
-            if pedido.get('createdAt', '').startswith(hoy):
-                pedidos_hoy += 1
-                
-        return pedidos_hoy
+        }]
+        if detail_type == 'OrderCreated':
+            incrementos[ATRIBUTO_TOTAL] = 1
+            for item in detail.get('items', []):
+                if item.get('productId'):
+                    clave = f"{PREFIJO_PRODUCTO}{item['productId']}"
+                    incrementos[clave] = incrementos.get(clave, 0) + int(item.get('qty', 1))
+            fecha = datetime.fromisoformat(detail.get('timestamp') or datetime.utcnow().isoformat()).date()
+            operaciones.append(add_operation(tabla, {'PK': pk, 'SK': contadores_sk_dia(fecha)}, {ATRIBUTO_PEDIDOS_DIA: 1}))
+        operaciones.append(add_operation(tabla, {'PK': pk, 'SK': CONTADORES_SK_TOTAL}, incrementos))
+
+        try:
+            _get_dynamodb().transact_write(operaciones)
+        except Exception as e:
+            if cancellation_reasons(e)[:1] == ['ConditionalCheckFailed']:
+                print(f"Contadores: {order_id}/{etapa} ya aplicado, se ignora el duplicado")
+                return {'statusCode': 200, 'body': json.dumps({'orderId': order_id, 'updated': False})}
+            raise
+
+        return {'statusCode': 200, 'body': json.dumps({'orderId': order_id, 'updated': True})}
     except Exception as e:
-        print(f"Error obteniendo pedidos hoy: {str(e)}")
-        return 0
+        # Se relanza para que EventBridge/Lambda reintenten el evento
+        print(f"Error en actualizar_contadores: {str(e)}")
+        raise
 
-def obtener_pedidos_activos(tenant_id):
-    """Obtiene pedidos activos REALES"""
+def reconstruir_contadores(event, context):
+    """
+    Backfill: recalcula los contadores desde el historial de pedidos y los
+    escribe como valores absolutos. Se invoca a mano (serverless invoke).
+    Los eventos que lleguen mientras corre pueden perderse: correrlo en un
+    momento sin pedidos en curso.
+    """
     try:
-        response = _get_dynamodb().scan(
-            table_name=os.environ['ORDERS_TABLE'],
-            filter_expression='begins_with(PK, :pk) AND SK = :sk',
-            expression_attribute_values={
-                ':pk': f"TENANT#{tenant_id}#ORDER#",
-                ':sk': 'INFO'
-            }
-        )
-        
-        activos = 0
-        estados_activos = ['CREATED', 'COOKING', 'PACKAGING', 'DELIVERY']
-        for pedido in response.get('Items', []):
-            if pedido.get('status') in estados_activos:
-                activos += 1
-                
-        return activos
+        tenant_id = (event or {}).get('tenantId', 'pardos')
+        dias = int((event or {}).get('dias', 3650))
+        agregado = calcular_agregado_pedidos(tenant_id, dias=dias)
+        items = agregado.items_contadores(tenant_id, datetime.utcnow().isoformat())
+        _get_dynamodb().batch_write(os.environ['COUNTERS_TABLE'], puts=items)
+        return {
+            'statusCode': 200,
+            'body': json.dumps({
+                'message': 'Contadores reconstruidos',
+                'totalPedidos': agregado.total,
+                'itemsEscritos': len(items)
+            })
+        }
     except Exception as e:
-        print(f"Error obteniendo pedidos activos: {str(e)}")
-        return 0
+        print(f"Error en reconstruir_contadores: {str(e)}")
+        return {'statusCode': 500, 'body': json.dumps({'error': str(e)})}
 
-def obtener_pedidos_por_estado_real(tenant_id):
-    """Obtiene distribución REAL de pedidos por estado"""
+def obtener_productos_populares(agregado):
+    """Top 3 de productos del agregado, con nombre legible"""
+    return [
+        {'producto': obtener_nombre_producto(product_id), 'cantidad': cantidad}
+        for product_id, cantidad in agregado.productos_populares(3)
+    ]
+
+def leer_sketches_latencia(tenant_id):
+    """
+    Sketches de latencia por etapa y de punta a punta: un solo BatchGetItem
+    de tamaño fijo, sin importar cuántos pedidos haya
+    """
     try:
-        response = _get_dynamodb().scan(
-            table_name=os.environ['ORDERS_TABLE'],
-            filter_expression='begins_with(PK, :pk) AND SK = :sk',
-            expression_attribute_values={
-                ':pk': f"TENANT#{tenant_id}#ORDER#",
-                ':sk': 'INFO'
-            }
+        items = _get_dynamodb().batch_get(
+            os.environ['COUNTERS_TABLE'],
+            [{'PK': latency_pk(tenant_id), 'SK': latency_sk(etapa)} for etapa in ETAPAS_LATENCIA + (ORDER_TOTAL_STAGE,)]
         )
-        
-        distribucion = {'CREATED': 0, 'COOKING': 0, 'PACKAGING': 0, 'DELIVERY': 0, 'DELIVERED': 0, 'COMPLETED': 0}
-        for pedido in response.get('Items', []):
-            estado = pedido.get('status', 'CREATED')
-            distribucion[estado] = distribucion.get(estado, 0) + 1
-            
-        return distribucion
     except Exception as e:
-        print(f"Error obteniendo pedidos por estado: {str(e)}")
-        return {'CREATED': 0, 'COOKING': 0, 'PACKAGING': 0, 'DELIVERY': 0, 'DELIVERED': 0, 'COMPLETED': 0}
+        print(f"Error leyendo sketches de latencia: {str(e)}")
+        return {}
+    return {item['SK'].split('#', 1)[1]: LatencySketch.from_item(item) for item in items}
+
+def resumen_percentiles(sketch):
+    """p50/p90/p99 en minutos (con un decimal) y cantidad de observaciones"""
+    if sketch is None or not sketch.count:
+        return {'count': 0, **{nombre: None for nombre in PERCENTILES}}
+    resumen = {'count': sketch.count}
+    for nombre, q in PERCENTILES.items():
+        resumen[nombre] = round(sketch.quantile(q) / 60, 1)
+    return resumen
 
 def obtener_tiempos_por_etapa_real(tenant_id):
     """Calcula tiempos REALES por etapa"""
     try:
-        response = _get_dynamodb().scan(
+        items = _get_dynamodb().iter_parallel_scan(
             table_name=os.environ['STEPS_TABLE'],
             filter_expression='begins_with(PK, :pk) AND attribute_exists(finishedAt)',
             expression_attribute_values={
@@ -210,7 +365,7 @@ def obtener_tiempos_por_etapa_real(tenant_id):
         
         tiempos = {'COOKING': [], 'PACKAGING': [], 'DELIVERY': []}
         
-        for item in response.get('Items', []):
+        for item in items:
             if item.get('status') == 'COMPLETED' and item.get('finishedAt'):
                 etapa = item.get('stepName')
                 started_at = item.get('startedAt')
@@ -236,90 +391,6 @@ def obtener_tiempos_por_etapa_real(tenant_id):
         print(f"Error obteniendo tiempos por etapa: {str(e)}")
         return {'COOKING': 15, 'PACKAGING': 5, 'DELIVERY': 25}
 
-def obtener_pedidos_ultima_semana_real(tenant_id):
-    """Obtiene pedidos REALES de la última semana"""
-    try:
-        hoy = datetime.utcnow()
-        pedidos_por_dia = [0] * 7  # Últimos 7 días
-        
-        response = _get_dynamodb().scan(
-            table_name=os.environ['ORDERS_TABLE'],
-            filter_expression='begins_with(PK, :pk) AND SK = :sk',
-            expression_attribute_values={
-                ':pk': f"TENANT#{tenant_id}#ORDER#",
-                ':sk': 'INFO'
-            }
-        )
-        
-        pedidos_por_fecha = {}
-        for item in response.get('Items', []):
-            created_at = item.get('createdAt', '')
-            if created_at:
-                try:
-                    fecha = datetime.fromisoformat(created_at.replace('Z', '+00:00')).date()
-                    dias_diff = (hoy.date() - fecha).days
-                    
-                    if 0 <= dias_diff < 7:
-                        order_id = item.get('orderId')
-                        if order_id:
-                            if fecha not in pedidos_por_fecha:
-                                pedidos_por_fecha[fecha] = set()
-                            pedidos_por_fecha[fecha].add(order_id)
-                except:
-                    continue
-        
-        # Organizar por día
-        for i in range(7):
-            fecha = hoy.date() - timedelta(days=i)
-            if fecha in pedidos_por_fecha:
-                pedidos_por_dia[6-i] = len(pedidos_por_fecha[fecha])
-        
-        return pedidos_por_dia
-    except Exception as e:
-        print(f"Error obteniendo pedidos última semana: {str(e)}")
-        return [0, 0, 0, 0, 0, 0, 0]
-
-def obtener_productos_populares_real(tenant_id):
-    """Obtiene productos populares REALES"""
-    try:
-        response = _get_dynamodb().scan(
-            table_name=os.environ['ORDERS_TABLE'],
-            filter_expression='begins_with(PK, :pk) AND SK = :sk',
-            expression_attribute_values={
-                ':pk': f"TENANT#{tenant_id}#ORDER#",
-                ':sk': 'INFO'
-            }
-        )
-        
-        productos_count = {}
-        for pedido in response.get('Items', []):
-            items = pedido.get('items', [])
-            for item in items:
-                product_id = item.get('productId', '')
-                if product_id:
-                    productos_count[product_id] = productos_count.get(product_id, 0) + 1
-        
-        # Convertir a formato de respuesta
-        productos_populares = []
-        for product_id, cantidad in productos_count.items():
-            nombre_producto = obtener_nombre_producto(product_id)
-            productos_populares.append({
-                'producto': nombre_producto,
-                'cantidad': cantidad
-            })
-        
-        # Ordenar por cantidad descendente y tomar top 3
-        productos_populares.sort(key=lambda x: x['cantidad'], reverse=True)
-        return productos_populares[:3]
-        
-    except Exception as e:
-        print(f"Error obteniendo productos populares: {str(e)}")
-        return [
-            {'producto': 'Pollo a la Brasa', 'cantidad': obtener_total_pedidos(tenant_id)},
-            {'producto': 'Chicha Morada', 'cantidad': max(obtener_total_pedidos(tenant_id) - 2, 0)},
-            {'producto': 'Ensalada Fresca', 'cantidad': max(obtener_total_pedidos(tenant_id) - 5, 0)}
-        ]
-
 def obtener_nombre_producto(product_id):
     """Mapea productId a nombre de producto"""
     mapeo_productos = {
@@ -333,94 +404,178 @@ def obtener_nombre_producto(product_id):
     return mapeo_productos.get(product_id, product_id)
 
 def obtener_tiempo_promedio_real(tenant_id):
-    """Calcula tiempo promedio REAL de entrega"""
+    """
+    Calcula tiempo promedio REAL de entrega (minutos) mientras no hay sketch
+    de punta a punta: una sola pasada sobre las etapas que arma, por pedido,
+    el primer inicio y el último fin completado, sin consultas por pedido
+    """
+    def agregar(rangos, etapa):
+        rango = rangos.setdefault(etapa['PK'], {'inicio': None, 'fin': None, 'entregado': False})
+        _ampliar_rango(rango, etapa.get('startedAt'), None)
+        # La etapa DELIVERED se escribe con status DONE, el resto termina en COMPLETED
+        entregado = etapa.get('stepName') == 'DELIVERED'
+        if etapa.get('finishedAt') and (entregado or etapa.get('status') == 'COMPLETED'):
+            _ampliar_rango(rango, None, etapa['finishedAt'])
+            rango['entregado'] = rango['entregado'] or entregado
+        return rangos
+
+    def combinar(rangos, otros):
+        for pk, otro in otros.items():
+            rango = rangos.setdefault(pk, {'inicio': None, 'fin': None, 'entregado': False})
+            _ampliar_rango(rango, otro['inicio'], otro['fin'])
+            rango['entregado'] = rango['entregado'] or otro['entregado']
+        return rangos
+
     try:
-        response = _get_dynamodb().scan(
+        rangos = _get_dynamodb().parallel_scan(
             table_name=os.environ['STEPS_TABLE'],
-            filter_expression='begins_with(PK, :pk) AND stepName = :step AND attribute_exists(finishedAt)',
-            expression_attribute_values={
-                ':pk': f"TENANT#{tenant_id}#ORDER#",
-                ':step': 'DELIVERED'
-            }
+            reducer=agregar,
+            initial=dict,
+            combine=combinar,
+            filter_expression='begins_with(PK, :pk) AND attribute_exists(stepName)',
+            expression_attribute_values={':pk': f"TENANT#{tenant_id}#ORDER#"},
+            expression_names={'#s': 'status'},
+            projection='PK, stepName, #s, startedAt, finishedAt'
         )
-        
+
         tiempos = []
-        for item in response.get('Items', []):
-            if item.get('status') == 'COMPLETED':
-                # Buscar etapas del mismo pedido para calcular tiempo total
-                order_id = item.get('orderId')
-                pedido_tiempo = calcular_tiempo_total_pedido(tenant_id, order_id)
+        for rango in rangos.values():
+            if rango['entregado'] and rango['inicio'] and rango['fin']:
+                pedido_tiempo = calcular_duracion_minutos(rango['inicio'], rango['fin'])
                 if pedido_tiempo > 0:
                     tiempos.append(pedido_tiempo)
-        
+
         return int(sum(tiempos) / len(tiempos)) if tiempos else 45
     except Exception as e:
         print(f"Error calculando tiempo promedio: {str(e)}")
         return 45
 
-def obtener_pedidos_reales(tenant_id, limit=50):
-    """Obtiene lista REAL de pedidos con sus datos REALES"""
-    try:
-        # Obtener todos los pedidos de la tabla ORDERS
-        response = _get_dynamodb().scan(
-            table_name=os.environ['ORDERS_TABLE'],
-            filter_expression='begins_with(PK, :pk) AND SK = :sk',
-            expression_attribute_values={
-                ':pk': f"TENANT#{tenant_id}#ORDER#",
-                ':sk': 'INFO'
-            }
-        )
-        
-        pedidos = response.get('Items', [])
-        
-        # Para cada pedido, obtener sus etapas
-        pedidos_completos = []
-        for pedido in pedidos:
-            order_id = pedido.get('orderId')
-            
-            # Obtener etapas del pedido
-            etapas_response = _get_dynamodb().query(
-                table_name=os.environ['STEPS_TABLE'],
-                key_condition_expression='PK = :pk',
-                expression_attribute_values={
-                    ':pk': f"TENANT#{tenant_id}#ORDER#{order_id}"
-                }
-            )
-            etapas = etapas_response.get('Items', [])
-            
-            pedido_completo = {
-                'orderId': order_id,
-                'customerId': pedido.get('customerId', 'N/A'),
-                'status': pedido.get('status', 'CREATED'),
-                'createdAt': pedido.get('createdAt', ''),
-                'etapas': [],
-                'items': pedido.get('items', []),  # ITEMS REALES del pedido
-                'total': float(pedido.get('total', 0))  # TOTAL REAL del pedido
-            }
-            
-            # Agregar etapas formateadas
-            for etapa in etapas:
-                etapa_info = {
+def _ampliar_rango(rango, inicio, fin):
+    if inicio and (rango['inicio'] is None or inicio < rango['inicio']):
+        rango['inicio'] = inicio
+    if fin and (rango['fin'] is None or fin > rango['fin']):
+        rango['fin'] = fin
+
+def obtener_pedidos_reales(tenant_id, limit=DEFAULT_PEDIDOS_PAGE, cursor=None):
+    """
+    Página de pedidos REALES (más recientes primero) con sus etapas.
+    Devuelve (pedidos, cursor); cursor es None si no hay más páginas.
+    Lanza ValueError si el cursor no es válido.
+    """
+    posicion = decode_cursor(cursor)
+    antes_de = (posicion.get('createdAt', ''), posicion.get('orderId', '')) if posicion else None
+
+    # 1) Query por día sobre el GSI, del día del cursor hacia atrás
+    desde = datetime.utcnow().date() - timedelta(days=PEDIDOS_DIAS_HISTORIAL - 1)
+    seleccion = obtener_pedidos_por_dia(tenant_id, limit + 1, antes_de, desde)
+
+    siguiente = None
+    if len(seleccion) > limit:
+        seleccion = seleccion[:limit]
+        ultimo = seleccion[-1]
+        siguiente = encode_cursor({'createdAt': ultimo.get('createdAt', ''), 'orderId': ultimo.get('orderId', '')})
+    if not seleccion:
+        return [], None
+
+    # 2) Solo para esos K: etapas en paralelo e items completos en lote
+    #    (los que vinieron del GSI ya están completos, proyección ALL)
+    #    Desde un hilo del pool no se espera a otro trabajo del pool: ahí va en línea
+    pks = [item['PK'] for item in seleccion]
+    if in_worker_thread():
+        etapas_por_pedido = [obtener_etapas_pedido(pk) for pk in pks]
+    else:
+        etapas_por_pedido = get_executor().map(obtener_etapas_pedido, pks)  # ya encoladas, se consumen abajo
+    pedidos = {item['PK']: item for item in seleccion if 'items' in item}
+    faltantes = [{'PK': item['PK'], 'SK': 'INFO'} for item in seleccion if item['PK'] not in pedidos]
+    if faltantes:
+        for pedido in _get_dynamodb().batch_get(os.environ['ORDERS_TABLE'], faltantes):
+            pedidos[pedido['PK']] = pedido
+
+    pedidos_completos = []
+    for item, etapas in zip(seleccion, etapas_por_pedido):
+        pedido = pedidos.get(item['PK'])
+        if pedido is None:
+            continue
+        pedidos_completos.append({
+            'orderId': pedido.get('orderId'),
+            'customerId': pedido.get('customerId', 'N/A'),
+            'status': pedido.get('status', 'CREATED'),
+            'createdAt': pedido.get('createdAt', ''),
+            'etapas': [
+                {
                     'stepName': etapa.get('stepName'),
                     'status': etapa.get('status', 'IN_PROGRESS'),
                     'startedAt': etapa.get('startedAt'),
                     'finishedAt': etapa.get('finishedAt')
                 }
-                pedido_completo['etapas'].append(etapa_info)
-            
-            pedidos_completos.append(pedido_completo)
-        
-        # Ordenar por fecha de creación descendente
-        pedidos_completos.sort(key=lambda x: x.get('createdAt', ''), reverse=True)
-        
-        # Aplicar límite
-        pedidos_completos = pedidos_completos[:limit]
-        
-        return pedidos_completos
-        
-    except Exception as e:
-        print(f"Error obteniendo pedidos reales: {str(e)}")
-        return []
+                for etapa in etapas
+            ],
+            'items': pedido.get('items', []),  # ITEMS REALES del pedido
+            'total': float(pedido.get('total', 0))  # TOTAL REAL del pedido
+        })
+
+    return pedidos_completos, siguiente
+
+def obtener_pedidos_por_dia(tenant_id, limite, antes_de, desde):
+    """
+    Hasta `limite` pedidos más recientes con createdAt >= `desde` (fecha),
+    recorriendo las particiones diarias del GSI de la más nueva a la más
+    vieja. Los días se consultan en bloques paralelos que se duplican (1, 2,
+    4... días): una página que sale de hoy cuesta un Query y un historial
+    disperso se recorre en pocas rondas. El costo depende de los días
+    recorridos, nunca de un scan de la tabla.
+    """
+    fecha = datetime.utcnow().date()
+    if antes_de:
+        try:
+            fecha = min(fecha, datetime.fromisoformat(antes_de[0][:10]).date())
+        except ValueError:
+            raise ValueError("Cursor de paginación inválido")
+
+    def pedidos_del_dia(dia):
+        key_condition = 'dayBucket = :bucket'
+        valores = {':bucket': day_bucket(tenant_id, dia)}
+        if antes_de:
+            key_condition += ' AND createdAt <= :antes'
+            valores[':antes'] = antes_de[0]
+        pedidos = []
+        for pedido in _get_dynamodb().iter_query(
+            table_name=os.environ['ORDERS_TABLE'],
+            index_name=ORDER_DAY_INDEX,
+            key_condition_expression=key_condition,
+            expression_attribute_values=valores,
+            scan_index_forward=False,
+            page_size=limite
+        ):
+            # Empates de createdAt con el cursor: se desempata por orderId
+            if antes_de and (pedido.get('createdAt', ''), pedido.get('orderId', '')) >= antes_de:
+                continue
+            pedidos.append(pedido)
+            if len(pedidos) == limite:
+                break
+        return pedidos
+
+    pedidos, bloque = [], 1
+    while fecha >= desde and len(pedidos) < limite:
+        dias = [fecha - timedelta(days=i) for i in range(min(bloque, (fecha - desde).days + 1))]
+        # Desde un hilo del pool no se espera a otro trabajo del pool: ahí va en línea
+        if len(dias) == 1 or in_worker_thread():
+            por_dia = [pedidos_del_dia(dia) for dia in dias]
+        else:
+            por_dia = get_executor().map(pedidos_del_dia, dias)
+        for pedidos_dia in por_dia:
+            pedidos.extend(pedidos_dia[:limite - len(pedidos)])
+        fecha -= timedelta(days=len(dias))
+        bloque = min(bloque * 2, PEDIDOS_DIAS_BLOQUE_MAX)
+    return pedidos
+
+def obtener_etapas_pedido(order_pk):
+    """Etapas (STEPS_TABLE) de un pedido"""
+    return list(_get_dynamodb().iter_query(
+        table_name=os.environ['STEPS_TABLE'],
+        key_condition_expression='PK = :pk',
+        expression_attribute_values={':pk': order_pk}
+    ))
 
 def calcular_duracion_minutos(inicio, fin):
     """Calcula duración en minutos entre dos timestamps"""
@@ -428,51 +583,6 @@ def calcular_duracion_minutos(inicio, fin):
     end = datetime.fromisoformat(fin.replace('Z', '+00:00'))
     return int((end - start).total_seconds() / 60)
 
-def calcular_tiempo_total_pedido(tenant_id, order_id):
-    """Calcula tiempo total de un pedido desde creación hasta entrega"""
-    try:
-        # Obtener pedido
-        pedido_response = _get_dynamodb().get_item(
-            table_name=os.environ['ORDERS_TABLE'],
-            key={
-                'PK': f"TENANT#{tenant_id}#ORDER#{order_id}",
-                'SK': 'INFO'
-            }
-        )
-        pedido = pedido_response.get('Item', {})
-        
-        # Obtener todas las etapas
-        etapas_response = _get_dynamodb().query(
-            table_name=os.environ['STEPS_TABLE'],
-            key_condition_expression='PK = :pk',
-            expression_attribute_values={
-                ':pk': f"TENANT#{tenant_id}#ORDER#{order_id}"
-            }
-        )
-        etapas = etapas_response.get('Items', [])
-        
-        if not pedido or not etapas:
-            return 0
-        
-        # Encontrar primera y última etapa
-        primera_etapa = min(etapas, key=lambda x: x.get('startedAt', ''))
-        ultima_etapa_completada = None
-        
-        for etapa in etapas:
-            if etapa.get('status') == 'COMPLETED' and etapa.get('finishedAt'):
-                if not ultima_etapa_completada or etapa.get('finishedAt') > ultima_etapa_completada.get('finishedAt', ''):
-                    ultima_etapa_completada = etapa
-        
-        if primera_etapa.get('startedAt') and ultima_etapa_completada and ultima_etapa_completada.get('finishedAt'):
-            return calcular_duracion_minutos(primera_etapa['startedAt'], ultima_etapa_completada['finishedAt'])
-        
-        return 0
-    except Exception as e:
-        print(f"Error calculando tiempo total pedido: {str(e)}")
-        return 0
-                                     
-
-
 def calcular_duracion(inicio, fin):
     start = datetime.fromisoformat(inicio.replace('Z', '+00:00'))
     end = datetime.fromisoformat(fin.replace('Z', '+00:00'))
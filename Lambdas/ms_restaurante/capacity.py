@@ -0,0 +1,322 @@
+import json
+import os
+import random
+import time
+import uuid
+from datetime import datetime, timedelta
+
+try:
+    from shared.clients import get_client
+    from shared.database import DynamoDB, cancellation_reasons, is_conditional_check_failed
+    from shared.orders import DEFAULT_STORE_ID
+except ImportError:
+    from Lambdas.shared.clients import get_client
+    from Lambdas.shared.database import DynamoDB, cancellation_reasons, is_conditional_check_failed
+    from Lambdas.shared.orders import DEFAULT_STORE_ID
+
+# Capacidad por defecto (entregas simultáneas). Se puede fijar por tenant con
+# DELIVERY_CAPACITY_BY_TENANT='{"pardos": 5}' y por local con set_capacity.
+DEFAULT_DELIVERY_CAPACITY = int(os.environ.get('DELIVERY_CAPACITY', 5))
+
+CAPACITY_SK = 'DELIVERY_CAPACITY'
+SLOT_SK = 'DELIVERY_SLOT'
+CAPACITY_MAX_ATTEMPTS = 5
+
+# Una reserva que sigue tomada pasado este tiempo se da por perdida (workflow
+# caído o cancelado) y la libera sweep_delivery_reservations
+RESERVATION_TIMEOUT = int(os.environ.get('DELIVERY_RESERVATION_TIMEOUT', 21600))
+RESERVATIONS_INDEX = 'status-expiresAt-index'
+RESERVED_STATUS = 'RESERVED'
+
+
+def default_capacity(tenant_id):
+    by_tenant = json.loads(os.environ.get('DELIVERY_CAPACITY_BY_TENANT') or '{}')
+    return int(by_tenant.get(tenant_id, DEFAULT_DELIVERY_CAPACITY))
+
+
+def semaphore_key(tenant_id, store_id):
+    return {'PK': f"TENANT#{tenant_id}#STORE#{store_id}", 'SK': CAPACITY_SK}
+
+
+def queue_pk(tenant_id, store_id):
+    return f"TENANT#{tenant_id}#STORE#{store_id}#DELIVERY_QUEUE"
+
+
+def queue_sk(arrived_at, order_id):
+    # Ordena por llegada del pedido; el orderId desempata y hace la clave determinística
+    return f"{arrived_at}#{order_id}"
+
+
+def slot_key(order_id):
+    # Mismo PK que los tokens del pedido (ORDER#<id>) en STEPS_TABLE
+    return {'PK': f"ORDER#{order_id}", 'SK': SLOT_SK}
+
+
+def wake_waiting_order(entry):
+    """
+    Completa el task token de un pedido que esperaba capacidad, con su reserva.
+    False si el token ya no sirve (ejecución vencida o cancelada).
+    """
+    try:
+        get_client('stepfunctions').send_task_success(
+            taskToken=entry['taskToken'],
+            output=json.dumps({
+                "canProceed": True,
+                "message": "Capacidad disponible para delivery",
+                "storeId": entry['storeId'],
+                "reservationId": entry.get('reservationId'),
+                "waitingSince": entry.get('enqueuedAt'),
+                "reservedAt": datetime.now().isoformat()
+            })
+        )
+        return True
+    except Exception as e:
+        code = (getattr(e, 'response', None) or {}).get('Error', {}).get('Code')
+        if code in ('TaskTimedOut', 'TaskDoesNotExist', 'InvalidToken'):
+            print(f"Token de {entry['orderId']} ya no es válido ({code}), se pasa al siguiente")
+            return False
+        raise
+
+
+class DeliveryCapacity:
+    """
+    Semáforo de capacidad de delivery en STEPS_TABLE.
+
+    Un item por tenant y local lleva `inUse` y `capacity`; cada pedido que
+    obtiene lugar deja además un item DELIVERY_SLOT. Tomar y liberar son una
+    sola TransactWriteItems que mueve el contador y el item del pedido a la
+    vez, con condiciones que hacen las dos operaciones exactas e idempotentes:
+    reintentar un despacho o un release para el mismo pedido no cuenta dos veces.
+
+    Los pedidos esperan en una cola FIFO por local (una partición ordenada
+    por hora de llegada). `dispatch` toma la cabeza mientras haya capacidad:
+    reserva su lugar y saca la entrada en la misma transacción, y recién
+    entonces despierta su task token.
+    """
+
+    def __init__(self, db=None):
+        self.db = db or DynamoDB()
+        self.table_name = os.environ['STEPS_TABLE']
+
+    def release(self, order_id, reservation_id=None):
+        """
+        Libera el lugar del pedido y devuelve su item DELIVERY_SLOT (tenantId,
+        storeId), o None si no tenía (ya liberado o nunca reservado). Con
+        `reservation_id` solo se libera esa reserva exacta: un release tardío
+        no puede soltar una reserva más nueva del mismo pedido.
+        """
+        slot = self.db.get_item(self.table_name, slot_key(order_id), consistent_read=True).get('Item')
+        if not slot or (reservation_id and slot.get('reservationId') != reservation_id):
+            return None
+        delete = {'TableName': self.table_name, 'Key': slot_key(order_id)}
+        if slot.get('reservationId'):
+            delete['ConditionExpression'] = 'reservationId = :rid'
+            delete['ExpressionAttributeValues'] = {':rid': slot['reservationId']}
+        else:
+            delete['ConditionExpression'] = 'attribute_exists(PK)'
+        operations = [
+            {'Delete': delete},
+            {
+                'Update': {
+                    'TableName': self.table_name,
+                    'Key': semaphore_key(slot['tenantId'], slot['storeId']),
+                    'UpdateExpression': 'SET inUse = inUse - :one',
+                    'ConditionExpression': 'inUse > :zero',
+                    'ExpressionAttributeValues': {':zero': 0, ':one': 1}
+                }
+            }
+        ]
+        reasons = self._transact(operations)
+        if not reasons:
+            return slot
+        if reasons[0] == 'ConditionalCheckFailed':
+            return None  # Otro release se adelantó
+        # Contador ya en 0 (ajuste manual): solo se borra el lugar del pedido
+        self.db.delete_item(self.table_name, slot_key(order_id),
+                            condition_expression=delete['ConditionExpression'],
+                            expression_values=delete.get('ExpressionAttributeValues'))
+        return slot
+
+    def enqueue(self, tenant_id, store_id, order_id, task_token, arrived_at, expires_at):
+        """
+        Pone al pedido en la cola de su local. La clave depende solo del pedido,
+        así que volver a encolarlo (reintento del workflow) conserva su lugar y
+        solo reemplaza el token.
+        """
+        self.db.put_item(self.table_name, {
+            'PK': queue_pk(tenant_id, store_id),
+            'SK': queue_sk(arrived_at, order_id),
+            'taskToken': task_token,
+            'orderId': order_id,
+            'tenantId': tenant_id,
+            'storeId': store_id,
+            'status': 'WAITING_CAPACITY',
+            'arrivedAt': arrived_at,
+            'enqueuedAt': datetime.utcnow().isoformat(),
+            'expiresAt': expires_at.isoformat(),
+            'ttl': int(expires_at.timestamp())
+        })
+
+    def queue_position(self, tenant_id, store_id, arrived_at, order_id):
+        """Cantidad de pedidos que esperan antes que este (1 = cabeza)"""
+        return 1 + self.db.count_query(
+            self.table_name,
+            'PK = :pk AND SK < :sk',
+            {':pk': queue_pk(tenant_id, store_id), ':sk': queue_sk(arrived_at, order_id)}
+        )
+
+    def dispatch(self, tenant_id, store_id, wake):
+        """
+        Despierta pedidos de la cola en orden de llegada mientras haya capacidad.
+        `wake(entry)` envía el task token y devuelve False si ya no es válido
+        (ejecución vencida o cancelada): en ese caso se devuelve el lugar y se
+        sigue con el próximo. Devuelve cuántos pedidos despertó.
+        """
+        woken = 0
+        while True:
+            head = next(iter(self.db.iter_query(
+                self.table_name,
+                'PK = :pk',
+                {':pk': queue_pk(tenant_id, store_id)},
+                max_items=1,
+                consistent_read=True
+            )), None)
+            if head is None:
+                return woken
+            claimed = self._claim(head)
+            if claimed is None:
+                return woken  # Sin capacidad: el próximo release vuelve a despachar
+            if not claimed:
+                continue  # Otro despacho concurrente se la llevó
+            try:
+                accepted = wake(head)
+            except Exception:
+                # Error inesperado: se devuelve el lugar y el pedido vuelve a la cola
+                reservation_id = head.pop('reservationId', None)
+                self.release(head['orderId'], reservation_id)
+                self.db.put_item(self.table_name, head)
+                raise
+            if accepted:
+                woken += 1
+            else:
+                self.release(head['orderId'], head.get('reservationId'))
+
+    def _claim(self, entry):
+        """
+        Reserva lugar para la cabeza de la cola y la saca, todo en una transacción.
+        True si este llamador la tomó, False si otro se adelantó, None si no hay capacidad.
+        """
+        order_id, tenant_id, store_id = entry['orderId'], entry['tenantId'], entry['storeId']
+        entry_key = {'PK': entry['PK'], 'SK': entry['SK']}
+        entry['reservationId'] = str(uuid.uuid4())
+        operations = self._acquire_operations(tenant_id, store_id, order_id, entry['reservationId']) + [{
+            'Delete': {
+                'TableName': self.table_name,
+                'Key': entry_key,
+                'ConditionExpression': 'attribute_exists(PK)'
+            }
+        }]
+        reasons = self._transact(operations)
+        if not reasons:
+            return True
+        if reasons[2] == 'ConditionalCheckFailed':
+            return False
+        if reasons[1] == 'ConditionalCheckFailed':
+            # El pedido ya tenía lugar (p. ej. un despacho anterior): solo se saca de la cola
+            slot = self.db.get_item(self.table_name, slot_key(order_id), consistent_read=True).get('Item') or {}
+            entry['reservationId'] = slot.get('reservationId')
+            try:
+                self.db.delete_item(self.table_name, entry_key, condition_expression='attribute_exists(PK)')
+            except Exception as e:
+                if is_conditional_check_failed(e):
+                    return False
+                raise
+            return True
+        return None
+
+    def expired_reservations(self, now=None, page_size=100):
+        """Reservas vencidas (expiresAt < now) vía el GSI status-expiresAt, sin scan"""
+        return self.db.iter_query(
+            self.table_name,
+            '#s = :status AND expiresAt < :now',
+            {':status': RESERVED_STATUS, ':now': (now or datetime.utcnow()).isoformat()},
+            expression_names={'#s': 'status'},
+            index_name=RESERVATIONS_INDEX,
+            page_size=page_size
+        )
+
+    def status(self, tenant_id, store_id):
+        item = self.db.get_item(self.table_name, semaphore_key(tenant_id, store_id)).get('Item') or {}
+        return {
+            'inUse': int(item.get('inUse', 0)),
+            'capacity': int(item.get('capacity', default_capacity(tenant_id)))
+        }
+
+    def set_capacity(self, tenant_id, store_id, capacity):
+        """Fija la capacidad de un local; los lugares ya tomados se respetan"""
+        self.db.update_item(
+            self.table_name,
+            semaphore_key(tenant_id, store_id),
+            'SET #cap = :capacity, inUse = if_not_exists(inUse, :zero), tenantId = :tenant, storeId = :store',
+            {':capacity': int(capacity), ':zero': 0, ':tenant': tenant_id, ':store': store_id},
+            {'#cap': 'capacity'}  # palabra reservada en DynamoDB
+        )
+        return self.status(tenant_id, store_id)
+
+    def _acquire_operations(self, tenant_id, store_id, order_id, reservation_id):
+        # [0] sube inUse si hay lugar, [1] crea el DELIVERY_SLOT del pedido si no existe
+        now = datetime.utcnow()
+        return [
+            {
+                'Update': {
+                    'TableName': self.table_name,
+                    'Key': semaphore_key(tenant_id, store_id),
+                    'UpdateExpression': 'SET inUse = if_not_exists(inUse, :zero) + :one, '
+                                        '#cap = if_not_exists(#cap, :default), '
+                                        'tenantId = :tenant, storeId = :store',
+                    'ConditionExpression': 'attribute_not_exists(inUse) OR inUse < #cap',
+                    'ExpressionAttributeNames': {'#cap': 'capacity'},
+                    'ExpressionAttributeValues': {
+                        ':zero': 0,
+                        ':one': 1,
+                        ':default': default_capacity(tenant_id),
+                        ':tenant': tenant_id,
+                        ':store': store_id
+                    }
+                }
+            },
+            {
+                'Put': {
+                    'TableName': self.table_name,
+                    'Item': {
+                        **slot_key(order_id),
+                        'orderId': order_id,
+                        'tenantId': tenant_id,
+                        'storeId': store_id,
+                        'reservationId': reservation_id,
+                        'status': RESERVED_STATUS,
+                        'reservedAt': now.isoformat(),
+                        'expiresAt': (now + timedelta(seconds=RESERVATION_TIMEOUT)).isoformat()
+                    },
+                    'ConditionExpression': 'attribute_not_exists(PK)'
+                }
+            }
+        ]
+
+    def _transact(self, operations):
+        """
+        Aplica la transacción reintentando los conflictos con otras transacciones.
+        Devuelve [] si se aplicó, o los motivos por operación si falló una condición.
+        """
+        for attempt in range(CAPACITY_MAX_ATTEMPTS):
+            try:
+                self.db.transact_write(operations)
+                return []
+            except Exception as e:
+                reasons = cancellation_reasons(e)
+                if 'ConditionalCheckFailed' in reasons:
+                    return reasons
+                if 'TransactionConflict' not in reasons:
+                    raise
+                time.sleep(random.uniform(0, 0.05 * (2 ** attempt)))
+        raise RuntimeError("Capacidad de delivery: conflicto persistente entre transacciones")
@@ -1,26 +1,37 @@
 import json
-import uuid
 import os
-from datetime import datetime
+from datetime import datetime, timedelta
 from decimal import Decimal
 from boto3.dynamodb.conditions import Key
 import sys
 sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
 
 try:
-    from shared.database import DynamoDB
-    from shared.events import EventBridge
+    from shared.clients import get_client, get_executor, get_table
+    from shared.database import DynamoDB, cancellation_reasons, is_conditional_check_failed
+    from shared.events import EventBridge, flush_events
+    from shared.orders import STAGE_SEQUENCE, previous_stage
+    from shared.outbox import outbox_item, publish_outbox
+    from ms_restaurante.capacity import DEFAULT_STORE_ID, DeliveryCapacity, wake_waiting_order
+    from ms_restaurante.kitchen import CONFIRMED, KitchenScheduler
 except ImportError:
-    from Lambdas.shared.database import DynamoDB
-    from Lambdas.shared.events import EventBridge
+    from Lambdas.shared.clients import get_client, get_executor, get_table
+    from Lambdas.shared.database import DynamoDB, cancellation_reasons, is_conditional_check_failed
+    from Lambdas.shared.events import EventBridge, flush_events
+    from Lambdas.shared.orders import STAGE_SEQUENCE, previous_stage
+    from Lambdas.shared.outbox import outbox_item, publish_outbox
+    from Lambdas.ms_restaurante.capacity import DEFAULT_STORE_ID, DeliveryCapacity, wake_waiting_order
+    from Lambdas.ms_restaurante.kitchen import CONFIRMED, KitchenScheduler
 
 STAGE_CONFIRMATION_TIMEOUT = int(os.environ.get('STAGE_CONFIRMATION_TIMEOUT', 86400))
-MAX_DELIVERY_CAPACITY = 5  # Máximo 5 entregas simultáneas
+DELIVERY_CAPACITY_TIMEOUT = int(os.environ.get('DELIVERY_CAPACITY_TIMEOUT', 3600))
+MAX_BULK_CONFIRMATIONS = 100
 
 # Inicialización lazy: No crear globales en import time
 dynamodb = None
 events = None
-sqs_client = None
+capacity = None
+kitchen = None
 
 def _get_dynamodb():
     global dynamodb
@@ -31,16 +42,29 @@ def _get_dynamodb():
 def _get_events():
     global events
     if events is None:
-        events = EventBridge()
+        # Buffered: los eventos de la invocación salen juntos al terminar (flush_events)
+        events = EventBridge(buffered=True)
     return events
 
-def _get_sqs():
-    global sqs_client
-    if sqs_client is None:
-        import boto3
-        sqs_client = boto3.client('sqs')
-    return sqs_client
+def _get_capacity():
+    global capacity
+    if capacity is None:
+        capacity = DeliveryCapacity(_get_dynamodb())
+    return capacity
 
+def _get_kitchen():
+    global kitchen
+    if kitchen is None:
+        kitchen = KitchenScheduler(_get_dynamodb())
+    return kitchen
+
+def _get_stepfunctions():
+    return get_client('stepfunctions')
+
+def _get_steps_table():
+    return get_table(os.environ['STEPS_TABLE'])
+
+@flush_events(_get_events)
 def wait_stage_confirmation(event, context):
     """
     Espera confirmación manual de una etapa usando Task Token
@@ -58,7 +82,7 @@ def wait_stage_confirmation(event, context):
         current_time = datetime.now()
         expiration_time = current_time + timedelta(seconds=STAGE_CONFIRMATION_TIMEOUT)
         
-        steps_table.put_item(Item={
+        _get_steps_table().put_item(Item={
             'PK': f'ORDER#{order_id}',
             'SK': f'TOKEN#{stage}',
             'taskToken': task_token,
@@ -72,22 +96,16 @@ def wait_stage_confirmation(event, context):
         })
         
         # Publicar evento de espera de confirmación
-        eventbridge = _get_events()
-        eventbridge.put_events(
-            Entries=[
-                {
-                    'Source': 'pardos.stepfunctions',
-                    'DetailType': 'StageConfirmationPending',
-                    'EventBusName': os.environ['EVENT_BUS_NAME'],
-                    'Detail': json.dumps({
-                        'orderId': order_id,
-                        'stage': stage,
-                        'tenantId': tenant_id,
-                        'timestamp': current_time.isoformat(),
-                        'timeout': STAGE_CONFIRMATION_TIMEOUT
-                    })
-                }
-            ]
+        _get_events().publish_event(
+            source='pardos.stepfunctions',
+            detail_type='StageConfirmationPending',
+            detail={
+                'orderId': order_id,
+                'stage': stage,
+                'tenantId': tenant_id,
+                'timestamp': current_time.isoformat(),
+                'timeout': STAGE_CONFIRMATION_TIMEOUT
+            }
         )
         
         return {
@@ -101,7 +119,7 @@ def wait_stage_confirmation(event, context):
     except Exception as e:
         # Si hay error, notificar a Step Functions
         if 'taskToken' in event:
-            stepfunctions.send_task_failure(
+            _get_stepfunctions().send_task_failure(
                 taskToken=event['taskToken'],
                 error=str(type(e).__name__),
                 cause=str(e)
@@ -120,81 +138,59 @@ def wait_delivery_capacity(event, context):
         if not task_token:
             raise ValueError("Task Token es requerido")
         
-        # Verificar capacidad actual en la cola
-        queue_attributes = sqs.get_queue_attributes(
-            QueueUrl=delivery_queue_url,
-            AttributeNames=['ApproximateNumberOfMessages', 'ApproximateNumberOfMessagesNotVisible']
-        )
-        
-        messages_in_flight = int(queue_attributes['Attributes'].get('ApproximateNumberOfMessagesNotVisible', 0))
-        
-        # Si hay capacidad disponible
-        if messages_in_flight < MAX_DELIVERY_CAPACITY:
-            # Reservar un slot
-            message_id = str(uuid.uuid4())
-            sqs.send_message(
-                QueueUrl=delivery_queue_url,
-                MessageBody=json.dumps({
-                    'orderId': order_id,
-                    'tenantId': tenant_id,
-                    'action': 'RESERVE_DELIVERY_SLOT',
-                    'timestamp': datetime.now().isoformat()
-                }),
-                MessageGroupId='delivery-capacity',
-                MessageDeduplicationId=message_id
-            )
-            
-            # Notificar éxito inmediato
-            stepfunctions.send_task_success(
-                taskToken=task_token,
-                output=json.dumps({
-                    "canProceed": True,
-                    "message": "Capacidad disponible para delivery",
-                    "queuePosition": messages_in_flight + 1,
-                    "reservedAt": datetime.now().isoformat()
-                })
-            )
-            
+        delivery_capacity = _get_capacity()
+
+        # Todos los pedidos pasan por la cola FIFO del local (orden de llegada del
+        # pedido) y el despacho despierta a la cabeza mientras haya capacidad.
+        # El local sale del pedido: el estado del workflow no lo conserva hasta acá
+        # (las esperas de confirmación reemplazan el estado con su salida)
+        pedido = _get_dynamodb().get_item(
+            os.environ['ORDERS_TABLE'],
+            {'PK': f"TENANT#{tenant_id}#ORDER#{order_id}", 'SK': 'INFO'}
+        ).get('Item') or {}
+        store_id = pedido.get('storeId') or DEFAULT_STORE_ID
+        arrived_at = pedido.get('createdAt') or datetime.utcnow().isoformat()
+        expiration_time = datetime.now() + timedelta(seconds=DELIVERY_CAPACITY_TIMEOUT)
+        delivery_capacity.enqueue(tenant_id, store_id, order_id, task_token, arrived_at, expiration_time)
+
+        woken = []
+
+        def wake(entry):
+            accepted = wake_waiting_order(entry)
+            if accepted:
+                woken.append(entry['orderId'])
+            return accepted
+
+        try:
+            delivery_capacity.dispatch(tenant_id, store_id, wake)
+        except Exception as e:
+            # El pedido ya quedó en la cola: lo despierta el próximo release
+            print(f"Error despachando la cola de {store_id}: {str(e)}")
+        if order_id in woken:
             return {
                 "status": "CAPACITY_AVAILABLE",
                 "canProceed": True
             }
-        else:
-            # Guardar token para notificación cuando haya capacidad
-            current_time = datetime.now()
-            expiration_time = current_time + timedelta(hours=1)
-            
-            steps_table.put_item(Item={
-                'PK': f'ORDER#{order_id}',
-                'SK': f'DELIVERY_CAPACITY_TOKEN',
-                'taskToken': task_token,
-                'orderId': order_id,
-                'tenantId': tenant_id,
-                'status': 'WAITING_CAPACITY',
-                'createdAt': current_time.isoformat(),
-                'expiresAt': expiration_time.isoformat(),
-                'ttl': int(expiration_time.timestamp())
-            })
-            
-            # Enviar heartbeat para mantener vivo el token
-            stepfunctions.send_task_heartbeat(taskToken=task_token)
-            
-            return {
-                "status": "WAITING_CAPACITY",
-                "canProceed": False,
-                "message": f"Esperando capacidad. {messages_in_flight}/{MAX_DELIVERY_CAPACITY} slots ocupados",
-                "queuePosition": messages_in_flight + 1
-            }
+        
+        ocupacion = delivery_capacity.status(tenant_id, store_id)
+        position = delivery_capacity.queue_position(tenant_id, store_id, arrived_at, order_id)
+        return {
+            "status": "WAITING_CAPACITY",
+            "canProceed": False,
+            "message": f"Esperando capacidad. {ocupacion['inUse']}/{ocupacion['capacity']} slots ocupados",
+            "queuePosition": position
+        }
             
     except Exception as e:
         if 'taskToken' in event:
-            stepfunctions.send_task_failure(
+            _get_stepfunctions().send_task_failure(
                 taskToken=event['taskToken'],
                 error=str(type(e).__name__),
                 cause=str(e)
             )
         raise e
 
+@flush_events(_get_events)
 def process_cooking(event, context):
     try:
         order_id = event.get('detail', {}).get('orderId') or event.get('orderId')
@@ -205,6 +201,7 @@ def process_cooking(event, context):
         print(f"Error en process_cooking: {str(e)}")
         raise
 
+@flush_events(_get_events)
 def process_packaging(event, context):
     try:
         order_id = event.get('orderId')
@@ -215,16 +212,21 @@ def process_packaging(event, context):
         print(f"Error en process_packaging: {str(e)}")
         raise
 
+@flush_events(_get_events)
 def process_delivery(event, context):
     try:
         order_id = event.get('orderId')
         tenant_id = event.get('tenantId', 'pardos')
-        _update_step(order_id, tenant_id, 'DELIVERY', 'IN_PROGRESS')
+        # La reserva de capacidad queda en el step DELIVERY: process_delivered libera esa misma
+        reservation_id = (event.get('deliveryCapacity') or {}).get('reservationId')
+        _update_step(order_id, tenant_id, 'DELIVERY', 'IN_PROGRESS',
+                     attributes={'reservationId': reservation_id} if reservation_id else None)
         return {'orderId': order_id,  'tenantId': tenant_id,'stage': 'DELIVERY'}
     except Exception as e:
         print(f"Error en process_delivery: {str(e)}")
         raise
 
+@flush_events(_get_events)
 def process_delivered(event, context):
     try:
         order_id = event.get('orderId')
@@ -234,164 +236,49 @@ def process_delivered(event, context):
         
         print(f"🎯 Procesando entrega para orden {order_id}")
         
-        # 1. Actualizar el estado del pedido a DELIVERED
-        _get_dynamodb().update_item(
-            table_name=os.environ['ORDERS_TABLE'],
-            key={
+        # 1. Pedido a DELIVERED + etapa DELIVERED + outbox del evento en una sola
+        #    transacción; el evento se publica desde el outbox después del commit
+        _commit_transition(
+            order_id, tenant_id, 'DELIVERED', 'COMPLETED',
+            step_record={
                 'PK': pk,
-                'SK': 'INFO'
-            },
-            update_expression="SET currentStep = :step, #s = :status, updatedAt = :now",
-            expression_names={'#s': 'status'},
-            expression_values={
-                ':step': 'DELIVERED',
-                ':status': 'COMPLETED',
-                ':now': timestamp
-            }
-        )
-        
-        # 2. Registrar etapa DELIVERED
-        step_record = {
-            'PK': pk,
-            'SK': f"STEP#DELIVERED#{timestamp}",
-            'stepName': 'DELIVERED',
-            'status': 'DONE',
-            'startedAt': timestamp,
-            'finishedAt': timestamp,
-            'tenantId': tenant_id,
-            'orderId': order_id
-        }
-        _get_dynamodb().put_item(os.environ['STEPS_TABLE'], step_record)
-        
-        # 3. Publicar evento
-        _get_events().publish_event(
-            source="pardos.etapas",
-            detail_type="OrderDelivered",
-            detail={
-                'orderId': order_id,
+                'SK': f"STEP#DELIVERED#{timestamp}",
+                'stepName': 'DELIVERED',
+                'status': 'DONE',
+                'startedAt': timestamp,
+                'finishedAt': timestamp,
                 'tenantId': tenant_id,
-                'stage': 'DELIVERED',
-                'timestamp': timestamp
+                'orderId': order_id
+            },
+            event={
+                'source': "pardos.etapas",
+                'detail_type': "OrderDelivered",
+                'detail': {
+                    'orderId': order_id,
+                    'tenantId': tenant_id,
+                    'stage': 'DELIVERED',
+                    'sequence': STAGE_SEQUENCE['DELIVERED'],
+                    'timestamp': timestamp
+                }
             }
         )
         
-        # 4. REMOVER DE LA COLA SQS - VERSIÓN MEJORADA
-        print(f"🔄 Intentando remover orden {order_id} de SQS")
-        sqs = _get_sqs()
-        queue_url = os.environ['DELIVERY_QUEUE_URL']
-        
-        removed = False
-        max_attempts = 3
-        
-        for attempt in range(max_attempts):
-            try:
-                print(f"   Intento {attempt + 1} de {max_attempts}")
-                
-                # Buscar mensajes que contengan este orderId
-                response = sqs.receive_message(
-                    QueueUrl=queue_url,
-                    MaxNumberOfMessages=10,
-                    VisibilityTimeout=10,
-                    WaitTimeSeconds=0,
-                    MessageAttributeNames=['All']
-                )
-                
-                if 'Messages' in response:
-                    for message in response['Messages']:
-                        try:
-                            message_body = json.loads(message['Body'])
-                            print(f"   Mensaje encontrado: {message_body.get('orderId')}")
-                            
-                            if message_body.get('orderId') == order_id:
-                                # Eliminar el mensaje de la cola
-                                sqs.delete_message(
-                                    QueueUrl=queue_url,
-                                    ReceiptHandle=message['ReceiptHandle']
-                                )
-                                print(f"✅✅✅ MENSAJE REMOVIDO de SQS para orden {order_id}")
-                                removed = True
-                                break
-                        except json.JSONDecodeError:
-                            print(f"   ⚠️ Mensaje con formato inválido: {message['Body'][:50]}...")
-                            continue
-                
-                if removed:
-                    break
-                    
-            except Exception as e:
-                print(f"   ⚠️ Error en intento {attempt + 1}: {str(e)}")
-                continue
-        
-        if not removed:
-            print(f"⚠️ No se pudo encontrar/remover mensaje para orden {order_id} en SQS")
-            print(f"   Esto puede ser normal si el mensaje ya fue procesado o expiró")
-        
-        # 5. También verificar si hay mensajes viejos que limpiar
-        try:
-            clean_old_messages_from_queue(sqs, queue_url)
-        except Exception as e:
-            print(f"⚠️ Error en limpieza adicional: {str(e)}")
+        # 2. Liberar exactamente la reserva registrada en el step DELIVERY (O(1)) y despertar al siguiente
+        released = _release_and_dispatch(order_id, _delivery_reservation_id(pk))
+        if not released:
+            print(f"⚠️ La orden {order_id} no tenía capacidad reservada (ya liberada)")
         
         return {
             'orderId': order_id, 
             'tenantId': tenant_id, 
             'stage': 'DELIVERED',
-            'sqsRemoved': removed
+            'capacityReleased': released
         }
         
     except Exception as e:
         print(f"❌ Error en process_delivered: {str(e)}")
         raise
 
-def clean_old_messages_from_queue(sqs, queue_url, max_age_minutes=30):
-    """
-    Limpia mensajes antiguos de la cola
-    """
-    try:
-        print("🧹 Limpiando mensajes antiguos de SQS...")
-        
-        response = sqs.receive_message(
-            QueueUrl=queue_url,
-            MaxNumberOfMessages=10,
-            VisibilityTimeout=5,
-            WaitTimeSeconds=0
-        )
-        
-        if 'Messages' not in response:
-            print("   No hay mensajes para limpiar")
-            return 0
-        
-        cleaned = 0
-        current_time = datetime.utcnow()
-        
-        for message in response['Messages']:
-            try:
-                message_body = json.loads(message['Body'])
-                added_time_str = message_body.get('addedToQueueAt')
-                
-                if added_time_str:
-                    added_time = datetime.fromisoformat(added_time_str.replace('Z', '+00:00'))
-                    age_minutes = (current_time - added_time).total_seconds() / 60
-                    
-                    if age_minutes > max_age_minutes:
-                        sqs.delete_message(
-                            QueueUrl=queue_url,
-                            ReceiptHandle=message['ReceiptHandle']
-                        )
-                        cleaned += 1
-                        print(f"   🗑️ Mensaje antiguo removido ({age_minutes:.1f} minutos)")
-                        
-            except Exception as e:
-                print(f"   ⚠️ Error procesando mensaje: {str(e)}")
-                continue
-        
-        print(f"   Total limpiado: {cleaned} mensajes antiguos")
-        return cleaned
-        
-    except Exception as e:
-        print(f"⚠️ Error en clean_old_messages_from_queue: {str(e)}")
-        return 0
-
 # ==============================================
 # NUEVAS FUNCIONES PARA STEP FUNCTIONS MEJORADO
 # ==============================================
@@ -403,55 +290,135 @@ def release_delivery_capacity(event, context):
     try:
         order_id = event['pathParameters']['orderId']
         
-        # Eliminar mensaje de la cola (liberar capacidad)
-        sqs.purge_queue(QueueUrl=delivery_queue_url)
+        # Liberar solo el lugar de este pedido y despertar al siguiente en la cola
+        released = _release_and_dispatch(order_id)
         
-        # Buscar tokens de capacidad pendientes
-        response = steps_table.query(
-            KeyConditionExpression='PK = :pk AND begins_with(SK, :sk)',
-            ExpressionAttributeValues={
-                ':pk': f'ORDER#{order_id}',
-                ':sk': 'DELIVERY_CAPACITY_TOKEN'
-            }
-        )
+        return {
+            "statusCode": 200,
+            "body": json.dumps({
+                "message": "Capacidad liberada exitosamente" if released else "El pedido no tenía capacidad reservada",
+                "orderId": order_id,
+                "released": released
+            })
+        }
         
-        # Notificar a todos los tokens pendientes
-        for item in response.get('Items', []):
-            try:
-                stepfunctions.send_task_success(
-                    taskToken=item['taskToken'],
-                    output=json.dumps({
-                        "capacityReleased": True,
-                        "orderId": order_id,
-                        "releasedAt": datetime.now().isoformat()
-                    })
-                )
-                
-                # Eliminar el token
-                steps_table.delete_item(
-                    Key={
-                        'PK': item['PK'],
-                        'SK': item['SK']
+    except Exception as e:
+        return {
+            "statusCode": 500,
+            "body": json.dumps({
+                "error": str(e)
+            })
+        }
+
+def set_delivery_capacity(event, context):
+    """
+    Fija la capacidad de delivery de un local
+    PUT /delivery-capacity/{storeId}  body: {"capacity": 5, "tenantId": "pardos"}
+    """
+    try:
+        store_id = event['pathParameters']['storeId']
+        body = json.loads(event.get('body') or '{}')
+        tenant_id = body.get('tenantId', 'pardos')
+        try:
+            nueva = int(body['capacity'])
+        except (KeyError, TypeError, ValueError):
+            return {"statusCode": 400, "body": json.dumps({"error": "capacity debe ser un entero"})}
+        if nueva < 0:
+            return {"statusCode": 400, "body": json.dumps({"error": "capacity no puede ser negativa"})}
+
+        ocupacion = _get_capacity().set_capacity(tenant_id, store_id, nueva)
+        # Si la capacidad subió, los que esperaban pueden salir ya
+        _get_capacity().dispatch(tenant_id, store_id, wake_waiting_order)
+        return {
+            "statusCode": 200,
+            "body": json.dumps({"tenantId": tenant_id, "storeId": store_id, **ocupacion})
+        }
+    except Exception as e:
+        return {
+            "statusCode": 500,
+            "body": json.dumps({
+                "error": str(e)
+            })
+        }
+
+def get_kitchen_batches(event, context):
+    """
+    Tandas de cocción armadas con los pedidos que esperan confirmación de COOKING
+    GET /kitchen/batches?tenantId=pardos&storeId=principal
+    """
+    try:
+        params = event.get('queryStringParameters') or {}
+        tenant_id = params.get('tenantId', 'pardos')
+        batches = _get_kitchen().plan(tenant_id, params.get('storeId'))
+        return {
+            "statusCode": 200,
+            "body": json.dumps({
+                "tenantId": tenant_id,
+                "batches": batches,
+                "ready": sum(1 for batch in batches if batch['ready'])
+            })
+        }
+    except Exception as e:
+        return {
+            "statusCode": 500,
+            "body": json.dumps({
+                "error": str(e)
+            })
+        }
+
+@flush_events(_get_events)
+def confirm_kitchen_batch(event, context):
+    """
+    Confirma una tanda: el producto queda cocido en todos sus pedidos y se
+    completan juntos los tokens de los que no tienen nada más pendiente
+    POST /kitchen/batches/confirm
+    body: {"productId": "pollo_entero", "orderIds": [...], "tenantId": "pardos", "batchId": "...", "confirmedBy": "..."}
+    """
+    try:
+        body = json.loads(event.get('body') or '{}')
+        product_id = body.get('productId')
+        order_ids = body.get('orderIds') or []
+        if not product_id or not isinstance(order_ids, list) or not order_ids:
+            return {"statusCode": 400, "body": json.dumps({"error": "productId y orderIds son requeridos"})}
+        tenant_id = body.get('tenantId', 'pardos')
+        confirmed_by = body.get('confirmedBy', 'unknown')
+
+        results = _get_kitchen().confirm_batch(tenant_id, product_id, order_ids, confirmed_by,
+                                               body.get('batchId'))
+        confirmed_at = datetime.now().isoformat()
+        for order_id, outcome in results.items():
+            if outcome['result'] == CONFIRMED:
+                _get_events().publish_event(
+                    source='pardos.stepfunctions',
+                    detail_type='StageConfirmed',
+                    detail={
+                        'orderId': order_id,
+                        'stage': 'COOKING',
+                        'confirmedBy': confirmed_by,
+                        'confirmedAt': confirmed_at,
+                        'batchId': body.get('batchId')
                     }
                 )
-            except:
-                pass  # Token podría ya haber expirado
-        
+
         return {
             "statusCode": 200,
             "body": json.dumps({
-                "message": "Capacidad liberada exitosamente",
-                "orderId": order_id
+                "productId": product_id,
+                "batchId": body.get('batchId'),
+                "released": sum(1 for outcome in results.values() if outcome['result'] == CONFIRMED),
+                "orders": [{"orderId": order_id, **outcome} for order_id, outcome in results.items()]
             })
         }
-        
     except Exception as e:
         return {
             "statusCode": 500,
             "body": json.dumps({
-                "error": str(e)
+                "error": str(e),
+                "message": "Error al confirmar la tanda"
             })
         }
+
+@flush_events(_get_events)
 def confirm_stage(event, context):
     """
     Endpoint HTTP para confirmar etapa manualmente
@@ -463,7 +430,7 @@ def confirm_stage(event, context):
         confirmed_by = body.get('confirmedBy', 'unknown')
         
         # Buscar el token en DynamoDB
-        response = steps_table.get_item(
+        response = _get_steps_table().get_item(
             Key={
                 'PK': f'ORDER#{order_id}',
                 'SK': f'TOKEN#{stage}'
@@ -484,7 +451,7 @@ def confirm_stage(event, context):
         task_token = item['taskToken']
         
         # Enviar éxito a Step Functions
-        stepfunctions.send_task_success(
+        _get_stepfunctions().send_task_success(
             taskToken=task_token,
             output=json.dumps({
                 "confirmed": True,
@@ -496,7 +463,7 @@ def confirm_stage(event, context):
         )
         
         # Actualizar estado en DynamoDB
-        steps_table.update_item(
+        _get_steps_table().update_item(
             Key={
                 'PK': f'ORDER#{order_id}',
                 'SK': f'TOKEN#{stage}'
@@ -513,21 +480,15 @@ def confirm_stage(event, context):
         )
         
         # Publicar evento de confirmación
-        eventbridge = boto3.client('events')
-        eventbridge.put_events(
-            Entries=[
-                {
-                    'Source': 'pardos.stepfunctions',
-                    'DetailType': 'StageConfirmed',
-                    'EventBusName': os.environ['EVENT_BUS_NAME'],
-                    'Detail': json.dumps({
-                        'orderId': order_id,
-                        'stage': stage,
-                        'confirmedBy': confirmed_by,
-                        'confirmedAt': datetime.now().isoformat()
-                    })
-                }
-            ]
+        _get_events().publish_event(
+            source='pardos.stepfunctions',
+            detail_type='StageConfirmed',
+            detail={
+                'orderId': order_id,
+                'stage': stage,
+                'confirmedBy': confirmed_by,
+                'confirmedAt': datetime.now().isoformat()
+            }
         )
         
         return {
@@ -549,40 +510,243 @@ def confirm_stage(event, context):
         }
 
 
+@flush_events(_get_events)
+def confirm_stages_bulk(event, context):
+    """
+    Confirma muchas etapas en una llamada
+    POST /orders/confirm-stage/bulk
+    body: {"confirmations": [{"orderId": "...", "stage": "COOKING"}, ...], "confirmedBy": "..."}
+    """
+    try:
+        body = json.loads(event.get('body') or '{}')
+        confirmations = body.get('confirmations')
+        confirmed_by = body.get('confirmedBy', 'unknown')
+        if not isinstance(confirmations, list) or not confirmations:
+            return {"statusCode": 400, "body": json.dumps({"error": "confirmations debe ser una lista no vacía"})}
+        if len(confirmations) > MAX_BULK_CONFIRMATIONS:
+            return {"statusCode": 400, "body": json.dumps({
+                "error": f"Máximo {MAX_BULK_CONFIRMATIONS} confirmaciones por llamada"
+            })}
+        pairs = []
+        for confirmation in confirmations:
+            if not isinstance(confirmation, dict) or not confirmation.get('orderId') or not confirmation.get('stage'):
+                return {"statusCode": 400, "body": json.dumps({"error": "Cada confirmación requiere orderId y stage"})}
+            pairs.append((confirmation['orderId'], confirmation['stage']))
+        pairs = list(dict.fromkeys(pairs))
+
+        # 1. Todos los tokens en un solo BatchGetItem
+        tokens = {
+            (item['orderId'], item['stage']): item
+            for item in _get_dynamodb().batch_get(
+                os.environ['STEPS_TABLE'],
+                [{'PK': f'ORDER#{order_id}', 'SK': f'TOKEN#{stage}'} for order_id, stage in pairs]
+            )
+        }
+
+        # 2. send_task_success y marca del token en paralelo
+        confirmed_at = datetime.now().isoformat()
+
+        def send(pair):
+            order_id, stage = pair
+            item = tokens.get(pair)
+            if item is None:
+                return pair, {"result": "NOT_FOUND", "error": "Token no encontrado o expirado"}
+            if item.get('status') != 'PENDING_CONFIRMATION':
+                return pair, {"result": "NOT_PENDING", "error": f"Token en estado {item.get('status')}"}
+            try:
+                _get_stepfunctions().send_task_success(
+                    taskToken=item['taskToken'],
+                    output=json.dumps({
+                        "confirmed": True,
+                        "stage": stage,
+                        "confirmedAt": confirmed_at,
+                        "confirmedBy": confirmed_by,
+                        "orderId": order_id
+                    })
+                )
+            except Exception as e:
+                code = (getattr(e, 'response', None) or {}).get('Error', {}).get('Code')
+                if code in ('TaskTimedOut', 'TaskDoesNotExist', 'InvalidToken'):
+                    return pair, {"result": "EXPIRED", "error": code}
+                print(f"Error confirmando {stage} de {order_id}: {str(e)}")
+                return pair, {"result": "ERROR", "error": str(e)}
+
+            # 3. Solo el estado, condicionado a que siga pendiente: si el barrido
+            #    o una confirmación simultánea ya lo movió, no se pisa. El workflow
+            #    ya avanzó, así que un error acá no deshace la confirmación
+            try:
+                _get_steps_table().update_item(
+                    Key={'PK': f'ORDER#{order_id}', 'SK': f'TOKEN#{stage}'},
+                    UpdateExpression="SET #s = :status, confirmedAt = :confirmedAt, confirmedBy = :confirmedBy",
+                    ConditionExpression="#s = :pending",
+                    ExpressionAttributeNames={'#s': 'status'},
+                    ExpressionAttributeValues={
+                        ':status': 'CONFIRMED',
+                        ':pending': 'PENDING_CONFIRMATION',
+                        ':confirmedAt': confirmed_at,
+                        ':confirmedBy': confirmed_by
+                    }
+                )
+            except Exception as e:
+                if is_conditional_check_failed(e):
+                    print(f"Token {stage} de {order_id} ya no estaba pendiente al marcarlo")
+                else:
+                    print(f"Error marcando el token {stage} de {order_id}: {str(e)}")
+                    return pair, {"result": "CONFIRMED", "error": f"Token sin marcar: {str(e)}"}
+            return pair, {"result": "CONFIRMED"}
+
+        outcomes = dict(get_executor().map(send, pairs))
+        confirmed = [pair for pair in pairs if outcomes[pair]['result'] == 'CONFIRMED']
+
+        # 4. Eventos: salen juntos en el flush de la invocación
+        for order_id, stage in confirmed:
+            _get_events().publish_event(
+                source='pardos.stepfunctions',
+                detail_type='StageConfirmed',
+                detail={
+                    'orderId': order_id,
+                    'stage': stage,
+                    'confirmedBy': confirmed_by,
+                    'confirmedAt': confirmed_at
+                }
+            )
+
+        return {
+            "statusCode": 200,
+            "body": json.dumps({
+                "confirmed": len(confirmed),
+                "failed": len(pairs) - len(confirmed),
+                "results": [
+                    {"orderId": order_id, "stage": stage, **outcomes[(order_id, stage)]}
+                    for order_id, stage in pairs
+                ]
+            })
+        }
+
+    except Exception as e:
+        return {
+            "statusCode": 500,
+            "body": json.dumps({
+                "error": str(e),
+                "message": "Error al confirmar etapas"
+            })
+        }
+
 # ==============================================
 # FUNCIONES AUXILIARES (existentes)
 # ==============================================
 
-def _update_step(order_id, tenant_id, step, status="IN_PROGRESS"):
+def _release_and_dispatch(order_id, reservation_id=None):
+    """Libera el lugar del pedido y despierta a los siguientes de la cola de su local"""
+    slot = _get_capacity().release(order_id, reservation_id)
+    if slot:
+        _get_capacity().dispatch(slot['tenantId'], slot['storeId'], wake_waiting_order)
+    return slot is not None
+
+def _delivery_reservation_id(pk):
+    """reservationId guardado en el step DELIVERY del pedido (None en pedidos anteriores)"""
+    for step in _get_dynamodb().iter_query(
+        table_name=os.environ['STEPS_TABLE'],
+        key_condition_expression='PK = :pk AND begins_with(SK, :sk)',
+        expression_attribute_values={':pk': pk, ':sk': 'STEP#DELIVERY#'},
+        projection='reservationId'
+    ):
+        if step.get('reservationId'):
+            return step['reservationId']
+    return None
+
+def _update_step(order_id, tenant_id, step, status="IN_PROGRESS", attributes=None):
     pk = f"TENANT#{tenant_id}#ORDER#{order_id}"
     timestamp = datetime.utcnow().isoformat()
-    _get_dynamodb().update_item(
-        table_name=os.environ['ORDERS_TABLE'],
-        key={'PK': pk, 'SK': 'INFO'},
-        update_expression="SET currentStep = :step, #s = :status",
-        expression_names={'#s': 'status'},
-        expression_values={':step': step, ':status': status}
-    )
-    step_record = {
-        'PK': pk,
-        'SK': f"STEP#{step}#{timestamp}",
-        'stepName': step,
-        'status': status,
-        'startedAt': timestamp,
-        'tenantId': tenant_id,
-        'orderId': order_id
-    }
-    _get_dynamodb().put_item(os.environ['STEPS_TABLE'], step_record)
-    _get_events().publish_event(
-        source="pardos.orders",
-        detail_type="OrderStageStarted" if status == "IN_PROGRESS" else "OrderStageCompleted",
-        detail={
+    _commit_transition(
+        order_id, tenant_id, step, status,
+        step_record={
+            'PK': pk,
+            'SK': f"STEP#{step}#{timestamp}",
+            'stepName': step,
+            'status': status,
+            'startedAt': timestamp,
+            'tenantId': tenant_id,
             'orderId': order_id,
-            'step': step,
-            'status': status
+            **(attributes or {})
+        },
+        event={
+            'source': "pardos.orders",
+            'detail_type': "OrderStageStarted" if status == "IN_PROGRESS" else "OrderStageCompleted",
+            'detail': {
+                'orderId': order_id,
+                'tenantId': tenant_id,
+                'step': step,
+                'status': status,
+                'sequence': STAGE_SEQUENCE[step],
+                'timestamp': timestamp
+            }
         }
     )
 
+def _commit_transition(order_id, tenant_id, step, order_status, step_record, event):
+    """
+    Transición de etapa en un solo TransactWriteItems: el pedido pasa a `step`
+    solo si está en la etapa anterior, y el registro de STEPS y el item de
+    outbox con el evento se escriben con él o no se escriben. Después del
+    commit el evento se publica y se borra del outbox; si la publicación
+    falla o la Lambda muere antes, lo publica el relay. Si la condición
+    falla porque el pedido ya está en `step` (reintento tras un timeout a
+    mitad de camino) no se hace nada más: el outbox del primer intento ya
+    garantiza el evento.
+    """
+    pk = step_record['PK']
+    expected = previous_stage(step)
+    outbox = outbox_item(order_id, step, event, step_record['startedAt'])
+    try:
+        _get_dynamodb().transact_write([
+            {
+                'Update': {
+                    'TableName': os.environ['ORDERS_TABLE'],
+                    'Key': {'PK': pk, 'SK': 'INFO'},
+                    'UpdateExpression': "SET currentStep = :step, #s = :status, updatedAt = :now",
+                    'ConditionExpression': "currentStep = :expected",
+                    'ExpressionAttributeNames': {'#s': 'status'},
+                    'ExpressionAttributeValues': {
+                        ':step': step,
+                        ':status': order_status,
+                        ':now': step_record['startedAt'],
+                        ':expected': expected
+                    }
+                }
+            },
+            {
+                'Put': {
+                    'TableName': os.environ['STEPS_TABLE'],
+                    'Item': step_record
+                }
+            },
+            {
+                'Put': {
+                    'TableName': os.environ['STEPS_TABLE'],
+                    'Item': outbox
+                }
+            }
+        ])
+    except Exception as e:
+        if cancellation_reasons(e)[:1] != ['ConditionalCheckFailed']:
+            raise
+        current = (_get_dynamodb().get_item(
+            os.environ['ORDERS_TABLE'], {'PK': pk, 'SK': 'INFO'}, consistent_read=True
+        ).get('Item') or {}).get('currentStep')
+        if current != step:
+            raise RuntimeError(
+                f"Transición inválida para {order_id}: {step} requiere {expected} y el pedido está en {current}"
+            )
+        print(f"{order_id} ya estaba en {step} (reintento): el evento queda en el outbox")
+        return
+
+    try:
+        publish_outbox(_get_dynamodb(), os.environ['STEPS_TABLE'], [outbox])
+    except Exception as e:
+        # La transición y el outbox ya están guardados: el relay publica el evento
+        print(f"Evento {event['detail_type']} de {order_id} queda en el outbox: {str(e)}")
+
 def calcular_duracion(inicio, fin):
     start = datetime.fromisoformat(inicio.replace('Z', '+00:00'))
     end = datetime.fromisoformat(fin.replace('Z', '+00:00'))
@@ -0,0 +1,237 @@
+import json
+import os
+from collections import Counter
+from datetime import datetime
+
+try:
+    from shared.clients import get_client, get_executor, get_table
+    from shared.database import DynamoDB, is_conditional_check_failed
+    from shared.orders import DEFAULT_STORE_ID, ORDER_INFO_SK, order_pk
+except ImportError:
+    from Lambdas.shared.clients import get_client, get_executor, get_table
+    from Lambdas.shared.database import DynamoDB, is_conditional_check_failed
+    from Lambdas.shared.orders import DEFAULT_STORE_ID, ORDER_INFO_SK, order_pk
+
+# Unidades que entran en una tanda (un horno / un asador). Se puede fijar por
+# producto con KITCHEN_BATCH_CAPACITY_BY_PRODUCT='{"pollo_entero": 8, "pollo_1_4": 32}'
+DEFAULT_BATCH_CAPACITY = int(os.environ.get('KITCHEN_BATCH_CAPACITY', 12))
+
+# Segundos que el pedido más antiguo de una tanda puede esperar antes de que
+# la tanda salga aunque no esté llena
+KITCHEN_MAX_WAIT = int(os.environ.get('KITCHEN_MAX_WAIT', 600))
+
+COOKING_TOKEN_SK = 'TOKEN#COOKING'
+PENDING_CONFIRMATION = 'PENDING_CONFIRMATION'
+TOKENS_BY_STAGE_INDEX = 'stage-status-index'
+
+# Por qué una tanda está lista para entrar a cocción
+READY_FULL = 'FULL'
+READY_MAX_WAIT = 'MAX_WAIT'
+
+# Resultado de confirmar una tanda, por pedido
+CONFIRMED = 'CONFIRMED'
+PARTIAL = 'PARTIAL'
+NOT_PENDING = 'NOT_PENDING'
+NOT_IN_ORDER = 'NOT_IN_ORDER'
+EXPIRED = 'EXPIRED'
+ERROR = 'ERROR'
+
+
+def batch_capacity(product_id):
+    by_product = json.loads(os.environ.get('KITCHEN_BATCH_CAPACITY_BY_PRODUCT') or '{}')
+    return int(by_product.get(product_id, DEFAULT_BATCH_CAPACITY))
+
+
+def token_key(order_id, stage='COOKING'):
+    return {'PK': f"ORDER#{order_id}", 'SK': f"TOKEN#{stage}"}
+
+
+def order_products(order):
+    """Unidades por productId de un pedido"""
+    products = Counter()
+    for item in order.get('items', []):
+        product_id = item.get('productId')
+        if product_id:
+            products[product_id] += int(item.get('qty', 1))
+    return products
+
+
+def _parse(timestamp):
+    return datetime.fromisoformat(timestamp.replace('Z', '+00:00')).replace(tzinfo=None)
+
+
+def plan_batches(pending, now=None, max_wait=KITCHEN_MAX_WAIT):
+    """
+    Agrupa las líneas pendientes por (storeId, productId) en tandas.
+
+    Las líneas se toman por orden de llegada y llenan la tanda actual hasta la
+    capacidad del producto; una línea no se parte entre tandas, así que una
+    que sola supera la capacidad va en una tanda propia. Una tanda está lista
+    si se llenó o si su pedido más antiguo ya esperó `max_wait` segundos.
+    `pending` son dicts con orderId, storeId, waitingSince, products y cooked.
+    """
+    now = now or datetime.now()
+    lines = {}
+    for order in sorted(pending, key=lambda o: (o['waitingSince'], o['orderId'])):
+        for product_id, units in order['products'].items():
+            if product_id not in order['cooked']:
+                lines.setdefault((order['storeId'], product_id), []).append((order, units))
+
+    batches = []
+    for (store_id, product_id), product_lines in lines.items():
+        capacity = batch_capacity(product_id)
+        current = None
+        for order, units in product_lines:
+            if current is None or (current['units'] and current['units'] + units > capacity):
+                current = {
+                    'batchId': f"{store_id}#{product_id}#{order['orderId']}",
+                    'storeId': store_id,
+                    'productId': product_id,
+                    'capacity': capacity,
+                    'units': 0,
+                    'orderIds': [],
+                    'oldestWaitingSince': order['waitingSince']
+                }
+                batches.append(current)
+            current['units'] += units
+            current['orderIds'].append(order['orderId'])
+
+    for batch in batches:
+        waited = (now - _parse(batch['oldestWaitingSince'])).total_seconds()
+        batch['waitedSeconds'] = max(int(waited), 0)
+        batch['ready'] = batch['units'] >= batch['capacity'] or waited >= max_wait
+        batch['readyReason'] = (READY_FULL if batch['units'] >= batch['capacity']
+                                else READY_MAX_WAIT if waited >= max_wait else None)
+    batches.sort(key=lambda b: (not b['ready'], b['oldestWaitingSince'], b['batchId']))
+    return batches
+
+
+class KitchenScheduler:
+    """
+    Tandas de cocción sobre los pedidos que esperan confirmación de COOKING.
+
+    Un pedido con varios productos participa en una tanda por producto: cada
+    confirmación agrega el producto a `cookedProducts` de su token y el task
+    token solo se completa cuando todos sus productos están cocidos.
+    """
+
+    def __init__(self, db=None):
+        self.db = db or DynamoDB()
+
+    def pending_orders(self, tenant_id, store_id=None):
+        tokens = [
+            token for token in self.db.iter_query(
+                table_name=os.environ['STEPS_TABLE'],
+                index_name=TOKENS_BY_STAGE_INDEX,
+                key_condition_expression='SK = :sk AND #s = :pending',
+                expression_attribute_values={':sk': COOKING_TOKEN_SK, ':pending': PENDING_CONFIRMATION,
+                                             ':tenant': tenant_id},
+                expression_names={'#s': 'status'},
+                filter_expression='tenantId = :tenant'
+            )
+        ]
+        orders = self._orders(tenant_id, [token['orderId'] for token in tokens])
+        pending = []
+        for token in tokens:
+            order = orders.get(token['orderId'])
+            if order is None:
+                continue
+            order_store = order.get('storeId') or DEFAULT_STORE_ID
+            if store_id and order_store != store_id:
+                continue
+            pending.append({
+                'orderId': token['orderId'],
+                'tenantId': tenant_id,
+                'storeId': order_store,
+                'waitingSince': token.get('createdAt') or order.get('createdAt'),
+                'products': order_products(order),
+                'cooked': set(token.get('cookedProducts') or ())
+            })
+        return pending
+
+    def plan(self, tenant_id, store_id=None, now=None):
+        return plan_batches(self.pending_orders(tenant_id, store_id), now)
+
+    def confirm_batch(self, tenant_id, product_id, order_ids, confirmed_by='unknown', batch_id=None):
+        """
+        Marca `product_id` como cocido en cada pedido de la tanda y completa de
+        una vez los task tokens de los pedidos que quedan sin productos
+        pendientes. Devuelve {orderId: resultado} (ver constantes de arriba).
+        """
+        orders = self._orders(tenant_id, order_ids)
+        confirmed_at = datetime.now().isoformat()
+
+        def confirm(order_id):
+            order = orders.get(order_id)
+            if order is None or product_id not in order_products(order):
+                return order_id, {'result': NOT_IN_ORDER}
+            try:
+                return order_id, self._confirm_order(order_id, order, product_id, confirmed_by,
+                                                     confirmed_at, batch_id)
+            except Exception as e:
+                # Un pedido con error no tapa a los demás de la tanda, que ya pueden estar liberados
+                print(f"Error confirmando {product_id} en {order_id}: {str(e)}")
+                return order_id, {'result': ERROR, 'error': str(e)}
+
+        return dict(get_executor().map(confirm, list(dict.fromkeys(order_ids))))
+
+    def _confirm_order(self, order_id, order, product_id, confirmed_by, confirmed_at, batch_id):
+        table = get_table(os.environ['STEPS_TABLE'])
+        try:
+            token = table.update_item(
+                Key=token_key(order_id),
+                UpdateExpression='ADD cookedProducts :product',
+                ConditionExpression='#s = :pending',
+                ExpressionAttributeNames={'#s': 'status'},
+                ExpressionAttributeValues={':product': {product_id}, ':pending': PENDING_CONFIRMATION},
+                ReturnValues='ALL_NEW'
+            )['Attributes']
+        except Exception as e:
+            if is_conditional_check_failed(e):
+                return {'result': NOT_PENDING}
+            raise
+
+        remaining = sorted(set(order_products(order)) - set(token.get('cookedProducts') or ()))
+        if remaining:
+            return {'result': PARTIAL, 'remainingProducts': remaining}
+
+        try:
+            get_client('stepfunctions').send_task_success(
+                taskToken=token['taskToken'],
+                output=json.dumps({
+                    "confirmed": True,
+                    "stage": 'COOKING',
+                    "confirmedAt": confirmed_at,
+                    "confirmedBy": confirmed_by,
+                    "orderId": order_id,
+                    "batchId": batch_id
+                })
+            )
+        except Exception as e:
+            code = (getattr(e, 'response', None) or {}).get('Error', {}).get('Code')
+            if code in ('TaskTimedOut', 'TaskDoesNotExist', 'InvalidToken'):
+                print(f"Token de cocción de {order_id} ya no es válido ({code})")
+                return {'result': EXPIRED}
+            raise
+
+        table.update_item(
+            Key=token_key(order_id),
+            UpdateExpression="SET #s = :status, confirmedAt = :confirmedAt, confirmedBy = :confirmedBy",
+            ExpressionAttributeNames={'#s': 'status'},
+            ExpressionAttributeValues={
+                ':status': 'CONFIRMED',
+                ':confirmedAt': confirmed_at,
+                ':confirmedBy': confirmed_by
+            }
+        )
+        return {'result': CONFIRMED}
+
+    def _orders(self, tenant_id, order_ids):
+        """Items INFO de los pedidos en un solo BatchGetItem: {orderId: item}"""
+        items = self.db.batch_get(
+            os.environ['ORDERS_TABLE'],
+            [{'PK': order_pk(tenant_id, order_id), 'SK': ORDER_INFO_SK} for order_id in order_ids],
+            projection='orderId, storeId, createdAt, #items',
+            expression_names={'#items': 'items'}
+        )
+        return {item['orderId']: item for item in items}
@@ -1,14 +1,51 @@
 import json
 import os
-from datetime import datetime
+from collections import Counter
+from datetime import datetime, timedelta
 
 import sys
 sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
 
 try:
-    from shared.database import DynamoDB
+    from shared.clients import get_executor
+    from shared.database import DynamoDB, add_operation, cancellation_reasons, is_conditional_check_failed
+    from shared.orders import ORDER_INFO_SK, order_pk
 except ImportError:
-    from Lambdas.shared.database import DynamoDB
+    from Lambdas.shared.clients import get_executor
+    from Lambdas.shared.database import DynamoDB, add_operation, cancellation_reasons, is_conditional_check_failed
+    from Lambdas.shared.orders import ORDER_INFO_SK, order_pk
+
+DEFAULT_NOTIFICATIONS_PAGE = 20
+MAX_NOTIFICATIONS_PAGE = 100
+
+# Retención: cada notificación lleva ttl y DynamoDB la borra pasado este plazo
+NOTIFICATION_RETENTION_DAYS = int(os.environ.get('NOTIFICATION_RETENTION_DAYS', 90))
+
+# Al entregarse un pedido sus notificaciones de etapa se compactan en la de
+# entrega; se buscan solo en esta ventana previa a la entrega
+COMPACTION_LOOKBACK_HOURS = 24
+COMPACTION_MAX_ATTEMPTS = 3
+TRANSACTION_MAX_ITEMS = 100
+
+# Transiciones del mismo pedido que llegan en el mismo lote dentro de esta
+# ventana (segundos) se guardan como una sola notificación con el último
+# mensaje. 0 la desactiva
+NOTIFICATION_COALESCE_SECONDS = float(os.environ.get('NOTIFICATION_COALESCE_SECONDS', 0))
+NOTIFICATION_WRITE_ATTEMPTS = 3
+
+# Contador de no leídas por cliente: un item más en la partición del cliente,
+# fuera del rango NOTIFICATION# que recorre el feed. Cada escritura sube su
+# versión; se recuenta (condicionado a la versión) la primera vez que se lee
+# y cada UNREAD_RESYNC_HOURS, porque las notificaciones que vence el TTL sin
+# leer no lo descuentan
+UNREAD_COUNTER_SK = 'UNREAD_COUNTER'
+UNREAD_ATTRIBUTE = 'unread'
+UNREAD_VERSION_ATTRIBUTE = 'version'
+UNREAD_RESYNC_HOURS = int(os.environ.get('UNREAD_RESYNC_HOURS', 24))
+UNREAD_RESYNC_ATTEMPTS = 3
+
+# Campos que muestra el feed (type y read son palabras reservadas: van todos con alias)
+FEED_FIELDS = ('SK', 'orderId', 'message', 'type', 'stage', 'createdAt', 'read', 'readAt', 'timeline', 'coalesced')
 
 # Inicialización lazy
 dynamodb = None
@@ -32,32 +69,33 @@ def send_order_notification(event, context):
         
         order_id = detail.get('orderId')
         tenant_id = detail.get('tenantId', 'pardos')
-        customer_id = detail.get('customerId')
         stage = detail.get('stage', detail.get('step', ''))
         
         print(f"Procesando notificación: {detail_type} para pedido {order_id}")
         
-        # Determinar el mensaje de notificación
-        message = _get_notification_message(detail_type, stage)
-        
-        if message:
-            # Guardar notificación en base de datos
-            notification_record = {
-                'PK': f"TENANT#{tenant_id}#CUSTOMER#{customer_id}",
-                'SK': f"NOTIFICATION#{datetime.utcnow().isoformat()}",
-                'orderId': order_id,
-                'message': message,
-                'type': detail_type,
-                'stage': stage,
-                'createdAt': datetime.utcnow().isoformat(),
-                'read': False
+        # Los eventos de etapa no traen customerId: se toma del pedido
+        customer_id = detail.get('customerId') or _customer_ids([(tenant_id, order_id)]).get((tenant_id, order_id))
+        if not customer_id:
+            print(f"Pedido {order_id} sin cliente, se descarta {detail_type}")
+            return {
+                'statusCode': 200,
+                'body': json.dumps({'message': 'Notification skipped', 'orderId': order_id, 'stage': stage})
             }
-            
+        notification_record = _build_notification(
+            event, customer_id, detail.get('timestamp') or datetime.utcnow().isoformat()
+        )
+        
+        if notification_record:
             # En una implementación real, aquí enviarías push notifications, SMS, email, etc.
             # Por ahora solo guardamos en DynamoDB
-            _get_dynamodb().put_item(os.environ['NOTIFICATIONS_TABLE'], notification_record)
-            
-            print(f"Notificación guardada: {message}")
+            written, failed = _store_notifications([{'item': notification_record, 'messageIds': [order_id]}])
+            if failed:
+                raise RuntimeError(f"No se pudo guardar la notificación de {order_id}")
+            if written:
+                print(f"Notificación guardada: {notification_record['message']}")
+            else:
+                print(f"Notificación duplicada de {order_id} ({detail_type} {stage}), se ignora")
+            _compact_delivered(written)
             
         return {
             'statusCode': 200,
@@ -75,34 +113,107 @@ def send_order_notification(event, context):
             'body': json.dumps({'error': str(e)})
         }
 
+def ingest_notifications(event, context):
+    """
+    Ingesta por lotes: consume de NotificationsQueue los mismos eventos de
+    pardos.orders / pardos.etapas y los guarda con _store_notifications.
+    Devuelve batchItemFailures para que SQS reintente solo los mensajes que
+    fallaron; un mensaje reintentado que ya se guardó no escribe nada.
+    """
+    records = event.get('Records', [])
+    failures = []
+    parsed = []
+    for record in records:
+        try:
+            parsed.append((record['messageId'], json.loads(record['body'])))
+        except (KeyError, TypeError, ValueError) as e:
+            print(f"Mensaje inválido {record.get('messageId')}: {str(e)}")
+            failures.append(record.get('messageId'))
+
+    # Un solo BatchGetItem para los customerId que los eventos de etapa no traen
+    missing = [
+        (message.get('detail', {}).get('tenantId', 'pardos'), message.get('detail', {}).get('orderId'))
+        for _, message in parsed
+        if not message.get('detail', {}).get('customerId') and message.get('detail', {}).get('orderId')
+    ]
+    customers = _customer_ids(missing)
+
+    entries = []
+    for message_id, message in parsed:
+        try:
+            detail = message.get('detail', {})
+            tenant_id = detail.get('tenantId', 'pardos')
+            customer_id = detail.get('customerId') or customers.get((tenant_id, detail.get('orderId')))
+            if not customer_id:
+                print(f"Pedido {detail.get('orderId')} sin cliente, se descarta {message.get('detail-type')}")
+                continue
+            record = _build_notification(
+                message, customer_id,
+                detail.get('timestamp') or message.get('time') or datetime.utcnow().isoformat()
+            )
+            if record:
+                entries.append({'item': record, 'messageIds': [message_id]})
+        except Exception as e:
+            print(f"Error armando notificación del mensaje {message_id}: {str(e)}")
+            failures.append(message_id)
+
+    written, failed = _store_notifications(entries)
+    failures.extend(failed)
+    _compact_delivered(written)
+
+    print(f"Ingesta de notificaciones: {len(records)} mensajes, {len(written)} guardadas, {len(failures)} fallidas")
+    return {'batchItemFailures': [{'itemIdentifier': message_id} for message_id in dict.fromkeys(failures)]}
+
 def get_customer_notifications(event, context):
     """
-    Obtiene notificaciones para un cliente específico
-    GET /notifications/{customerId}
+    Obtiene notificaciones para un cliente específico, más recientes primero
+    GET /notifications/{customerId}?limit=&nextToken=
     """
     try:
         customer_id = event['pathParameters']['customerId']
         tenant_id = 'pardos'
-        
-        response = _get_dynamodb().query(
-            table_name=os.environ['NOTIFICATIONS_TABLE'],
-            key_condition_expression='PK = :pk AND begins_with(SK, :sk)',
-            expression_attribute_values={
-                ':pk': f"TENANT#{tenant_id}#CUSTOMER#{customer_id}",
-                ':sk': 'NOTIFICATION#'
-            }
+        params = event.get('queryStringParameters') or {}
+        try:
+            limit = min(max(int(params.get('limit', DEFAULT_NOTIFICATIONS_PAGE)), 1), MAX_NOTIFICATIONS_PAGE)
+        except ValueError:
+            return {'statusCode': 400, 'body': json.dumps({'error': 'limit debe ser un entero'})}
+        pk = _customer_pk(tenant_id, customer_id)
+
+        # El contador se lee en paralelo con la página
+        unread = get_executor().submit(
+            _get_dynamodb().get_item, os.environ['NOTIFICATIONS_TABLE'], _unread_counter_key(pk)
         )
-        
-        notifications = response.get('Items', [])
-        
-        # Ordenar por fecha descendente
-        notifications.sort(key=lambda x: x.get('createdAt', ''), reverse=True)
+        try:
+            pages = _get_dynamodb().iter_query(
+                table_name=os.environ['NOTIFICATIONS_TABLE'],
+                key_condition_expression='PK = :pk AND begins_with(SK, :sk)',
+                expression_attribute_values={
+                    ':pk': pk,
+                    ':sk': 'NOTIFICATION#'
+                },
+                projection=', '.join(f"#{field}" for field in FEED_FIELDS),
+                expression_names={f"#{field}": field for field in FEED_FIELDS},
+                scan_index_forward=False,
+                max_items=limit,
+                cursor=params.get('nextToken')
+            )
+            notifications = list(pages)
+        except ValueError as e:
+            return {'statusCode': 400, 'body': json.dumps({'error': str(e)})}
+        counter = unread.result().get('Item') or {}
+        unread_count = int(counter.get(UNREAD_ATTRIBUTE, 0))
+        if _unread_needs_resync(counter):
+            resynced = _resync_unread(pk)
+            if resynced is not None:
+                unread_count = resynced
         
         return {
             'statusCode': 200,
             'body': json.dumps({
                 'notifications': notifications,
-                'total': len(notifications)
+                'total': len(notifications),
+                'nextToken': pages.cursor,
+                'unreadCount': unread_count
             }, default=str)
         }
         
@@ -124,20 +235,34 @@ def mark_notification_read(event, context):
         notification_sk = body.get('notificationSK')
         tenant_id = 'pardos'
         
-        _get_dynamodb().update_item(
-            table_name=os.environ['NOTIFICATIONS_TABLE'],
-            key={
-                'PK': f"TENANT#{tenant_id}#CUSTOMER#{customer_id}",
-                'SK': notification_sk
-            },
-            update_expression="SET #read = :read, readAt = :readAt",
-            expression_names={'#read': 'read'},
-            expression_values={
-                ':read': True,
-                ':readAt': datetime.utcnow().isoformat()
-            }
-        )
+        if not notification_sk:
+            return {'statusCode': 400, 'body': json.dumps({'error': 'notificationSK es requerido'})}
+        pk = _customer_pk(tenant_id, customer_id)
         
+        # Solo si estaba sin leer: así el contador baja exactamente una vez
+        try:
+            _get_dynamodb().transact_write([
+                {
+                    'Update': {
+                        'TableName': os.environ['NOTIFICATIONS_TABLE'],
+                        'Key': {'PK': pk, 'SK': notification_sk},
+                        'UpdateExpression': "SET #read = :read, readAt = :readAt",
+                        'ConditionExpression': "#read = :unread",
+                        'ExpressionAttributeNames': {'#read': 'read'},
+                        'ExpressionAttributeValues': {
+                            ':read': True,
+                            ':unread': False,
+                            ':readAt': datetime.utcnow().isoformat()
+                        }
+                    }
+                },
+                _unread_delta(pk, -1)
+            ])
+        except Exception as e:
+            if cancellation_reasons(e)[:1] != ['ConditionalCheckFailed']:
+                raise
+            # Ya estaba leída (o no existe): nada que cambiar
+            
         return {
             'statusCode': 200,
             'body': json.dumps({'message': 'Notification marked as read'})
@@ -150,6 +275,400 @@ def mark_notification_read(event, context):
             'body': json.dumps({'error': str(e)})
         }
 
+def mark_all_notifications_read(event, context):
+    """
+    Marca como leídas todas las notificaciones sin leer de un cliente, o solo
+    hasta `upTo` (SK de notificación, inclusive)
+    PUT /notifications/{customerId}/read-all  body opcional: {"upTo": "NOTIFICATION#..."}
+    """
+    try:
+        body = event.get('body') or {}
+        body = json.loads(body) if isinstance(body, str) else body
+        customer_id = event['pathParameters']['customerId']
+        up_to = body.get('upTo')
+        tenant_id = 'pardos'
+        
+        if up_to and not up_to.startswith('NOTIFICATION#'):
+            return {'statusCode': 400, 'body': json.dumps({'error': 'upTo debe ser un SK NOTIFICATION#...'})}
+        pk = _customer_pk(tenant_id, customer_id)
+        
+        if up_to:
+            key_condition = 'PK = :pk AND SK BETWEEN :sk AND :upTo'
+            values = {':pk': pk, ':sk': 'NOTIFICATION#', ':upTo': up_to}
+        else:
+            key_condition = 'PK = :pk AND begins_with(SK, :sk)'
+            values = {':pk': pk, ':sk': 'NOTIFICATION#'}
+        unread = [
+            item['SK'] for item in _get_dynamodb().iter_query(
+                table_name=os.environ['NOTIFICATIONS_TABLE'],
+                key_condition_expression=key_condition,
+                expression_attribute_values={**values, ':unread': False},
+                filter_expression='#read = :unread',
+                expression_names={'#read': 'read'},
+                projection='SK'
+            )
+        ]
+        
+        # Lotes transaccionales: cada update condicionado a seguir sin leer, más el descuento del contador
+        read_at = datetime.utcnow().isoformat()
+        size = TRANSACTION_MAX_ITEMS - 1
+        chunks = [unread[i:i + size] for i in range(0, len(unread), size)]
+        marked = sum(get_executor().map(lambda chunk: _mark_read(pk, chunk, read_at), chunks))
+        
+        if not up_to:
+            # Sin límite, el contador se resincroniza con lo que quedó sin leer (notificaciones
+            # vencidas por TTL sin haberse leído); el recuento no pisa escrituras concurrentes
+            _resync_unread(pk)
+        
+        return {
+            'statusCode': 200,
+            'body': json.dumps({'message': 'Notifications marked as read', 'marked': marked, 'upTo': up_to})
+        }
+        
+    except Exception as e:
+        print(f"Error en mark_all_notifications_read: {str(e)}")
+        return {
+            'statusCode': 500,
+            'body': json.dumps({'error': str(e)})
+        }
+
+def _mark_read(pk, sort_keys, read_at):
+    """
+    Marca un lote (<= 99) en una transacción junto con el descuento del
+    contador. Si alguna ya se leyó en el medio se saca del lote y se reintenta.
+    Devuelve cuántas marcó.
+    """
+    while sort_keys:
+        operations = [
+            {
+                'Update': {
+                    'TableName': os.environ['NOTIFICATIONS_TABLE'],
+                    'Key': {'PK': pk, 'SK': sk},
+                    'UpdateExpression': "SET #read = :read, readAt = :readAt",
+                    'ConditionExpression': "#read = :unread",
+                    'ExpressionAttributeNames': {'#read': 'read'},
+                    'ExpressionAttributeValues': {':read': True, ':unread': False, ':readAt': read_at}
+                }
+            }
+            for sk in sort_keys
+        ]
+        operations.append(_unread_delta(pk, -len(sort_keys)))
+        try:
+            _get_dynamodb().transact_write(operations)
+            return len(sort_keys)
+        except Exception as e:
+            reasons = cancellation_reasons(e)
+            if 'ConditionalCheckFailed' not in reasons:
+                raise
+            sort_keys = [sk for sk, reason in zip(sort_keys, reasons) if reason != 'ConditionalCheckFailed']
+    return 0
+
+def _dedup_key(record):
+    """Marca determinística por (orderId, detail-type, stage) en la partición del cliente"""
+    return {'PK': record['PK'], 'SK': f"DEDUP#{record['orderId']}#{record['type']}#{record['stage']}"}
+
+def _store_notifications(entries):
+    """
+    Guarda notificaciones una sola vez por (orderId, detail-type, stage).
+
+    `entries` son {'item': notificación, 'messageIds': [...]}. Las marcas que
+    ya existen se descartan con un BatchGetItem, sin escribir nada. Las
+    nuevas van en transacciones de hasta 100 operaciones: Put condicional de
+    la marca, Put de la notificación y un ADD por cliente al contador de no
+    leídas; si una marca aparece en el medio (entrega concurrente) solo se
+    saca esa notificación y se reintenta. Devuelve (notificaciones escritas,
+    messageIds que fallaron).
+    """
+    groups = {}
+    for entry in entries:
+        dedup = _dedup_key(entry['item'])
+        key = (dedup['PK'], dedup['SK'])
+        if key in groups:
+            groups[key]['messageIds'].extend(entry['messageIds'])
+        else:
+            groups[key] = {'item': entry['item'], 'dedup': [dedup], 'messageIds': list(entry['messageIds'])}
+    if not groups:
+        return [], []
+
+    seen = {
+        (item['PK'], item['SK'])
+        for item in _get_dynamodb().batch_get(
+            os.environ['NOTIFICATIONS_TABLE'], [group['dedup'][0] for group in groups.values()],
+            projection='PK, SK'
+        )
+    }
+    pending = [group for key, group in groups.items() if key not in seen]
+    if NOTIFICATION_COALESCE_SECONDS > 0:
+        pending = _coalesce(pending)
+
+    # Cada grupo usa sus marcas + la notificación; se reserva lugar para un ADD por cliente
+    chunks, chunk, size = [], [], 0
+    for group in pending:
+        cost = len(group['dedup']) + 2
+        if chunk and size + cost > TRANSACTION_MAX_ITEMS:
+            chunks.append(chunk)
+            chunk, size = [], 0
+        chunk.append(group)
+        size += cost
+    if chunk:
+        chunks.append(chunk)
+
+    def write(chunk):
+        try:
+            return _write_notification_chunk(chunk), []
+        except Exception as e:
+            print(f"Error guardando {len(chunk)} notificaciones: {str(e)}")
+            return [], [message_id for group in chunk for message_id in group['messageIds']]
+
+    written, failed = [], []
+    for chunk_written, chunk_failed in get_executor().map(write, chunks):
+        written.extend(chunk_written)
+        failed.extend(chunk_failed)
+    return written, failed
+
+def _write_notification_chunk(groups):
+    for _ in range(NOTIFICATION_WRITE_ATTEMPTS):
+        if not groups:
+            return []
+        operations, owners = [], []
+        for group in groups:
+            for index, dedup in enumerate(group['dedup']):
+                operations.append({
+                    'Put': {
+                        'TableName': os.environ['NOTIFICATIONS_TABLE'],
+                        'Item': {**dedup, 'notificationSK': group['item']['SK'], 'ttl': group['item']['ttl']},
+                        'ConditionExpression': 'attribute_not_exists(SK)'
+                    }
+                })
+                owners.append((group, index))
+            operations.append({'Put': {'TableName': os.environ['NOTIFICATIONS_TABLE'], 'Item': group['item']}})
+            owners.append(None)
+        for pk, count in Counter(group['item']['PK'] for group in groups).items():
+            operations.append(_unread_delta(pk, count))
+            owners.append(None)
+        try:
+            _get_dynamodb().transact_write(operations)
+            return [group['item'] for group in groups]
+        except Exception as e:
+            reasons = cancellation_reasons(e)
+            if 'ConditionalCheckFailed' not in reasons:
+                raise
+        # Marca propia ya escrita: la notificación es un duplicado y se saca.
+        # Marca de una transición absorbida: solo se saca esa marca
+        duplicated, stale = set(), {}
+        for owner, reason in zip(owners, reasons):
+            if owner and reason == 'ConditionalCheckFailed':
+                group, index = owner
+                if index == 0:
+                    duplicated.add(id(group))
+                else:
+                    stale.setdefault(id(group), set()).add(index)
+        groups = [group for group in groups if id(group) not in duplicated]
+        for group in groups:
+            drop = stale.get(id(group), ())
+            group['dedup'] = [dedup for index, dedup in enumerate(group['dedup']) if index not in drop]
+    raise RuntimeError(f"Notificaciones sin guardar tras {NOTIFICATION_WRITE_ATTEMPTS} intentos")
+
+def _coalesce(groups):
+    """
+    Junta las transiciones de un mismo pedido separadas por menos de la
+    ventana: queda la notificación más reciente, con las marcas de las
+    absorbidas para que sus reentregas tampoco escriban.
+    """
+    by_order = {}
+    for group in sorted(groups, key=lambda group: group['item']['createdAt']):
+        by_order.setdefault((group['item']['PK'], group['item']['orderId']), []).append(group)
+
+    coalesced = []
+    for order_groups in by_order.values():
+        current = order_groups[0]
+        started = _parse_timestamp(current['item']['createdAt'])
+        for group in order_groups[1:]:
+            if (_parse_timestamp(group['item']['createdAt']) - started).total_seconds() <= NOTIFICATION_COALESCE_SECONDS:
+                group['dedup'] = group['dedup'] + current['dedup']
+                group['messageIds'] = current['messageIds'] + group['messageIds']
+                group['item']['coalesced'] = current['item'].get('coalesced', 1) + 1
+            else:
+                coalesced.append(current)
+                started = _parse_timestamp(group['item']['createdAt'])
+            current = group
+        coalesced.append(current)
+    return coalesced
+
+def _parse_timestamp(timestamp):
+    return datetime.fromisoformat(timestamp.replace('Z', '+00:00')).replace(tzinfo=None)
+
+def _compact_delivered(written):
+    """Compacta los pedidos cuya notificación de entrega se acaba de guardar"""
+    def compact(record):
+        # La compactación es mantenimiento: si falla, las notificaciones igual quedaron guardadas
+        try:
+            _compact_order(record)
+        except Exception as e:
+            print(f"Error compactando notificaciones del pedido {record['orderId']}: {str(e)}")
+
+    list(get_executor().map(compact, [record for record in written if record['type'] == 'OrderDelivered']))
+
+def _compact_order(delivered):
+    """
+    Compacta las notificaciones de etapa de un pedido entregado en su
+    notificación de entrega: se borran y quedan resumidas en su `timeline`.
+    Todo va en una transacción con el descuento de las que estaban sin leer;
+    cada borrado se condiciona al estado de lectura visto, así que si el
+    cliente marca alguna en el medio se vuelve a leer y se reintenta.
+    """
+    pk = delivered['PK']
+    since = _parse_timestamp(delivered['createdAt']) - timedelta(hours=COMPACTION_LOOKBACK_HOURS)
+    for _ in range(COMPACTION_MAX_ATTEMPTS):
+        stages = [
+            item for item in _get_dynamodb().iter_query(
+                table_name=os.environ['NOTIFICATIONS_TABLE'],
+                key_condition_expression='PK = :pk AND SK BETWEEN :since AND :delivered',
+                expression_attribute_values={
+                    ':pk': pk,
+                    ':since': f"NOTIFICATION#{since.isoformat()}",
+                    ':delivered': delivered['SK'],
+                    ':order': delivered['orderId']
+                },
+                filter_expression='orderId = :order'
+            )
+            if item['SK'] != delivered['SK']
+        ][:TRANSACTION_MAX_ITEMS - 2]
+        if not stages:
+            return 0
+        
+        stages.sort(key=lambda item: item['SK'])
+        unread = sum(1 for item in stages if not item.get('read'))
+        operations = [
+            {
+                'Delete': {
+                    'TableName': os.environ['NOTIFICATIONS_TABLE'],
+                    'Key': {'PK': pk, 'SK': item['SK']},
+                    'ConditionExpression': '#read = :read',
+                    'ExpressionAttributeNames': {'#read': 'read'},
+                    'ExpressionAttributeValues': {':read': bool(item.get('read'))}
+                }
+            }
+            for item in stages
+        ]
+        operations.append({
+            'Update': {
+                'TableName': os.environ['NOTIFICATIONS_TABLE'],
+                'Key': {'PK': pk, 'SK': delivered['SK']},
+                'UpdateExpression': 'SET timeline = list_append(if_not_exists(timeline, :empty), :timeline)',
+                'ConditionExpression': 'attribute_exists(SK)',
+                'ExpressionAttributeValues': {
+                    ':empty': [],
+                    ':timeline': [
+                        {'stage': item.get('stage'), 'type': item.get('type'),
+                         'message': item.get('message'), 'createdAt': item.get('createdAt')}
+                        for item in stages
+                    ]
+                }
+            }
+        })
+        if unread:
+            operations.append(_unread_delta(pk, -unread))
+        try:
+            _get_dynamodb().transact_write(operations)
+            return len(stages)
+        except Exception as e:
+            if 'ConditionalCheckFailed' not in cancellation_reasons(e):
+                raise
+    print(f"Compactación del pedido {delivered['orderId']} abandonada tras {COMPACTION_MAX_ATTEMPTS} intentos")
+    return 0
+
+def _build_notification(event, customer_id, created_at):
+    """Item de NOTIFICATIONS_TABLE para un evento de pedido, o None si no lleva mensaje"""
+    detail = event.get('detail', {})
+    detail_type = event.get('detail-type', '')
+    stage = detail.get('stage', detail.get('step', ''))
+    message = _get_notification_message(detail_type, stage)
+    if not message:
+        return None
+    return {
+        'PK': _customer_pk(detail.get('tenantId', 'pardos'), customer_id),
+        'SK': f"NOTIFICATION#{created_at}#{detail.get('orderId')}#{detail_type}#{stage}",
+        'orderId': detail.get('orderId'),
+        'message': message,
+        'type': detail_type,
+        'stage': stage,
+        'createdAt': created_at,
+        'read': False,
+        'ttl': int((datetime.utcnow() + timedelta(days=NOTIFICATION_RETENTION_DAYS)).timestamp())
+    }
+
+def _customer_pk(tenant_id, customer_id):
+    return f"TENANT#{tenant_id}#CUSTOMER#{customer_id}"
+
+def _unread_counter_key(pk):
+    return {'PK': pk, 'SK': UNREAD_COUNTER_SK}
+
+def _unread_delta(pk, delta):
+    """ADD al contador de no leídas para transact_write; sube la versión que chequea el recuento"""
+    return add_operation(os.environ['NOTIFICATIONS_TABLE'], _unread_counter_key(pk),
+                         {UNREAD_ATTRIBUTE: delta, UNREAD_VERSION_ATTRIBUTE: 1})
+
+def _unread_needs_resync(counter):
+    """Sin recuento (cliente anterior al contador) o recuento más viejo que UNREAD_RESYNC_HOURS"""
+    counted_at = counter.get('countedAt')
+    if not counted_at:
+        return True
+    return datetime.utcnow() - _parse_timestamp(counted_at) > timedelta(hours=UNREAD_RESYNC_HOURS)
+
+def _resync_unread(pk):
+    """
+    Recuenta las notificaciones sin leer y las guarda en el contador. El SET
+    se condiciona a la versión leída antes de contar: si otra escritura movió
+    el contador en el medio, el recuento ya no vale y se repite. Devuelve el
+    valor guardado, o None si no se pudo (el contador queda como estaba).
+    """
+    table_name = os.environ['NOTIFICATIONS_TABLE']
+    for _ in range(UNREAD_RESYNC_ATTEMPTS):
+        counter = _get_dynamodb().get_item(table_name, _unread_counter_key(pk), consistent_read=True).get('Item') or {}
+        unread = _get_dynamodb().count_query(
+            table_name,
+            'PK = :pk AND begins_with(SK, :sk)',
+            {':pk': pk, ':sk': 'NOTIFICATION#', ':unread': False},
+            filter_expression='#read = :unread',
+            expression_names={'#read': 'read'},
+            consistent_read=True
+        )
+        version = counter.get(UNREAD_VERSION_ATTRIBUTE)
+        values = {':count': unread, ':next': (version or 0) + 1, ':countedAt': datetime.utcnow().isoformat()}
+        if version is None:
+            condition = 'attribute_not_exists(#version)'
+        else:
+            condition = '#version = :version'
+            values[':version'] = version
+        try:
+            _get_dynamodb().update_item(
+                table_name,
+                _unread_counter_key(pk),
+                'SET #unread = :count, #version = :next, countedAt = :countedAt',
+                values,
+                {'#unread': UNREAD_ATTRIBUTE, '#version': UNREAD_VERSION_ATTRIBUTE},
+                condition_expression=condition
+            )
+            return unread
+        except Exception as e:
+            if not is_conditional_check_failed(e):
+                raise
+    print(f"Recuento de no leídas de {pk} abandonado tras {UNREAD_RESYNC_ATTEMPTS} intentos")
+    return None
+
+def _customer_ids(orders):
+    """customerId de cada (tenantId, orderId), leídos de los items INFO en un BatchGetItem"""
+    orders = [(tenant_id, order_id) for tenant_id, order_id in orders if order_id]
+    if not orders:
+        return {}
+    items = _get_dynamodb().batch_get(
+        os.environ['ORDERS_TABLE'],
+        [{'PK': order_pk(tenant_id, order_id), 'SK': ORDER_INFO_SK} for tenant_id, order_id in orders],
+        projection='tenantId, orderId, customerId'
+    )
+    return {(item.get('tenantId'), item['orderId']): item.get('customerId') for item in items}
+
 def _get_notification_message(detail_type, stage):
     """
     Genera mensaje de notificación basado en el tipo de evento
@@ -0,0 +1,92 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import boto3
+from botocore.config import Config
+
+# Config común para todos los clientes: keep-alive, pool dimensionado para los
+# hilos de trabajo y reintentos adaptativos (respetan el throttling de AWS)
+WORKER_THREADS = int(os.environ.get('WORKER_THREADS', 16))
+
+BOTO_CONFIG = Config(
+    tcp_keepalive=True,
+    max_pool_connections=int(os.environ.get('BOTO_MAX_POOL_CONNECTIONS', WORKER_THREADS * 2)),
+    connect_timeout=float(os.environ.get('BOTO_CONNECT_TIMEOUT', 2)),
+    read_timeout=float(os.environ.get('BOTO_READ_TIMEOUT', 10)),
+    retries={'mode': 'adaptive', 'max_attempts': int(os.environ.get('BOTO_MAX_ATTEMPTS', 5))}
+)
+
+# Todo vive a nivel de proceso: se reutiliza entre invocaciones "warm".
+# Reentrante: get_client/get_resource lo toman y llaman a get_session, que lo vuelve a tomar
+_lock = threading.RLock()
+_session = None
+_clients = {}
+_executor = None
+_local = threading.local()
+
+
+def get_session():
+    global _session
+    if _session is None:
+        with _lock:
+            if _session is None:
+                _session = boto3.session.Session()
+    return _session
+
+
+def get_client(service_name):
+    """Cliente low-level cacheado por proceso (los clientes sí son thread-safe)"""
+    client = _clients.get(service_name)
+    if client is None:
+        with _lock:
+            client = _clients.get(service_name)
+            if client is None:
+                # Crear clientes desde la misma sesión no es thread-safe: va bajo el lock
+                client = get_session().client(service_name, config=BOTO_CONFIG)
+                _clients[service_name] = client
+    return client
+
+
+def get_resource(service_name):
+    """Resource cacheado por hilo (los resources de boto3 no son thread-safe)"""
+    resources = _local.__dict__.setdefault('resources', {})
+    resource = resources.get(service_name)
+    if resource is None:
+        with _lock:
+            resource = get_session().resource(service_name, config=BOTO_CONFIG)
+        resources[service_name] = resource
+    return resource
+
+
+def get_table(table_name):
+    """Objeto Table de DynamoDB cacheado por hilo y por nombre"""
+    tables = _local.__dict__.setdefault('tables', {})
+    table = tables.get(table_name)
+    if table is None:
+        table = get_resource('dynamodb').Table(table_name)
+        tables[table_name] = table
+    return table
+
+
+def _mark_worker():
+    _local.is_worker = True
+
+
+def in_worker_thread():
+    """True si el hilo actual pertenece al pool compartido"""
+    return getattr(_local, 'is_worker', False)
+
+
+def get_executor():
+    """
+    Pool de hilos compartido por proceso. Sus hilos sobreviven entre
+    invocaciones, así que sus resources y conexiones también. Un trabajo que ya
+    corre dentro del pool no debe esperar a otro trabajo del pool (ver
+    in_worker_thread) para no agotar los hilos.
+    """
+    global _executor
+    if _executor is None:
+        with _lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=WORKER_THREADS, initializer=_mark_worker)
+    return _executor
@@ -1,16 +1,196 @@
-import boto3
+import base64
+import functools
+import json
+import queue
+import random
+import threading
+import time
 import os
+from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+
+from .clients import get_executor, get_resource, get_table, in_worker_thread
+
+# Segmentos por defecto para los scans paralelos (Segment/TotalSegments)
+SCAN_SEGMENTS = int(os.environ.get('SCAN_SEGMENTS', 4))
+
+# Límites de BatchGetItem / BatchWriteItem y política de reintentos
+BATCH_GET_SIZE = 100
+BATCH_WRITE_SIZE = 25
+BATCH_MAX_ATTEMPTS = 6
+BATCH_BACKOFF_BASE = 0.05
+BATCH_BACKOFF_CAP = 2.0
+
+_serializer = TypeSerializer()
+_deserializer = TypeDeserializer()
+_STREAM_DONE = object()
+
+
+def encode_cursor(last_evaluated_key):
+    """Convierte un LastEvaluatedKey en un cursor opaco (base64 url-safe)"""
+    if not last_evaluated_key:
+        return None
+    wire = {k: _serializer.serialize(v) for k, v in last_evaluated_key.items()}
+    raw = json.dumps(wire, separators=(',', ':'), sort_keys=True).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """Inverso de encode_cursor. Lanza ValueError si el cursor no es válido"""
+    if not cursor:
+        return None
+    try:
+        wire = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return {k: _deserializer.deserialize(v) for k, v in wire.items()}
+    except Exception:
+        raise ValueError("Cursor de paginación inválido")
+
+
+class ItemIterator:
+    """
+    Iterador perezoso sobre los items de un scan/query paginado.
+
+    Pide las páginas a DynamoDB solo a medida que se consumen. `cursor` apunta
+    al final de la última página entregada completa: si el consumidor corta a
+    mitad de página, reanudar desde `cursor` vuelve a entregar esa página.
+    """
+
+    def __init__(self, fetch_page, kwargs, page_size=None, max_items=None, cursor=None):
+        self._fetch_page = fetch_page
+        self._kwargs = kwargs
+        self._page_size = page_size
+        self._max_items = max_items
+        self._start_key = decode_cursor(cursor)
+        self.cursor = cursor
+        self.pages = 0
+        self.exhausted = False
+
+    def __iter__(self):
+        remaining = self._max_items
+        start_key = self._start_key
+        while True:
+            kwargs = dict(self._kwargs)
+            limit = self._page_size
+            if remaining is not None:
+                # Con Limit = lo que falta, DynamoDB corta justo donde paramos
+                limit = remaining if limit is None else min(limit, remaining)
+            if limit:
+                kwargs['Limit'] = limit
+            if start_key:
+                kwargs['ExclusiveStartKey'] = start_key
+
+            response = self._fetch_page(**kwargs)
+            self.pages += 1
+            items = response.get('Items', [])
+            for item in items:
+                yield item
+
+            start_key = response.get('LastEvaluatedKey')
+            self.cursor = encode_cursor(start_key)
+            if not start_key:
+                self.exhausted = True
+                return
+            if remaining is not None:
+                remaining -= len(items)
+                if remaining <= 0:
+                    return
+
+
+def is_conditional_check_failed(error):
+    """True si la excepción es un ConditionalCheckFailed de una escritura condicional"""
+    response = getattr(error, 'response', None) or {}
+    return response.get('Error', {}).get('Code') == 'ConditionalCheckFailedException'
+
+
+def cancellation_reasons(error):
+    """Códigos por operación de un TransactionCanceledException ('None' si esa operación no falló)"""
+    response = getattr(error, 'response', None) or {}
+    if response.get('Error', {}).get('Code') != 'TransactionCanceledException':
+        return []
+    return [reason.get('Code', 'None') for reason in response.get('CancellationReasons', [])]
+
+
+def add_operation(table_name, key, increments):
+    """Operación Update para transact_write con un ADD atómico por atributo"""
+    names, values, parts = {}, {}, []
+    for i, (attribute, delta) in enumerate(increments.items()):
+        names[f"#a{i}"] = attribute
+        values[f":v{i}"] = delta
+        parts.append(f"#a{i} :v{i}")
+    return {
+        'Update': {
+            'TableName': table_name,
+            'Key': key,
+            'UpdateExpression': 'ADD ' + ', '.join(parts),
+            'ExpressionAttributeNames': names,
+            'ExpressionAttributeValues': values
+        }
+    }
+
+
+def _backoff(attempt):
+    # Exponencial con jitter completo, para no reintentar todos a la vez
+    time.sleep(random.uniform(0, min(BATCH_BACKOFF_CAP, BATCH_BACKOFF_BASE * (2 ** attempt))))
+
+
+def _chunks(values, size):
+    return [values[i:i + size] for i in range(0, len(values), size)]
+
+
+def _read_kwargs(filter_expression=None, expression_attribute_values=None, expression_names=None,
+                 index_name=None, projection=None):
+    kwargs = {}
+    if filter_expression:
+        kwargs['FilterExpression'] = filter_expression
+    if expression_attribute_values:
+        kwargs['ExpressionAttributeValues'] = expression_attribute_values
+    if expression_names:
+        kwargs['ExpressionAttributeNames'] = expression_names
+    if index_name:
+        kwargs['IndexName'] = index_name
+    if projection:
+        kwargs['ProjectionExpression'] = projection
+    return kwargs
+
 
 class DynamoDB:
-    def __init__(self):
-        self.client = boto3.resource('dynamodb')
+    # Resources, Tables y conexiones salen de shared.clients (cache por proceso/hilo),
+    # así que una misma instancia se puede usar desde cualquier hilo
+
+    @property
+    def client(self):
+        return get_resource('dynamodb')
 
-    def put_item(self, table_name, item):
-        table = self.client.Table(table_name)
-        table.put_item(Item=item)
+    def _map(self, worker, values):
+        # Un solo valor no justifica usar hilos, y dentro del pool se corre en línea
+        if len(values) <= 1 or in_worker_thread():
+            return [worker(value) for value in values]
+        return list(get_executor().map(worker, values))
 
-    def update_item(self, table_name, key, update_expression, expression_values, expression_names=None):
-        table = self.client.Table(table_name)
+    def _scan_segment_pages(self, table_name, kwargs, segment, total_segments):
+        table = get_table(table_name)
+        kwargs = dict(kwargs, Segment=segment, TotalSegments=total_segments)
+        while True:
+            response = table.scan(**kwargs)
+            yield response
+            if 'LastEvaluatedKey' not in response:
+                return
+            kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    def put_item(self, table_name, item, condition_expression=None, expression_values=None,
+                 expression_names=None):
+        table = get_table(table_name)
+        kwargs = {'Item': item}
+        if condition_expression:
+            kwargs['ConditionExpression'] = condition_expression
+        if expression_values:
+            kwargs['ExpressionAttributeValues'] = expression_values
+        if expression_names:
+            kwargs['ExpressionAttributeNames'] = expression_names
+        table.put_item(**kwargs)
+
+    def update_item(self, table_name, key, update_expression, expression_values, expression_names=None,
+                    condition_expression=None):
+        table = get_table(table_name)
         kwargs = {
             'Key': key,
             'UpdateExpression': update_expression,
@@ -18,17 +198,19 @@ class DynamoDB:
         }
         if expression_names:
             kwargs['ExpressionAttributeNames'] = expression_names
+        if condition_expression:
+            kwargs['ConditionExpression'] = condition_expression
         table.update_item(**kwargs)
 
     def query(self, table_name, key_condition_expression, expression_attribute_values):
-        table = self.client.Table(table_name)
+        table = get_table(table_name)
         return table.query(
             KeyConditionExpression=key_condition_expression,
             ExpressionAttributeValues=expression_attribute_values
         )
 
     def scan(self, table_name, filter_expression=None, expression_attribute_values=None):
-        table = self.client.Table(table_name)
+        table = get_table(table_name)
         if filter_expression:
             return table.scan(
                 FilterExpression=filter_expression,
@@ -36,6 +218,244 @@ class DynamoDB:
             )
         return table.scan()
 
-    def get_item(self, table_name, key):
-        table = self.client.Table(table_name)
+    def delete_item(self, table_name, key, condition_expression=None, expression_values=None,
+                    expression_names=None):
+        table = get_table(table_name)
+        kwargs = {'Key': key}
+        if condition_expression:
+            kwargs['ConditionExpression'] = condition_expression
+        if expression_values:
+            kwargs['ExpressionAttributeValues'] = expression_values
+        if expression_names:
+            kwargs['ExpressionAttributeNames'] = expression_names
+        table.delete_item(**kwargs)
+
+    def get_item(self, table_name, key, consistent_read=False):
+        table = get_table(table_name)
+        if consistent_read:
+            return table.get_item(Key=key, ConsistentRead=True)
         return table.get_item(Key=key)
+
+    def transact_write(self, operations, client_request_token=None):
+        """
+        TransactWriteItems (hasta 100 operaciones Put/Update/Delete/ConditionCheck,
+        cada una con su TableName). El client del resource acepta tipos nativos.
+        """
+        kwargs = {'TransactItems': operations}
+        if client_request_token:
+            kwargs['ClientRequestToken'] = client_request_token
+        get_resource('dynamodb').meta.client.transact_write_items(**kwargs)
+
+    def iter_query(self, table_name, key_condition_expression, expression_attribute_values,
+                   filter_expression=None, expression_names=None, index_name=None, projection=None,
+                   scan_index_forward=True, page_size=None, max_items=None, cursor=None,
+                   consistent_read=False):
+        """
+        Query paginado que sigue LastEvaluatedKey de forma perezosa.
+        Devuelve un ItemIterator; su atributo `cursor` permite reanudar.
+        """
+        table = get_table(table_name)
+        kwargs = _read_kwargs(filter_expression, expression_attribute_values, expression_names,
+                              index_name, projection)
+        kwargs['KeyConditionExpression'] = key_condition_expression
+        if not scan_index_forward:
+            kwargs['ScanIndexForward'] = False
+        if consistent_read:
+            kwargs['ConsistentRead'] = True
+        return ItemIterator(table.query, kwargs, page_size=page_size, max_items=max_items, cursor=cursor)
+
+    def iter_scan(self, table_name, filter_expression=None, expression_attribute_values=None,
+                  expression_names=None, index_name=None, projection=None,
+                  page_size=None, max_items=None, cursor=None):
+        """
+        Scan paginado que sigue LastEvaluatedKey de forma perezosa.
+        Devuelve un ItemIterator; su atributo `cursor` permite reanudar.
+        """
+        table = get_table(table_name)
+        kwargs = _read_kwargs(filter_expression, expression_attribute_values, expression_names,
+                              index_name, projection)
+        return ItemIterator(table.scan, kwargs, page_size=page_size, max_items=max_items, cursor=cursor)
+
+    def iter_parallel_scan(self, table_name, filter_expression=None, expression_attribute_values=None,
+                           expression_names=None, projection=None, page_size=None, total_segments=None):
+        """
+        Scan segmentado en paralelo: un hilo por segmento, items entregados en
+        streaming a medida que llegan las páginas (sin orden garantizado).
+        """
+        total_segments = total_segments or SCAN_SEGMENTS
+        kwargs = _read_kwargs(filter_expression, expression_attribute_values, expression_names,
+                              projection=projection)
+        if page_size:
+            kwargs['Limit'] = page_size
+
+        # Cola acotada: si el consumidor va lento, los segmentos esperan
+        pages = queue.Queue(maxsize=total_segments * 2)
+        stop = threading.Event()
+
+        def offer(value):
+            while not stop.is_set():
+                try:
+                    pages.put(value, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def worker(segment):
+            try:
+                for response in self._scan_segment_pages(table_name, kwargs, segment, total_segments):
+                    if not offer(response.get('Items', [])):
+                        return
+            except Exception as e:
+                offer(e)
+            finally:
+                offer(_STREAM_DONE)
+
+        if in_worker_thread():
+            # Sin hilos libres garantizados: se recorren los segmentos en secuencia
+            for segment in range(total_segments):
+                for response in self._scan_segment_pages(table_name, kwargs, segment, total_segments):
+                    for item in response.get('Items', []):
+                        yield item
+            return
+
+        try:
+            for segment in range(total_segments):
+                get_executor().submit(worker, segment)
+            pending = total_segments
+            while pending:
+                page = pages.get()
+                if page is _STREAM_DONE:
+                    pending -= 1
+                elif isinstance(page, Exception):
+                    raise page
+                else:
+                    for item in page:
+                        yield item
+        finally:
+            stop.set()
+
+    def parallel_scan(self, table_name, reducer, initial, combine=None, filter_expression=None,
+                      expression_attribute_values=None, expression_names=None, projection=None,
+                      page_size=None, total_segments=None):
+        """
+        Scan paralelo con agregación por segmento.
+
+        Cada segmento arranca con `initial()` y pliega sus items con
+        `reducer(acc, item)`. Si se pasa `combine(a, b)` se devuelve el
+        acumulador combinado; si no, la lista de acumuladores por segmento.
+        """
+        total_segments = total_segments or SCAN_SEGMENTS
+        kwargs = _read_kwargs(filter_expression, expression_attribute_values, expression_names,
+                              projection=projection)
+        if page_size:
+            kwargs['Limit'] = page_size
+
+        def worker(segment):
+            acc = initial()
+            for response in self._scan_segment_pages(table_name, kwargs, segment, total_segments):
+                for item in response.get('Items', []):
+                    acc = reducer(acc, item)
+            return acc
+
+        partials = self._map(worker, list(range(total_segments)))
+        if combine is None:
+            return partials
+        return functools.reduce(combine, partials)
+
+    def count(self, table_name, filter_expression=None, expression_attribute_values=None,
+              expression_names=None, total_segments=None):
+        """Cuenta los items de un scan (Select=COUNT) recorriendo los segmentos en paralelo"""
+        total_segments = total_segments or SCAN_SEGMENTS
+        kwargs = _read_kwargs(filter_expression, expression_attribute_values, expression_names)
+        kwargs['Select'] = 'COUNT'
+
+        def worker(segment):
+            return sum(response.get('Count', 0)
+                       for response in self._scan_segment_pages(table_name, kwargs, segment, total_segments))
+
+        return sum(self._map(worker, list(range(total_segments))))
+
+    def count_query(self, table_name, key_condition_expression, expression_attribute_values,
+                    filter_expression=None, expression_names=None, index_name=None, consistent_read=False):
+        """Cuenta los items de un query (Select=COUNT) siguiendo LastEvaluatedKey"""
+        table = get_table(table_name)
+        kwargs = _read_kwargs(filter_expression, expression_attribute_values, expression_names, index_name)
+        kwargs['KeyConditionExpression'] = key_condition_expression
+        kwargs['Select'] = 'COUNT'
+        if consistent_read:
+            kwargs['ConsistentRead'] = True
+        total = 0
+        while True:
+            response = table.query(**kwargs)
+            total += response.get('Count', 0)
+            if not response.get('LastEvaluatedKey'):
+                return total
+            kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    def batch_get(self, table_name, keys, projection=None, expression_names=None, consistent_read=False):
+        """
+        BatchGetItem en bloques de 100 claves lanzados en paralelo en el pool compartido.
+        Reintenta UnprocessedKeys con backoff. Devuelve los items encontrados,
+        sin orden garantizado; las claves inexistentes simplemente no aparecen.
+        """
+        unique = list({tuple(sorted(key.items())): key for key in keys}.values())
+        if not unique:
+            return []
+
+        def fetch(chunk):
+            resource = get_resource('dynamodb')
+            table_request = {'Keys': chunk}
+            if projection:
+                table_request['ProjectionExpression'] = projection
+            if expression_names:
+                table_request['ExpressionAttributeNames'] = expression_names
+            if consistent_read:
+                table_request['ConsistentRead'] = True
+            request = {table_name: table_request}
+            found = []
+            for attempt in range(BATCH_MAX_ATTEMPTS):
+                response = resource.batch_get_item(RequestItems=request)
+                found.extend(response.get('Responses', {}).get(table_name, []))
+                request = response.get('UnprocessedKeys') or {}
+                if not request:
+                    return found
+                _backoff(attempt)
+            raise RuntimeError(f"BatchGetItem: claves sin procesar en {table_name} tras {BATCH_MAX_ATTEMPTS} intentos")
+
+        results = self._map(fetch, _chunks(unique, BATCH_GET_SIZE))
+        return [item for chunk in results for item in chunk]
+
+    def batch_write(self, table_name, puts=None, deletes=None):
+        """
+        BatchWriteItem en bloques de 25 operaciones lanzados en paralelo.
+        `puts` son items completos y `deletes` claves. Reintenta UnprocessedItems
+        con backoff. Una misma clave no puede repetirse dentro de la llamada.
+        """
+        self.batch_write_multi({table_name: {'puts': puts or [], 'deletes': deletes or []}})
+
+    def batch_write_multi(self, writes_by_table):
+        """Igual que batch_write pero mezclando varias tablas: {tabla: {'puts': [...], 'deletes': [...]}}"""
+        requests = []
+        for table_name, writes in writes_by_table.items():
+            for item in writes.get('puts') or []:
+                requests.append((table_name, {'PutRequest': {'Item': item}}))
+            for key in writes.get('deletes') or []:
+                requests.append((table_name, {'DeleteRequest': {'Key': key}}))
+        if not requests:
+            return
+
+        def write(chunk):
+            resource = get_resource('dynamodb')
+            request = {}
+            for table_name, write_request in chunk:
+                request.setdefault(table_name, []).append(write_request)
+            for attempt in range(BATCH_MAX_ATTEMPTS):
+                response = resource.batch_write_item(RequestItems=request)
+                request = response.get('UnprocessedItems') or {}
+                if not request:
+                    return
+                _backoff(attempt)
+            raise RuntimeError(f"BatchWriteItem: escrituras sin procesar tras {BATCH_MAX_ATTEMPTS} intentos")
+
+        self._map(write, _chunks(requests, BATCH_WRITE_SIZE))
@@ -1,29 +1,128 @@
-import boto3
+import functools
 import json
 import os
+import random
+import time
+
+from .clients import get_client
+
+# Límites de PutEvents
+PUT_EVENTS_MAX_ENTRIES = 10
+PUT_EVENTS_MAX_BYTES = 256 * 1024
+PUT_EVENTS_MAX_ATTEMPTS = 4
+
+
+def _entry_size(entry):
+    # Misma cuenta que hace EventBridge: 14 bytes de Time + los campos de texto
+    size = 14
+    for field in ('Source', 'DetailType', 'Detail', 'EventBusName'):
+        if entry.get(field):
+            size += len(entry[field].encode('utf-8'))
+    return size
+
+
+def _batches(entries):
+    batch, batch_bytes = [], 0
+    for entry in entries:
+        size = _entry_size(entry)
+        if batch and (len(batch) == PUT_EVENTS_MAX_ENTRIES or batch_bytes + size > PUT_EVENTS_MAX_BYTES):
+            yield batch
+            batch, batch_bytes = [], 0
+        batch.append(entry)
+        batch_bytes += size
+    if batch:
+        yield batch
+
 
 class EventBridge:
-    def __init__(self):
+    def __init__(self, buffered=False):
         self.client = None
         self.bus_name = None  # Lazy load
+        # En modo buffered los eventos se acumulan hasta flush() (ver flush_events)
+        self.buffered = buffered
+        self._pending = []
 
     def _get_client(self):
         if self.client is None:
-            self.client = boto3.client('events')
+            self.client = get_client('events')
             self.bus_name = os.environ.get('EVENT_BUS_NAME')  # Use .get() to avoid KeyError if missing
             if not self.bus_name:
                 raise ValueError("EVENT_BUS_NAME environment variable not set")
         return self.client
 
     def publish_event(self, source, detail_type, detail):
-        client = self._get_client()  # Lazy init here
-        client.put_events(
-            Entries=[
-                {
-                    'Source': source,
-                    'DetailType': detail_type,
-                    'Detail': json.dumps(detail),
-                    'EventBusName': self.bus_name
-                }
-            ]
-        )
+        self._get_client()  # Lazy init here
+        entry = {
+            'Source': source,
+            'DetailType': detail_type,
+            'Detail': json.dumps(detail),
+            'EventBusName': self.bus_name
+        }
+        if _entry_size(entry) > PUT_EVENTS_MAX_BYTES:
+            raise ValueError(f"Evento {detail_type} supera el límite de {PUT_EVENTS_MAX_BYTES} bytes")
+        self._pending.append(entry)
+        if not self.buffered:
+            self.flush()
+
+    def flush(self):
+        """
+        Envía los eventos pendientes en lotes de hasta 10 entradas / 256 KB.
+        Solo se reintentan las entradas que PutEvents devolvió con error.
+        Si algo no sale (rechazos que agotaron los reintentos o un error del
+        cliente) queda pendiente para el próximo flush y se lanza la excepción.
+        Devuelve cuántos eventos se publicaron.
+        """
+        if not self._pending:
+            return 0
+        client = self._get_client()
+        pending, self._pending = self._pending, []
+        batches = list(_batches(pending))
+
+        published, failed = 0, []
+        for index, batch in enumerate(batches):
+            try:
+                rejected = self._send(client, batch)
+            except Exception:
+                self._pending = failed + [entry for unsent in batches[index:] for entry in unsent] + self._pending
+                raise
+            published += len(batch) - len(rejected)
+            failed.extend(rejected)
+        if failed:
+            self._pending = failed + self._pending
+            raise RuntimeError(f"PutEvents: {len(failed)} de {len(pending)} eventos no se pudieron publicar")
+        return published
+
+    def _send(self, client, entries):
+        for attempt in range(PUT_EVENTS_MAX_ATTEMPTS):
+            if attempt:
+                time.sleep(random.uniform(0, 0.1 * (2 ** attempt)))
+            response = client.put_events(Entries=entries)
+            if not response.get('FailedEntryCount'):
+                return []
+            # Las respuestas vienen en el mismo orden que las entradas
+            entries = [entry for entry, result in zip(entries, response.get('Entries', []))
+                       if result.get('ErrorCode')]
+        return entries
+
+
+def flush_events(get_publisher):
+    """
+    Decorador para handlers Lambda: publica de una vez los eventos acumulados
+    por el EventBridge buffered cuando el handler termina, incluso si falló
+    (lo ya escrito en DynamoDB igual debe anunciarse).
+    """
+    def decorator(handler):
+        @functools.wraps(handler)
+        def wrapper(event, context):
+            try:
+                result = handler(event, context)
+            except Exception:
+                try:
+                    get_publisher().flush()
+                except Exception as e:
+                    print(f"Error publicando eventos pendientes: {str(e)}")
+                raise
+            get_publisher().flush()
+            return result
+        return wrapper
+    return decorator
@@ -0,0 +1,139 @@
+from datetime import datetime
+from decimal import Decimal
+
+# Etapas del flujo de un pedido, en el orden en que las recorre Step Functions.
+# La posición en la lista es el número de secuencia que viaja en los eventos.
+ORDER_STAGES = ['CREATED', 'COOKING', 'PACKAGING', 'DELIVERY', 'DELIVERED']
+STAGE_SEQUENCE = {stage: index for index, stage in enumerate(ORDER_STAGES)}
+
+# Local que despacha cuando el pedido no indica storeId
+DEFAULT_STORE_ID = 'principal'
+
+ORDER_INFO_SK = 'INFO'
+ORDER_VIEW_SK = 'VIEW'
+
+# GSI de pedidos por día (dayBucket -> createdAt). Solo los items INFO llevan dayBucket
+ORDER_DAY_INDEX = 'dayBucket-createdAt-index'
+
+# Pseudo-etapa para el tiempo de punta a punta (CREATED -> DELIVERED)
+ORDER_TOTAL_STAGE = 'TOTAL'
+
+
+def order_pk(tenant_id, order_id):
+    return f"TENANT#{tenant_id}#ORDER#{order_id}"
+
+
+def day_bucket(tenant_id, day):
+    """Partición del GSI por día; `day` es una fecha o un timestamp ISO"""
+    day = day[:10] if isinstance(day, str) else day.isoformat()
+    return f"TENANT#{tenant_id}#DAY#{day}"
+
+
+def previous_stage(stage):
+    """Etapa anterior en el flujo, o None para CREATED"""
+    sequence = STAGE_SEQUENCE.get(stage, 0)
+    return ORDER_STAGES[sequence - 1] if sequence > 0 else None
+
+
+def event_stage(detail_type, detail):
+    """Etapa del pedido a la que se refiere un evento de pardos.orders / pardos.etapas"""
+    if detail_type == 'OrderCreated':
+        return 'CREATED'
+    if detail_type == 'OrderDelivered':
+        return 'DELIVERED'
+    return detail.get('stage') or detail.get('step')
+
+
+def _set_earliest(entry, field, timestamp):
+    # Ante duplicados o reintentos con otra hora gana siempre la más temprana
+    if timestamp and (not entry.get(field) or timestamp < entry[field]):
+        entry[field] = timestamp
+
+
+def apply_order_event(view, detail_type, detail):
+    """
+    Aplica un evento de pedido a la vista materializada (dict) y devuelve
+    (vista, cambió). Es idempotente y no depende del orden de llegada:
+    los tiempos de la línea de tiempo se quedan con el valor más temprano
+    visto, y status/currentStep solo avanzan si la secuencia del evento es
+    mayor que la `version` ya aplicada.
+    """
+    stage = event_stage(detail_type, detail)
+    if stage not in STAGE_SEQUENCE:
+        return view, False
+
+    before = repr(view)
+    sequence = int(detail.get('sequence', STAGE_SEQUENCE[stage]))
+    timestamp = detail.get('timestamp')
+    timeline = view.setdefault('timeline', {})
+
+    if detail_type == 'OrderCreated':
+        view.setdefault('createdAt', timestamp)
+        view.setdefault('total', Decimal(str(detail.get('total', 0))))
+        view.setdefault('items', [
+            {
+                'productId': item.get('productId', ''),
+                'qty': int(item.get('qty', 0)),
+                'price': Decimal(str(item.get('price', 0)))
+            }
+            for item in detail.get('items', [])
+        ])
+        customer = view.setdefault('customer', {})
+        if detail.get('customerId'):
+            customer.setdefault('customerId', detail['customerId'])
+
+    entry = timeline.setdefault(stage, {})
+    if detail_type == 'OrderStageCompleted':
+        _set_earliest(entry, 'finishedAt', timestamp)
+    else:
+        _set_earliest(entry, 'startedAt', timestamp)
+        # Empezar una etapa cierra la anterior
+        previous = previous_stage(stage)
+        if previous:
+            previous_entry = timeline.setdefault(previous, {})
+            _set_earliest(previous_entry, 'finishedAt', timestamp)
+        if stage == 'DELIVERED':
+            _set_earliest(entry, 'finishedAt', timestamp)
+
+    if sequence > int(view.get('version', -1)):
+        view['version'] = sequence
+        view['currentStep'] = stage
+        if stage == 'DELIVERED':
+            view['status'] = 'COMPLETED'
+        else:
+            view['status'] = detail.get('status') or ('CREATED' if stage == 'CREATED' else 'IN_PROGRESS')
+
+    return view, repr(view) != before
+
+
+def _seconds_between(start, end):
+    try:
+        return (datetime.fromisoformat(end) - datetime.fromisoformat(start)).total_seconds()
+    except (TypeError, ValueError):
+        return None
+
+
+def new_stage_durations(previous_timeline, timeline):
+    """
+    Duraciones en segundos de las etapas que quedaron completas (inicio y fin)
+    entre dos versiones de la línea de tiempo, más TOTAL cuando se completa el
+    recorrido CREATED -> DELIVERED. Cada duración aparece una sola vez por
+    pedido, aunque los eventos lleguen duplicados o desordenados.
+    """
+    def _span(tl, start_stage, end_stage, end_field):
+        start = tl.get(start_stage, {}).get('startedAt')
+        end = tl.get(end_stage, {}).get(end_field)
+        return start, end
+
+    durations = {}
+    spans = {stage: (stage, stage, 'finishedAt') for stage in ORDER_STAGES if stage != 'DELIVERED'}
+    spans[ORDER_TOTAL_STAGE] = ('CREATED', 'DELIVERED', 'startedAt')
+    for name, (start_stage, end_stage, end_field) in spans.items():
+        if all(_span(previous_timeline, start_stage, end_stage, end_field)):
+            continue
+        start, end = _span(timeline, start_stage, end_stage, end_field)
+        if start and end:
+            seconds = _seconds_between(start, end)
+            if seconds is not None and seconds >= 0:
+                durations[name] = seconds
+    return durations
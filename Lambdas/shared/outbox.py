@@ -0,0 +1,67 @@
+import json
+from datetime import datetime, timedelta
+
+from .events import EventBridge
+
+# Outbox transaccional: el evento de una transición se escribe como item en
+# la misma TransactWriteItems que la cambia, se publica después del commit y
+# recién entonces se borra. Si la Lambda muere en el medio, el item queda
+# pendiente y el relay programado (cleanup.relay_outbox) lo publica. La
+# entrega es al menos una vez: los consumidores ya toleran duplicados.
+OUTBOX_STATUS = 'OUTBOX_PENDING'
+OUTBOX_INDEX = 'status-expiresAt-index'
+OUTBOX_SK_PREFIX = 'OUTBOX#'
+# Antigüedad mínima para que el relay tome un item: antes de eso es probable
+# que la Lambda que lo escribió todavía lo esté publicando
+OUTBOX_RELAY_GRACE_SECONDS = 60
+
+
+def outbox_item(order_id, step, event, created_at):
+    """
+    Item de outbox para el evento de la transición a `step`. La clave es
+    determinística: una transición condicional escribe a lo sumo uno.
+    expiresAt = createdAt lo deja en el GSI status-expiresAt ordenado por edad.
+    """
+    return {
+        'PK': f"ORDER#{order_id}",
+        'SK': f"{OUTBOX_SK_PREFIX}{step}",
+        'orderId': order_id,
+        'status': OUTBOX_STATUS,
+        'source': event['source'],
+        'detailType': event['detail_type'],
+        # JSON para que el detail vuelva tal cual (sin Decimal) al publicarlo
+        'detail': json.dumps(event['detail']),
+        'createdAt': created_at,
+        'expiresAt': created_at
+    }
+
+
+def publish_outbox(db, table_name, items):
+    """
+    Publica los items de outbox y, una vez aceptados por EventBridge, los
+    borra. Usa un publisher propio: si la publicación falla la excepción
+    sube, los items quedan para el relay y no queda nada pendiente en el
+    buffer de la invocación. Devuelve cuántos se publicaron.
+    """
+    if not items:
+        return 0
+    publisher = EventBridge(buffered=True)
+    for item in items:
+        publisher.publish_event(item['source'], item['detailType'], json.loads(item['detail']))
+    publisher.flush()
+    db.batch_write(table_name, deletes=[{'PK': item['PK'], 'SK': item['SK']} for item in items])
+    return len(items)
+
+
+def pending_outbox(db, table_name, now=None, grace_seconds=OUTBOX_RELAY_GRACE_SECONDS, max_items=None):
+    """Items de outbox sin publicar con más de `grace_seconds` de antigüedad"""
+    # createdAt viene de datetime.utcnow() en las transiciones
+    before = ((now or datetime.utcnow()) - timedelta(seconds=grace_seconds)).isoformat()
+    return db.iter_query(
+        table_name=table_name,
+        index_name=OUTBOX_INDEX,
+        key_condition_expression='#s = :status AND expiresAt < :before',
+        expression_attribute_values={':status': OUTBOX_STATUS, ':before': before},
+        expression_names={'#s': 'status'},
+        max_items=max_items
+    )
@@ -0,0 +1,101 @@
+import math
+from collections import Counter
+
+# Sketch de cuantiles con buckets logarítmicos (estilo DDSketch): cada
+# duración cae en el bucket ceil(log_gamma(x)), así que cualquier cuantil
+# se estima con error relativo <= SKETCH_RELATIVE_ACCURACY. Dos sketches se
+# combinan sumando buckets, lo que permite guardarlo en DynamoDB como
+# atributos b<índice> actualizados con ADD atómicos.
+SKETCH_RELATIVE_ACCURACY = 0.02
+SKETCH_GAMMA = (1 + SKETCH_RELATIVE_ACCURACY) / (1 - SKETCH_RELATIVE_ACCURACY)
+SKETCH_MIN_VALUE = 1.0  # segundos; lo menor va al bucket cero
+
+SKETCH_COUNT = 'count'
+SKETCH_SUM = 'sum'
+SKETCH_ZERO_BUCKET = 'z'
+SKETCH_BUCKET_PREFIX = 'b'
+
+_LOG_GAMMA = math.log(SKETCH_GAMMA)
+
+
+def latency_pk(tenant_id):
+    return f"TENANT#{tenant_id}#LATENCY"
+
+
+def latency_sk(stage):
+    return f"STAGE#{stage}"
+
+
+def bucket_index(value):
+    return math.ceil(math.log(value) / _LOG_GAMMA)
+
+
+def bucket_value(index):
+    # Punto del bucket (gamma^(i-1), gamma^i] que minimiza el error relativo
+    return 2 * SKETCH_GAMMA ** index / (SKETCH_GAMMA + 1)
+
+
+def sketch_increments(value):
+    """Deltas (para un ADD) que agregan una observación a un sketch guardado"""
+    bucket = SKETCH_ZERO_BUCKET if value < SKETCH_MIN_VALUE else f"{SKETCH_BUCKET_PREFIX}{bucket_index(value)}"
+    return {SKETCH_COUNT: 1, SKETCH_SUM: int(round(value)), bucket: 1}
+
+
+class LatencySketch:
+    """Sketch de cuantiles en memoria constante (un contador por bucket)"""
+
+    def __init__(self):
+        self.buckets = Counter()
+        self.zero = 0
+        self.count = 0
+        self.total = 0
+
+    @classmethod
+    def from_item(cls, item):
+        """Reconstruye el sketch desde un item de DynamoDB (atributos b<i>, z, count, sum)"""
+        sketch = cls()
+        for attribute, value in (item or {}).items():
+            if attribute == SKETCH_ZERO_BUCKET:
+                sketch.zero = int(value)
+            elif attribute.startswith(SKETCH_BUCKET_PREFIX):
+                try:
+                    sketch.buckets[int(attribute[len(SKETCH_BUCKET_PREFIX):])] = int(value)
+                except ValueError:
+                    continue
+        sketch.count = int((item or {}).get(SKETCH_COUNT, 0))
+        sketch.total = int((item or {}).get(SKETCH_SUM, 0))
+        return sketch
+
+    def add(self, value):
+        if value < SKETCH_MIN_VALUE:
+            self.zero += 1
+        else:
+            self.buckets[bucket_index(value)] += 1
+        self.count += 1
+        self.total += int(round(value))
+        return self
+
+    def merge(self, other):
+        self.buckets.update(other.buckets)
+        self.zero += other.zero
+        self.count += other.count
+        self.total += other.total
+        return self
+
+    def quantile(self, q):
+        """Valor estimado del cuantil q (0..1), o None si el sketch está vacío"""
+        observed = self.zero + sum(self.buckets.values())
+        if not observed:
+            return None
+        rank = q * (observed - 1)
+        if rank < self.zero:
+            return 0.0
+        seen = self.zero
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen > rank:
+                return bucket_value(index)
+        return bucket_value(max(self.buckets))
+
+    def mean(self):
+        return self.total / self.count if self.count else None
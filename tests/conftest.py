@@ -0,0 +1,116 @@
+import os
+import sys
+
+import pytest
+
+# Igual que en el runtime de Lambda: los handlers importan shared.* y ms_* desde Lambdas/
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'Lambdas'))
+
+# Credenciales falsas: ningún test debe llegar a AWS de verdad
+os.environ['AWS_DEFAULT_REGION'] = 'us-east-1'
+os.environ['AWS_ACCESS_KEY_ID'] = 'testing'
+os.environ['AWS_SECRET_ACCESS_KEY'] = 'testing'
+os.environ.pop('AWS_PROFILE', None)
+
+os.environ['ORDERS_TABLE'] = 'OrdersTable-test'
+os.environ['STEPS_TABLE'] = 'StepsTable-test'
+os.environ['NOTIFICATIONS_TABLE'] = 'NotificationsTable-test'
+os.environ['COUNTERS_TABLE'] = 'CountersTable-test'
+os.environ['EVENT_BUS_NAME'] = 'PardosEventBus-test'
+
+# Mismo esquema que serverless.yml (solo lo que usan los tests)
+TABLES = {
+    'ORDERS_TABLE': [
+        ('dayBucket-createdAt-index', 'dayBucket', 'createdAt'),
+    ],
+    'STEPS_TABLE': [
+        ('status-expiresAt-index', 'status', 'expiresAt'),
+        ('stage-status-index', 'SK', 'status'),
+    ],
+    'NOTIFICATIONS_TABLE': [],
+    'COUNTERS_TABLE': [],
+}
+
+
+def _create_table(client, table_name, indexes):
+    attributes = {'PK', 'SK'} | {name for _, hash_key, range_key in indexes for name in (hash_key, range_key)}
+    kwargs = {
+        'TableName': table_name,
+        'AttributeDefinitions': [{'AttributeName': name, 'AttributeType': 'S'} for name in sorted(attributes)],
+        'KeySchema': [{'AttributeName': 'PK', 'KeyType': 'HASH'}, {'AttributeName': 'SK', 'KeyType': 'RANGE'}],
+        'BillingMode': 'PAY_PER_REQUEST',
+    }
+    if indexes:
+        kwargs['GlobalSecondaryIndexes'] = [
+            {
+                'IndexName': index_name,
+                'KeySchema': [{'AttributeName': hash_key, 'KeyType': 'HASH'},
+                              {'AttributeName': range_key, 'KeyType': 'RANGE'}],
+                'Projection': {'ProjectionType': 'ALL'},
+            }
+            for index_name, hash_key, range_key in indexes
+        ]
+    client.create_table(**kwargs)
+
+
+@pytest.fixture
+def dynamodb():
+    """Tablas del stack en un DynamoDB simulado con moto; devuelve shared.database.DynamoDB"""
+    moto = pytest.importorskip('moto')
+    import boto3
+    from shared.database import DynamoDB
+
+    with moto.mock_aws():
+        client = boto3.client('dynamodb')
+        for env_name, indexes in TABLES.items():
+            _create_table(client, os.environ[env_name], indexes)
+        yield DynamoDB()
+
+
+class FakeEvents:
+    """
+    Cliente de EventBridge para los tests: guarda las entradas aceptadas.
+    `fail` es una excepción para lanzar en cada put_events y `reject_once`
+    los DetailType que PutEvents rechaza la primera vez que los recibe.
+    """
+
+    def __init__(self):
+        self.entries = []
+        self.calls = 0
+        self.fail = None
+        self.reject_once = set()
+
+    def put_events(self, Entries):
+        self.calls += 1
+        if self.fail:
+            raise self.fail
+        results = []
+        for entry in Entries:
+            if entry['DetailType'] in self.reject_once:
+                self.reject_once.discard(entry['DetailType'])
+                results.append({'ErrorCode': 'InternalFailure', 'ErrorMessage': 'rechazado'})
+            else:
+                self.entries.append(entry)
+                results.append({'EventId': str(len(self.entries))})
+        return {'FailedEntryCount': sum(1 for result in results if 'ErrorCode' in result), 'Entries': results}
+
+    def detail_types(self):
+        return [entry['DetailType'] for entry in self.entries]
+
+
+@pytest.fixture
+def events_client(monkeypatch):
+    """
+    Reemplaza el cliente de todos los EventBridge por un FakeEvents, también
+    el de los publishers que los handlers ya tienen cacheados por proceso
+    """
+    pytest.importorskip('boto3')
+    from shared.events import EventBridge
+    client = FakeEvents()
+
+    def get_client(publisher):
+        publisher.bus_name = os.environ['EVENT_BUS_NAME']
+        return client
+
+    monkeypatch.setattr(EventBridge, '_get_client', get_client)
+    return client
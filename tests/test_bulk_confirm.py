@@ -0,0 +1,67 @@
+import json
+import os
+
+import pytest
+
+pytest.importorskip('boto3')
+from botocore.exceptions import ClientError
+
+from ms_restaurante import handler
+
+
+class FakeStepFunctions:
+    """send_task_success que falla según el token"""
+
+    def __init__(self, errors):
+        self.errors = errors
+        self.succeeded = []
+
+    def send_task_success(self, taskToken, output):
+        if taskToken in self.errors:
+            raise self.errors[taskToken]
+        self.succeeded.append(json.loads(output)['orderId'])
+
+
+def _token(db, order_id, stage='PACKAGING', status='PENDING_CONFIRMATION'):
+    db.put_item(os.environ['STEPS_TABLE'], {
+        'PK': f"ORDER#{order_id}", 'SK': f"TOKEN#{stage}", 'orderId': order_id, 'stage': stage,
+        'taskToken': f"token-{order_id}", 'status': status
+    })
+
+
+def _status(db, order_id, stage='PACKAGING'):
+    return db.get_item(os.environ['STEPS_TABLE'], {'PK': f"ORDER#{order_id}", 'SK': f"TOKEN#{stage}"})['Item']['status']
+
+
+def test_bulk_confirmation_reports_each_item(dynamodb, events_client, monkeypatch):
+    _token(dynamodb, 'ok')
+    _token(dynamodb, 'done', status='CONFIRMED')
+    _token(dynamodb, 'throttled')
+    _token(dynamodb, 'expired')
+    stepfunctions = FakeStepFunctions({
+        'token-throttled': ClientError({'Error': {'Code': 'ThrottlingException', 'Message': 'lento'}}, 'SendTaskSuccess'),
+        'token-expired': ClientError({'Error': {'Code': 'TaskTimedOut', 'Message': 'vencido'}}, 'SendTaskSuccess'),
+    })
+    monkeypatch.setattr(handler, '_get_stepfunctions', lambda: stepfunctions)
+
+    response = handler.confirm_stages_bulk({'body': json.dumps({
+        'confirmedBy': 'cocina',
+        'confirmations': [{'orderId': order_id, 'stage': 'PACKAGING'}
+                          for order_id in ('ok', 'done', 'throttled', 'expired', 'missing')]
+    })}, None)
+
+    assert response['statusCode'] == 200
+    body = json.loads(response['body'])
+    assert {item['orderId']: item['result'] for item in body['results']} == {
+        'ok': 'CONFIRMED', 'done': 'NOT_PENDING', 'throttled': 'ERROR', 'expired': 'EXPIRED', 'missing': 'NOT_FOUND'
+    }
+    assert (body['confirmed'], body['failed']) == (1, 4)
+    assert stepfunctions.succeeded == ['ok']
+    assert _status(dynamodb, 'ok') == 'CONFIRMED'
+    assert _status(dynamodb, 'throttled') == 'PENDING_CONFIRMATION'
+    assert [json.loads(entry['Detail'])['orderId'] for entry in events_client.entries] == ['ok']
+
+
+def test_bulk_confirmation_validates_body(dynamodb):
+    response = handler.confirm_stages_bulk({'body': json.dumps({'confirmations': [{'orderId': '1'}]})}, None)
+    assert response['statusCode'] == 400
@@ -0,0 +1,86 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+pytest.importorskip('boto3')
+
+from ms_restaurante.capacity import DeliveryCapacity, queue_pk
+
+TENANT, STORE = 'pardos', 'principal'
+
+
+@pytest.fixture
+def capacity(dynamodb):
+    capacity = DeliveryCapacity(dynamodb)
+    capacity.set_capacity(TENANT, STORE, 2)
+    return capacity
+
+
+def _enqueue(capacity, order_id, arrived_at):
+    capacity.enqueue(TENANT, STORE, order_id, f"token-{order_id}", arrived_at,
+                     datetime.utcnow() + timedelta(hours=1))
+
+
+def _queued(capacity):
+    return [item['orderId'] for item in capacity.db.iter_query(
+        capacity.table_name, 'PK = :pk', {':pk': queue_pk(TENANT, STORE)}
+    )]
+
+
+def test_dispatch_follows_arrival_order_up_to_capacity(capacity):
+    # Encolados fuera de orden: manda la hora de llegada, no la de encolado
+    _enqueue(capacity, 'c', '2024-05-01T10:03:00')
+    _enqueue(capacity, 'a', '2024-05-01T10:01:00')
+    _enqueue(capacity, 'b', '2024-05-01T10:02:00')
+    assert capacity.queue_position(TENANT, STORE, '2024-05-01T10:03:00', 'c') == 3
+
+    woken = []
+    assert capacity.dispatch(TENANT, STORE, lambda entry: woken.append(entry) or True) == 2
+    assert [entry['orderId'] for entry in woken] == ['a', 'b']
+    assert all(entry['reservationId'] for entry in woken)
+    assert capacity.status(TENANT, STORE) == {'inUse': 2, 'capacity': 2}
+    assert _queued(capacity) == ['c']
+
+    slot = capacity.release('a', woken[0]['reservationId'])
+    assert slot['orderId'] == 'a'
+    assert capacity.dispatch(TENANT, STORE, lambda entry: woken.append(entry) or True) == 1
+    assert woken[-1]['orderId'] == 'c'
+    assert capacity.status(TENANT, STORE)['inUse'] == 2
+    assert _queued(capacity) == []
+
+
+def test_release_is_idempotent_and_checks_reservation(capacity):
+    _enqueue(capacity, 'a', '2024-05-01T10:01:00')
+    woken = []
+    capacity.dispatch(TENANT, STORE, lambda entry: woken.append(entry) or True)
+    reservation_id = woken[0]['reservationId']
+
+    assert capacity.release('a', 'otra-reserva') is None
+    assert capacity.status(TENANT, STORE)['inUse'] == 1
+    assert capacity.release('a', reservation_id)
+    assert capacity.release('a', reservation_id) is None
+    assert capacity.status(TENANT, STORE)['inUse'] == 0
+
+
+def test_stale_token_gives_the_slot_to_the_next_order(capacity):
+    capacity.set_capacity(TENANT, STORE, 1)
+    _enqueue(capacity, 'a', '2024-05-01T10:01:00')
+    _enqueue(capacity, 'b', '2024-05-01T10:02:00')
+
+    woken = []
+    assert capacity.dispatch(TENANT, STORE, lambda entry: entry['orderId'] != 'a' and not woken.append(entry)) == 1
+    assert [entry['orderId'] for entry in woken] == ['b']
+    assert capacity.status(TENANT, STORE) == {'inUse': 1, 'capacity': 1}
+    assert _queued(capacity) == []
+
+
+def test_reenqueue_keeps_place_and_replaces_token(capacity):
+    capacity.set_capacity(TENANT, STORE, 1)
+    _enqueue(capacity, 'a', '2024-05-01T10:01:00')
+    _enqueue(capacity, 'b', '2024-05-01T10:02:00')
+    capacity.enqueue(TENANT, STORE, 'a', 'token-a-2', '2024-05-01T10:01:00', datetime.utcnow() + timedelta(hours=1))
+
+    woken = []
+    capacity.dispatch(TENANT, STORE, lambda entry: woken.append(entry) or True)
+    assert [(entry['orderId'], entry['taskToken']) for entry in woken] == [('a', 'token-a-2')]
+    assert _queued(capacity) == ['b']
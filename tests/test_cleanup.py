@@ -0,0 +1,106 @@
+import json
+import os
+
+import pytest
+
+pytest.importorskip('boto3')
+
+from cleanup import handler
+from cleanup.handler import SWEEP_CHECKPOINT_KEY
+
+
+class FakeStepFunctions:
+    """Guarda los tokens fallados; `before_failure` simula escrituras concurrentes"""
+
+    def __init__(self, before_failure=None):
+        self.failed = []
+        self.before_failure = before_failure
+
+    def send_task_failure(self, taskToken, error, cause):
+        if self.before_failure:
+            self.before_failure(taskToken)
+        self.failed.append(taskToken)
+
+
+class FakeContext:
+    """Devuelve los tiempos restantes en orden; el último se repite"""
+
+    def __init__(self, *remaining_ms):
+        self.remaining_ms = list(remaining_ms)
+
+    def get_remaining_time_in_millis(self):
+        return self.remaining_ms.pop(0) if len(self.remaining_ms) > 1 else self.remaining_ms[0]
+
+
+@pytest.fixture
+def stepfunctions(monkeypatch):
+    client = FakeStepFunctions()
+    monkeypatch.setattr(handler, '_get_stepfunctions', lambda: client)
+    monkeypatch.setattr(handler, 'dynamodb', None)
+    return client
+
+
+def _token(db, order_id, status='PENDING_CONFIRMATION'):
+    db.put_item(os.environ['STEPS_TABLE'], {
+        'PK': f"ORDER#pardos#{order_id}", 'SK': 'TOKEN#COOKING', 'orderId': order_id,
+        'taskToken': f"token-{order_id}", 'status': status, 'expiresAt': '2024-05-01T10:00:00'
+    })
+
+
+def _status(db, order_id):
+    item = db.get_item(os.environ['STEPS_TABLE'],
+                       {'PK': f"ORDER#pardos#{order_id}", 'SK': 'TOKEN#COOKING'}).get('Item')
+    return item and item['status']
+
+
+def _checkpoint(db):
+    return db.get_item(os.environ['STEPS_TABLE'], SWEEP_CHECKPOINT_KEY).get('Item')
+
+
+def test_sweeper_pages_through_all_expired_tokens(dynamodb, stepfunctions, monkeypatch):
+    monkeypatch.setattr(handler, 'SWEEP_PAGE_SIZE', 2)
+    for n in range(5):
+        _token(dynamodb, f"p{n}")
+    _token(dynamodb, 'w0', status='WAITING_CAPACITY')
+
+    body = json.loads(handler.cleanup_expired_tokens({}, FakeContext(60000))['body'])
+
+    assert (body['expired'], body['failed'], body['complete']) == (6, 0, True)
+    assert sorted(stepfunctions.failed) == sorted([f"token-p{n}" for n in range(5)] + ['token-w0'])
+    assert all(_status(dynamodb, f"p{n}") == 'EXPIRED' for n in range(5))
+    assert _status(dynamodb, 'w0') is None
+    assert _checkpoint(dynamodb)['cursors'] == {}
+
+
+def test_sweeper_stops_at_the_deadline_and_resumes_from_the_checkpoint(dynamodb, stepfunctions, monkeypatch):
+    monkeypatch.setattr(handler, 'SWEEP_PAGE_SIZE', 2)
+    for n in range(5):
+        _token(dynamodb, f"p{n}")
+
+    # Alcanza para una página y después se corta por tiempo
+    body = json.loads(handler.cleanup_expired_tokens({}, FakeContext(60000, 0))['body'])
+    assert (body['expired'], body['complete']) == (2, False)
+    assert 'PENDING_CONFIRMATION' in _checkpoint(dynamodb)['cursors']
+
+    body = json.loads(handler.cleanup_expired_tokens({}, FakeContext(60000))['body'])
+    assert (body['expired'], body['complete']) == (3, True)
+    assert len(set(stepfunctions.failed)) == 5
+    assert _checkpoint(dynamodb)['cursors'] == {}
+
+
+def test_sweeper_does_not_overwrite_a_concurrent_confirmation(dynamodb, stepfunctions):
+    _token(dynamodb, 'a')
+    _token(dynamodb, 'b')
+
+    def confirm(token):
+        # La cocina confirma 'a' entre el query del barrido y su escritura
+        if token == 'token-a':
+            dynamodb.update_item(os.environ['STEPS_TABLE'], {'PK': 'ORDER#pardos#a', 'SK': 'TOKEN#COOKING'},
+                                 'SET #s = :confirmed', {':confirmed': 'CONFIRMED'}, expression_names={'#s': 'status'})
+
+    stepfunctions.before_failure = confirm
+    body = json.loads(handler.cleanup_expired_tokens({}, None)['body'])
+
+    assert body['failed'] == 0
+    assert _status(dynamodb, 'a') == 'CONFIRMED'
+    assert _status(dynamodb, 'b') == 'EXPIRED'
@@ -0,0 +1,51 @@
+import json
+import os
+
+import pytest
+
+pytest.importorskip('boto3')
+
+from ms_clientes import handler
+from shared.orders import ORDER_INFO_SK, order_pk
+
+
+class FakeContext:
+    def __init__(self, remaining_ms):
+        self.remaining_ms = remaining_ms
+
+    def get_remaining_time_in_millis(self):
+        return self.remaining_ms
+
+
+def _legacy_orders(db, count):
+    for n in range(count):
+        db.put_item(os.environ['ORDERS_TABLE'], {
+            'PK': order_pk('pardos', f"o{n}"), 'SK': ORDER_INFO_SK, 'orderId': f"o{n}",
+            'tenantId': 'pardos', 'createdAt': f"2024-05-{n % 28 + 1:02d}T10:00:00"
+        })
+
+
+def _buckets(db):
+    return {item['orderId']: item.get('dayBucket') for item in db.iter_scan(os.environ['ORDERS_TABLE'])}
+
+
+def test_backfill_tags_every_order_with_more_segments_than_workers(dynamodb, monkeypatch):
+    # Más segmentos que hilos en el pool: antes los updates quedaban encolados detrás del scan
+    monkeypatch.setattr(handler, 'BACKFILL_SEGMENTS', 32)
+    _legacy_orders(dynamodb, 40)
+
+    response = handler.backfill_day_buckets({}, FakeContext(60000))
+
+    assert json.loads(response['body']) == {'updated': 40, 'complete': True}
+    buckets = _buckets(dynamodb)
+    assert buckets['o0'] == 'TENANT#pardos#DAY#2024-05-01'
+    assert all(buckets.values())
+
+
+def test_backfill_stops_before_the_lambda_timeout(dynamodb):
+    _legacy_orders(dynamodb, 5)
+
+    response = handler.backfill_day_buckets({}, FakeContext(handler.BACKFILL_SAFETY_MS - 1))
+
+    assert json.loads(response['body']) == {'updated': 0, 'complete': False}
+    assert not any(_buckets(dynamodb).values())
@@ -0,0 +1,125 @@
+import json
+import os
+from datetime import datetime, timedelta
+
+import pytest
+
+pytest.importorskip('boto3')
+
+from ms_dashboard.agregacion import ATRIBUTO_RECONSTRUIDO, CONTADORES_SK_TOTAL, contadores_pk
+from ms_dashboard.handler import (
+    actualizar_contadores, leer_agregado_contadores, obtener_pedidos_reales, obtener_tiempo_promedio_real
+)
+from shared.database import DynamoDB
+from shared.orders import ORDER_INFO_SK, day_bucket, order_pk
+
+HOY = datetime.utcnow().replace(microsecond=0)
+
+
+def _evento(detail_type, order_id, **detail):
+    return {'detail-type': detail_type, 'detail': {'orderId': order_id, 'tenantId': 'pardos', **detail}}
+
+
+def _creado(order_id, items):
+    return _evento('OrderCreated', order_id, timestamp=HOY.isoformat(), items=items)
+
+
+def _marcar_reconstruido(db):
+    db.update_item(os.environ['COUNTERS_TABLE'], {'PK': contadores_pk('pardos'), 'SK': CONTADORES_SK_TOTAL},
+                   f"SET {ATRIBUTO_RECONSTRUIDO} = :en", {':en': HOY.isoformat()})
+
+
+def test_counters_follow_stage_transitions(dynamodb):
+    actualizar_contadores(_creado('1', [{'productId': 'pollo_entero', 'qty': 2}]), None)
+    actualizar_contadores(_creado('2', [{'productId': 'pollo_entero', 'qty': 1}, {'productId': 'papas'}]), None)
+    actualizar_contadores(_evento('OrderStageStarted', '1', stage='COOKING'), None)
+
+    # Sin la marca del backfill los contadores no cubren el historial y no se usan
+    assert leer_agregado_contadores('pardos', 7) is None
+    _marcar_reconstruido(dynamodb)
+
+    agregado = leer_agregado_contadores('pardos', 7)
+    assert agregado.total == 2 and agregado.hoy_count == 2
+    assert agregado.pedidos_por_estado()['CREATED'] == 1
+    assert agregado.pedidos_por_estado()['COOKING'] == 1
+    assert agregado.activos == 2
+    assert agregado.productos_populares() == [('pollo_entero', 3), ('papas', 1)]
+
+
+def test_duplicate_events_are_applied_once(dynamodb):
+    _marcar_reconstruido(dynamodb)
+    creado = _creado('1', [{'productId': 'pollo_entero', 'qty': 1}])
+    assert json.loads(actualizar_contadores(creado, None)['body'])['updated']
+    assert not json.loads(actualizar_contadores(creado, None)['body'])['updated']
+    for _ in range(2):
+        actualizar_contadores(_evento('OrderStageStarted', '1', stage='COOKING'), None)
+
+    agregado = leer_agregado_contadores('pardos', 7)
+    assert agregado.total == 1
+    assert agregado.pedidos_por_estado()['CREATED'] == 0
+    assert agregado.pedidos_por_estado()['COOKING'] == 1
+    assert agregado.productos_populares() == [('pollo_entero', 1)]
+
+
+def test_stage_event_before_creation_does_not_go_negative(dynamodb):
+    _marcar_reconstruido(dynamodb)
+    actualizar_contadores(_evento('OrderStageStarted', '1', stage='COOKING'), None)
+
+    agregado = leer_agregado_contadores('pardos', 7)
+    assert agregado.pedidos_por_estado()['CREATED'] == 0
+    assert agregado.pedidos_por_estado()['COOKING'] == 1
+
+    # Cuando llega el OrderCreated atrasado la etapa CREATED vuelve a cero
+    actualizar_contadores(_creado('1', []), None)
+    assert leer_agregado_contadores('pardos', 7).pedidos_por_estado()['CREATED'] == 0
+
+
+def _pedido(db, order_id, dias_atras):
+    created_at = (HOY - timedelta(days=dias_atras)).isoformat()
+    db.put_item(os.environ['ORDERS_TABLE'], {
+        'PK': order_pk('pardos', order_id), 'SK': ORDER_INFO_SK, 'orderId': order_id, 'tenantId': 'pardos',
+        'createdAt': created_at, 'dayBucket': day_bucket('pardos', created_at), 'items': [], 'total': 10
+    })
+
+
+def test_order_pages_walk_back_through_day_buckets_without_scanning(dynamodb, monkeypatch):
+    for order_id, dias_atras in (('a', 0), ('b', 0), ('c', 3), ('d', 40), ('e', 400)):
+        _pedido(dynamodb, order_id, dias_atras)
+
+    def sin_scan(*args, **kwargs):
+        raise AssertionError('el listado no debe escanear la tabla')
+
+    monkeypatch.setattr(DynamoDB, 'parallel_scan', sin_scan)
+    monkeypatch.setattr(DynamoDB, 'iter_parallel_scan', sin_scan)
+
+    paginas, cursor = [], None
+    while True:
+        pedidos, cursor = obtener_pedidos_reales('pardos', limit=2, cursor=cursor)
+        paginas.append([pedido['orderId'] for pedido in pedidos])
+        if not cursor:
+            break
+    assert [sorted(pagina) for pagina in paginas] == [['a', 'b'], ['c', 'd'], ['e']]
+
+
+def _etapa(db, order_id, etapa, status, inicio, fin=None):
+    item = {'PK': order_pk('pardos', order_id), 'SK': f"STEP#{etapa}#{inicio}", 'stepName': etapa,
+            'status': status, 'startedAt': inicio, 'orderId': order_id}
+    if fin:
+        item['finishedAt'] = fin
+    db.put_item(os.environ['STEPS_TABLE'], item)
+
+
+def test_average_delivery_time_from_steps_in_one_pass(dynamodb, monkeypatch):
+    _etapa(dynamodb, '1', 'COOKING', 'COMPLETED', '2024-05-01T10:00:00', '2024-05-01T10:20:00')
+    _etapa(dynamodb, '1', 'DELIVERED', 'DONE', '2024-05-01T10:40:00', '2024-05-01T10:40:00')
+    _etapa(dynamodb, '2', 'COOKING', 'COMPLETED', '2024-05-01T11:00:00', '2024-05-01T11:10:00')
+    _etapa(dynamodb, '2', 'DELIVERED', 'DONE', '2024-05-01T11:20:00', '2024-05-01T11:20:00')
+    # Sin entregar: no cuenta
+    _etapa(dynamodb, '3', 'COOKING', 'IN_PROGRESS', '2024-05-01T12:00:00')
+
+    def sin_consultas(*args, **kwargs):
+        raise AssertionError('no debe haber consultas por pedido')
+
+    monkeypatch.setattr(DynamoDB, 'iter_query', sin_consultas)
+    monkeypatch.setattr(DynamoDB, 'get_item', sin_consultas)
+    assert obtener_tiempo_promedio_real('pardos') == 30
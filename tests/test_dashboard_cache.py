@@ -0,0 +1,80 @@
+import pytest
+
+from ms_dashboard import cache as cache_module
+from ms_dashboard.cache import HIT, MISS, STALE, CacheRespuestas
+
+
+class Reloj:
+    def __init__(self):
+        self.ahora = 1000.0
+
+    def __call__(self):
+        return self.ahora
+
+
+@pytest.fixture
+def reloj(monkeypatch):
+    reloj = Reloj()
+    monkeypatch.setattr(cache_module.time, 'monotonic', reloj)
+    return reloj
+
+
+def _falla():
+    raise RuntimeError('DynamoDB caído')
+
+
+def test_fresh_entry_is_a_hit_and_expired_one_is_recomputed(reloj):
+    cache = CacheRespuestas(ttl=5, stale=60)
+    calculos = []
+
+    def calcular():
+        calculos.append(reloj.ahora)
+        return f"v{len(calculos)}"
+
+    assert cache.obtener('resumen', calcular) == ('v1', MISS, 0.0)
+    reloj.ahora += 3
+    assert cache.obtener('resumen', calcular) == ('v1', HIT, 3)
+    reloj.ahora += 3
+    assert cache.obtener('resumen', calcular) == ('v2', MISS, 0.0)
+    assert (cache.hits, cache.misses, len(calculos)) == (1, 2, 2)
+
+
+def test_failed_recompute_serves_stale_only_within_the_window(reloj):
+    cache = CacheRespuestas(ttl=5, stale=60)
+    cache.obtener('resumen', lambda: 'viejo')
+
+    reloj.ahora += 30
+    assert cache.obtener('resumen', _falla) == ('viejo', STALE, 30)
+    assert cache.stales == 1
+
+    reloj.ahora += 60
+    with pytest.raises(RuntimeError):
+        cache.obtener('resumen', _falla)
+
+
+def test_request_errors_are_not_hidden_by_a_stale_entry(reloj):
+    cache = CacheRespuestas(ttl=5, stale=60)
+    cache.obtener('pedidos', lambda: 'viejo')
+    reloj.ahora += 10
+
+    def cursor_invalido():
+        raise ValueError('nextToken inválido')
+
+    with pytest.raises(ValueError):
+        cache.obtener('pedidos', cursor_invalido)
+
+
+def test_evicts_least_recently_used_by_entries_and_bytes(reloj):
+    cache = CacheRespuestas(ttl=5, stale=60, max_entradas=2, max_bytes=10)
+    cache.obtener('a', lambda: 'aaaa')
+    cache.obtener('b', lambda: 'bbbb')
+    cache.obtener('a', lambda: 'nuevo')  # HIT: 'a' pasa a ser la más reciente
+    cache.obtener('c', lambda: 'cc')
+    assert list(cache._entradas) == ['a', 'c']
+
+    cache.obtener('d', lambda: 'd' * 9)
+    assert list(cache._entradas) == ['d'] and cache._bytes == 9
+
+    # Más grande que todo el cache: se devuelve pero no se guarda
+    assert cache.obtener('e', lambda: 'e' * 11)[1] == MISS
+    assert 'e' not in cache._entradas
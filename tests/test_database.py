@@ -0,0 +1,130 @@
+import os
+from decimal import Decimal
+
+import pytest
+
+pytest.importorskip('boto3')
+from botocore.exceptions import ClientError
+
+from shared.database import (
+    cancellation_reasons, decode_cursor, encode_cursor, is_conditional_check_failed
+)
+
+
+def _client_error(code, **extra):
+    return ClientError({'Error': {'Code': code, 'Message': code}, **extra}, 'TransactWriteItems')
+
+
+def test_cursor_roundtrip():
+    key = {'PK': 'TENANT#pardos#ORDER#1', 'SK': 'INFO', 'createdAt': '2024-05-01T10:00:00', 'n': Decimal('7')}
+    cursor = encode_cursor(key)
+    assert isinstance(cursor, str)
+    assert decode_cursor(cursor) == key
+
+
+def test_cursor_empty_and_invalid():
+    assert encode_cursor(None) is None
+    assert decode_cursor(None) is None
+    with pytest.raises(ValueError):
+        decode_cursor('no-es-un-cursor')
+
+
+def test_cancellation_reasons():
+    error = _client_error('TransactionCanceledException', CancellationReasons=[
+        {'Code': 'None'}, {'Code': 'ConditionalCheckFailed', 'Message': 'The conditional request failed'}
+    ])
+    assert cancellation_reasons(error) == ['None', 'ConditionalCheckFailed']
+    assert cancellation_reasons(_client_error('ConditionalCheckFailedException')) == []
+    assert cancellation_reasons(ValueError('otro')) == []
+
+
+def test_is_conditional_check_failed():
+    assert is_conditional_check_failed(_client_error('ConditionalCheckFailedException'))
+    assert not is_conditional_check_failed(_client_error('ProvisionedThroughputExceededException'))
+    assert not is_conditional_check_failed(ValueError('otro'))
+
+
+def _put_orders(db, count, pk='TENANT#pardos#QUEUE'):
+    for i in range(count):
+        db.put_item(os.environ['STEPS_TABLE'], {'PK': pk, 'SK': f"{i:04d}", 'n': i})
+
+
+def test_iter_query_resumes_from_cursor(dynamodb):
+    _put_orders(dynamodb, 25)
+    query = dict(table_name=os.environ['STEPS_TABLE'], key_condition_expression='PK = :pk',
+                 expression_attribute_values={':pk': 'TENANT#pardos#QUEUE'})
+
+    first = dynamodb.iter_query(**query, max_items=10)
+    first_items = list(first)
+    assert [item['SK'] for item in first_items] == [f"{i:04d}" for i in range(10)]
+    assert first.cursor and not first.exhausted
+
+    rest = dynamodb.iter_query(**query, page_size=7, cursor=first.cursor)
+    rest_items = list(rest)
+    assert [item['SK'] for item in rest_items] == [f"{i:04d}" for i in range(10, 25)]
+    assert rest.exhausted and rest.pages == 3
+
+
+def test_iter_scan_follows_pages(dynamodb):
+    _put_orders(dynamodb, 12)
+    scan = dynamodb.iter_scan(os.environ['STEPS_TABLE'], page_size=5)
+    assert len(list(scan)) == 12
+    assert scan.exhausted and scan.pages == 3
+    assert dynamodb.count(os.environ['STEPS_TABLE']) == 12
+
+
+def test_parallel_scan_combines_segments(dynamodb):
+    for tenant in range(3):
+        _put_orders(dynamodb, 20, pk=f"TENANT#{tenant}#QUEUE")
+
+    total = dynamodb.parallel_scan(
+        table_name=os.environ['STEPS_TABLE'],
+        reducer=lambda acc, item: acc + int(item['n']),
+        initial=lambda: 0,
+        combine=lambda a, b: a + b,
+        page_size=7,
+        total_segments=4
+    )
+    assert total == 3 * sum(range(20))
+
+    partials = dynamodb.parallel_scan(
+        table_name=os.environ['STEPS_TABLE'],
+        reducer=lambda acc, item: acc + 1,
+        initial=lambda: 0,
+        total_segments=4
+    )
+    assert len(partials) == 4 and sum(partials) == 60
+    assert dynamodb.count(os.environ['STEPS_TABLE'], total_segments=4) == 60
+    assert len(list(dynamodb.iter_parallel_scan(os.environ['STEPS_TABLE'], page_size=7))) == 60
+
+
+def test_batch_get_and_write_over_limits(dynamodb):
+    keys = [{'PK': 'TENANT#pardos#QUEUE', 'SK': f"{i:04d}"} for i in range(140)]
+    dynamodb.batch_write(os.environ['STEPS_TABLE'], puts=[{**key, 'n': i} for i, key in enumerate(keys[:130])])
+    found = dynamodb.batch_get(os.environ['STEPS_TABLE'], keys + keys[:5])
+    assert sorted(item['SK'] for item in found) == [f"{i:04d}" for i in range(130)]
+
+    dynamodb.batch_write(os.environ['STEPS_TABLE'], deletes=keys[:130])
+    assert dynamodb.count(os.environ['STEPS_TABLE']) == 0
+
+
+def test_transact_write_cancellation_reasons(dynamodb):
+    table = os.environ['STEPS_TABLE']
+    dynamodb.put_item(table, {'PK': 'A', 'SK': 'INFO', 'currentStep': 'COOKING'})
+
+    with pytest.raises(ClientError) as raised:
+        dynamodb.transact_write([
+            {'Put': {'TableName': table, 'Item': {'PK': 'B', 'SK': 'INFO'}}},
+            {
+                'Update': {
+                    'TableName': table,
+                    'Key': {'PK': 'A', 'SK': 'INFO'},
+                    'UpdateExpression': 'SET currentStep = :step',
+                    'ConditionExpression': 'currentStep = :expected',
+                    'ExpressionAttributeValues': {':step': 'DELIVERY', ':expected': 'PACKAGING'}
+                }
+            }
+        ])
+    assert cancellation_reasons(raised.value) == ['None', 'ConditionalCheckFailed']
+    # Nada de la transacción quedó escrito
+    assert 'Item' not in dynamodb.get_item(table, {'PK': 'B', 'SK': 'INFO'})
@@ -0,0 +1,63 @@
+import json
+
+import pytest
+
+pytest.importorskip('boto3')
+from botocore.exceptions import ClientError
+
+from shared.events import PUT_EVENTS_MAX_ATTEMPTS, EventBridge
+
+
+def _buffered(count):
+    publisher = EventBridge(buffered=True)
+    for n in range(count):
+        publisher.publish_event('pardos.orders', f"Evento{n}", {'n': n})
+    return publisher
+
+
+def test_rejected_entries_are_retried_until_accepted(events_client):
+    publisher = _buffered(3)
+    events_client.reject_once = {'Evento1'}
+
+    assert publisher.flush() == 3
+    assert sorted(events_client.detail_types()) == ['Evento0', 'Evento1', 'Evento2']
+    assert events_client.calls == 2
+
+
+def test_entries_rejected_on_every_attempt_stay_pending(events_client, monkeypatch):
+    publisher = _buffered(2)
+    put_events = events_client.put_events
+
+    def reject_first(Entries):
+        events_client.reject_once.add('Evento0')
+        return put_events(Entries)
+
+    monkeypatch.setattr(events_client, 'put_events', reject_first)
+    with pytest.raises(RuntimeError):
+        publisher.flush()
+    assert events_client.calls == PUT_EVENTS_MAX_ATTEMPTS
+    assert events_client.detail_types() == ['Evento1']
+
+    monkeypatch.setattr(events_client, 'put_events', put_events)
+    assert publisher.flush() == 1
+    assert events_client.detail_types() == ['Evento1', 'Evento0']
+
+
+def test_client_error_keeps_the_unsent_batches(events_client, monkeypatch):
+    # 12 eventos = dos lotes; el segundo PutEvents falla
+    publisher = _buffered(12)
+    put_events = events_client.put_events
+
+    def fail_second_batch(Entries):
+        if events_client.calls == 1:
+            events_client.fail = ClientError({'Error': {'Code': 'InternalException', 'Message': 'caído'}}, 'PutEvents')
+        return put_events(Entries)
+
+    monkeypatch.setattr(events_client, 'put_events', fail_second_batch)
+    with pytest.raises(ClientError):
+        publisher.flush()
+    assert len(events_client.entries) == 10
+
+    events_client.fail = None
+    assert publisher.flush() == 2
+    assert sorted(json.loads(entry['Detail'])['n'] for entry in events_client.entries) == list(range(12))
@@ -0,0 +1,118 @@
+import os
+from collections import Counter
+from datetime import datetime
+
+import pytest
+
+pytest.importorskip('boto3')
+from botocore.exceptions import ClientError
+
+from ms_restaurante import kitchen
+from ms_restaurante.kitchen import (
+    CONFIRMED, ERROR, NOT_IN_ORDER, PARTIAL, PENDING_CONFIRMATION, READY_FULL, READY_MAX_WAIT,
+    KitchenScheduler, plan_batches, token_key
+)
+from shared.orders import order_pk
+
+NOW = datetime(2024, 5, 1, 12, 0, 0)
+
+
+@pytest.fixture(autouse=True)
+def capacities(monkeypatch):
+    monkeypatch.setenv('KITCHEN_BATCH_CAPACITY_BY_PRODUCT', '{"pollo_entero": 4, "pollo_1_4": 10}')
+
+
+def _order(order_id, waiting_since, products, store_id='principal', cooked=()):
+    return {
+        'orderId': order_id,
+        'storeId': store_id,
+        'waitingSince': waiting_since,
+        'products': Counter(products),
+        'cooked': set(cooked)
+    }
+
+
+def test_fills_batches_in_arrival_order_without_splitting_lines():
+    pending = [
+        _order('c', '2024-05-01T11:59:00', {'pollo_entero': 2}),
+        _order('a', '2024-05-01T11:58:00', {'pollo_entero': 3}),
+        _order('b', '2024-05-01T11:58:30', {'pollo_entero': 1}),
+    ]
+    batches = plan_batches(pending, now=NOW, max_wait=600)
+
+    assert [batch['orderIds'] for batch in batches] == [['a', 'b'], ['c']]
+    full, partial = batches
+    assert full['units'] == 4 and full['ready'] and full['readyReason'] == READY_FULL
+    assert partial['units'] == 2 and not partial['ready'] and partial['readyReason'] is None
+
+
+def test_oversized_line_gets_its_own_batch():
+    pending = [
+        _order('a', '2024-05-01T11:58:00', {'pollo_entero': 1}),
+        _order('b', '2024-05-01T11:58:30', {'pollo_entero': 6}),
+    ]
+    batches = plan_batches(pending, now=NOW, max_wait=600)
+
+    by_order = {tuple(batch['orderIds']): batch for batch in batches}
+    assert by_order[('b',)]['units'] == 6 and by_order[('b',)]['ready']
+    assert by_order[('a',)]['units'] == 1
+
+
+def test_max_wait_releases_partial_batch():
+    pending = [_order('a', '2024-05-01T11:49:00', {'pollo_1_4': 2})]
+    [batch] = plan_batches(pending, now=NOW, max_wait=600)
+
+    assert batch['ready'] and batch['readyReason'] == READY_MAX_WAIT
+    assert batch['waitedSeconds'] == 660
+
+
+def test_groups_by_store_and_skips_cooked_products():
+    pending = [
+        _order('a', '2024-05-01T11:58:00', {'pollo_entero': 1, 'pollo_1_4': 2}, cooked={'pollo_entero'}),
+        _order('b', '2024-05-01T11:58:30', {'pollo_1_4': 1}, store_id='miraflores'),
+    ]
+    batches = plan_batches(pending, now=NOW, max_wait=600)
+
+    assert sorted((batch['storeId'], batch['productId'], tuple(batch['orderIds'])) for batch in batches) == [
+        ('miraflores', 'pollo_1_4', ('b',)),
+        ('principal', 'pollo_1_4', ('a',)),
+    ]
+
+
+class FakeStepFunctions:
+    def __init__(self, failing=()):
+        self.failing = set(failing)
+        self.succeeded = []
+
+    def send_task_success(self, taskToken, output):
+        if taskToken in self.failing:
+            raise ClientError({'Error': {'Code': 'ThrottlingException', 'Message': 'lento'}}, 'SendTaskSuccess')
+        self.succeeded.append(taskToken)
+
+
+def _pending_order(db, order_id, products):
+    db.put_item(os.environ['ORDERS_TABLE'], {
+        'PK': order_pk('pardos', order_id), 'SK': 'INFO', 'orderId': order_id, 'createdAt': '2024-05-01T11:50:00',
+        'items': [{'productId': product_id, 'qty': qty} for product_id, qty in products.items()]
+    })
+    db.put_item(os.environ['STEPS_TABLE'], {
+        **token_key(order_id), 'orderId': order_id, 'tenantId': 'pardos', 'taskToken': f"token-{order_id}",
+        'status': PENDING_CONFIRMATION, 'createdAt': '2024-05-01T11:50:00'
+    })
+
+
+def test_confirm_batch_reports_errors_per_order(dynamodb, monkeypatch):
+    _pending_order(dynamodb, 'a', {'pollo_entero': 1})
+    _pending_order(dynamodb, 'b', {'pollo_entero': 1})
+    _pending_order(dynamodb, 'c', {'pollo_entero': 1, 'papas': 1})
+    stepfunctions = FakeStepFunctions(failing={'token-b'})
+    monkeypatch.setattr(kitchen, 'get_client', lambda service_name: stepfunctions)
+
+    results = KitchenScheduler(dynamodb).confirm_batch('pardos', 'pollo_entero', ['a', 'b', 'c', 'x'], 'cocina')
+
+    assert {order_id: outcome['result'] for order_id, outcome in results.items()} == {
+        'a': CONFIRMED, 'b': ERROR, 'c': PARTIAL, 'x': NOT_IN_ORDER
+    }
+    assert 'ThrottlingException' in results['b']['error']
+    assert results['c']['remainingProducts'] == ['papas']
+    assert stepfunctions.succeeded == ['token-a']
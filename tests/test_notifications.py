@@ -0,0 +1,160 @@
+import json
+import os
+
+import pytest
+
+pytest.importorskip('boto3')
+
+from notifications import handler
+from notifications.handler import (
+    UNREAD_ATTRIBUTE, _build_notification, _compact_delivered, _customer_pk, _store_notifications,
+    _unread_counter_key, get_customer_notifications, mark_all_notifications_read, mark_notification_read,
+    send_order_notification
+)
+
+
+def _entry(stage, created_at, message_id, detail_type='OrderStageStarted'):
+    event = {'detail-type': detail_type, 'detail': {'orderId': '1', 'tenantId': 'pardos', 'stage': stage}}
+    return {'item': _build_notification(event, 'cliente-1', created_at), 'messageIds': [message_id]}
+
+
+def _notifications(db):
+    return [item for item in db.iter_query(
+        os.environ['NOTIFICATIONS_TABLE'], 'PK = :pk AND begins_with(SK, :prefix)',
+        {':pk': _customer_pk('pardos', 'cliente-1'), ':prefix': 'NOTIFICATION#'}
+    )]
+
+
+def _unread(db):
+    item = db.get_item(os.environ['NOTIFICATIONS_TABLE'],
+                       _unread_counter_key(_customer_pk('pardos', 'cliente-1'))).get('Item') or {}
+    return int(item.get(UNREAD_ATTRIBUTE, 0))
+
+
+def test_redelivered_transition_is_stored_once(dynamodb):
+    # La misma transición entregada dos veces en el lote, con distinta hora de recepción
+    written, failed = _store_notifications([
+        _entry('COOKING', '2024-05-01T10:05:00', 'm1'),
+        _entry('COOKING', '2024-05-01T10:05:02', 'm2'),
+        _entry('PACKAGING', '2024-05-01T10:20:00', 'm3'),
+    ])
+    assert failed == []
+    assert sorted(item['stage'] for item in written) == ['COOKING', 'PACKAGING']
+    assert len(_notifications(dynamodb)) == 2
+    assert _unread(dynamodb) == 2
+
+    # Reentrega en otra invocación: no escribe nada ni mueve el contador
+    written, failed = _store_notifications([_entry('COOKING', '2024-05-01T10:06:00', 'm4')])
+    assert (written, failed) == ([], [])
+    assert len(_notifications(dynamodb)) == 2
+    assert _unread(dynamodb) == 2
+
+
+def test_same_stage_with_other_detail_type_is_not_a_duplicate(dynamodb):
+    written, _ = _store_notifications([
+        _entry('COOKING', '2024-05-01T10:05:00', 'm1'),
+        _entry('COOKING', '2024-05-01T10:15:00', 'm2', detail_type='StageCompleted'),
+    ])
+    assert len(written) == 2
+    assert _unread(dynamodb) == 2
+
+
+def _unread_count(customer_id='cliente-1'):
+    response = get_customer_notifications({'pathParameters': {'customerId': customer_id}}, None)
+    return json.loads(response['body'])['unreadCount']
+
+
+def test_first_read_counts_notifications_stored_before_the_counter(dynamodb):
+    # Cliente anterior al contador: tiene notificaciones sin leer pero ningún item UNREAD_COUNTER
+    for entry in (_entry('COOKING', '2024-05-01T10:05:00', 'm1'), _entry('PACKAGING', '2024-05-01T10:20:00', 'm2')):
+        dynamodb.put_item(os.environ['NOTIFICATIONS_TABLE'], entry['item'])
+
+    assert _unread_count() == 2
+    assert _unread(dynamodb) == 2
+
+    _store_notifications([_entry('DELIVERY', '2024-05-01T10:30:00', 'm3')])
+    assert _unread_count() == 3
+
+
+def test_stale_counter_is_recounted_after_ttl_deletions(dynamodb):
+    _store_notifications([
+        _entry('COOKING', '2024-05-01T10:05:00', 'm1'),
+        _entry('PACKAGING', '2024-05-01T10:20:00', 'm2'),
+    ])
+    assert _unread_count() == 2
+
+    # El TTL borra una sin leer y el recuento anterior ya venció
+    [expired, _] = _notifications(dynamodb)
+    dynamodb.delete_item(os.environ['NOTIFICATIONS_TABLE'], {'PK': expired['PK'], 'SK': expired['SK']})
+    dynamodb.update_item(os.environ['NOTIFICATIONS_TABLE'], _unread_counter_key(_customer_pk('pardos', 'cliente-1')),
+                         'SET countedAt = :old', {':old': '2024-01-01T00:00:00'})
+
+    assert _unread_count() == 1
+    assert _unread(dynamodb) == 1
+
+
+def _mark_all(body=None):
+    response = mark_all_notifications_read({'pathParameters': {'customerId': 'cliente-1'}, 'body': body}, None)
+    return json.loads(response['body'])
+
+
+def test_read_all_up_to_a_notification(dynamodb):
+    _store_notifications([
+        _entry('COOKING', '2024-05-01T10:05:00', 'm1'),
+        _entry('PACKAGING', '2024-05-01T10:20:00', 'm2'),
+        _entry('DELIVERY', '2024-05-01T10:30:00', 'm3'),
+    ])
+    packaging = sorted(item['SK'] for item in _notifications(dynamodb))[1]
+
+    assert _mark_all({'upTo': packaging})['marked'] == 2
+    assert _unread(dynamodb) == 1
+    assert _mark_all()['marked'] == 1
+    assert _unread(dynamodb) == 0
+    assert all(item['read'] for item in _notifications(dynamodb))
+
+
+def test_read_all_recount_does_not_drop_a_concurrent_arrival(dynamodb, monkeypatch):
+    monkeypatch.setattr(handler, 'dynamodb', dynamodb)
+    _store_notifications([_entry('COOKING', '2024-05-01T10:05:00', 'm1')])
+    count_query = dynamodb.count_query
+    arrivals = [_entry('PACKAGING', '2024-05-01T10:20:00', 'm2')]
+
+    def racing_count(*args, **kwargs):
+        # Llega una notificación entre el recuento y el SET del contador
+        total = count_query(*args, **kwargs)
+        if arrivals:
+            _store_notifications([arrivals.pop()])
+        return total
+
+    monkeypatch.setattr(dynamodb, 'count_query', racing_count)
+    assert _mark_all()['marked'] == 1
+    assert _unread(dynamodb) == 1
+
+
+def test_delivery_compacts_stage_notifications_and_discounts_unread(dynamodb):
+    written, _ = _store_notifications([
+        _entry('COOKING', '2024-05-01T10:05:00', 'm1'),
+        _entry('PACKAGING', '2024-05-01T10:20:00', 'm2'),
+    ])
+    cooking = next(item for item in written if item['stage'] == 'COOKING')
+    mark_notification_read({'pathParameters': {'customerId': 'cliente-1'},
+                            'body': {'notificationSK': cooking['SK']}}, None)
+    assert _unread(dynamodb) == 1
+
+    delivered, _ = _store_notifications([_entry('', '2024-05-01T11:00:00', 'm3', detail_type='OrderDelivered')])
+    _compact_delivered(delivered)
+
+    [notification] = _notifications(dynamodb)
+    assert notification['type'] == 'OrderDelivered'
+    assert [step['stage'] for step in notification['timeline']] == ['COOKING', 'PACKAGING']
+    assert _unread(dynamodb) == 1
+
+
+def test_event_for_an_order_without_customer_is_skipped(dynamodb):
+    event = {'detail-type': 'OrderStageStarted', 'detail': {'orderId': 'sin-pedido', 'tenantId': 'pardos',
+                                                             'stage': 'COOKING'}}
+    response = send_order_notification(event, None)
+
+    assert response['statusCode'] == 200
+    assert json.loads(response['body'])['message'] == 'Notification skipped'
+    assert not list(dynamodb.iter_scan(os.environ['NOTIFICATIONS_TABLE']))
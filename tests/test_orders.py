@@ -0,0 +1,71 @@
+import copy
+
+from shared.orders import apply_order_event, new_stage_durations
+
+
+def _event(stage, timestamp, **detail):
+    detail_type = {'CREATED': 'OrderCreated', 'DELIVERED': 'OrderDelivered'}.get(stage, 'OrderStageStarted')
+    return detail_type, {'orderId': '1', 'tenantId': 'pardos', 'stage': stage, 'timestamp': timestamp, **detail}
+
+
+def _apply(view, event):
+    return apply_order_event(view, *event)
+
+
+def test_out_of_order_events_converge():
+    created = _event('CREATED', '2024-05-01T10:00:00', total=30, items=[{'productId': 'pollo', 'qty': 1, 'price': 30}])
+    cooking = _event('COOKING', '2024-05-01T10:05:00')
+    packaging = _event('PACKAGING', '2024-05-01T10:20:00')
+
+    in_order = {}
+    for event in (created, cooking, packaging):
+        in_order, _ = _apply(in_order, event)
+    shuffled = {}
+    for event in (packaging, created, cooking):
+        shuffled, _ = _apply(shuffled, event)
+
+    assert shuffled == in_order
+    assert shuffled['currentStep'] == 'PACKAGING' and shuffled['status'] == 'IN_PROGRESS'
+    assert shuffled['timeline']['COOKING'] == {'startedAt': '2024-05-01T10:05:00', 'finishedAt': '2024-05-01T10:20:00'}
+
+
+def test_late_event_does_not_move_status_back():
+    view, _ = _apply({}, _event('DELIVERED', '2024-05-01T11:00:00'))
+    view, changed = _apply(view, _event('DELIVERY', '2024-05-01T10:40:00'))
+
+    assert changed
+    assert view['currentStep'] == 'DELIVERED' and view['status'] == 'COMPLETED'
+    assert view['timeline']['DELIVERY']['startedAt'] == '2024-05-01T10:40:00'
+
+
+def test_duplicates_are_noops_and_earliest_timestamp_wins():
+    view, _ = _apply({}, _event('COOKING', '2024-05-01T10:05:00'))
+    _, changed = _apply(copy.deepcopy(view), _event('COOKING', '2024-05-01T10:05:00'))
+    assert not changed
+
+    view, changed = _apply(view, _event('COOKING', '2024-05-01T10:04:00'))
+    assert changed and view['timeline']['COOKING']['startedAt'] == '2024-05-01T10:04:00'
+    _, changed = _apply(copy.deepcopy(view), _event('COOKING', '2024-05-01T10:09:00'))
+    assert not changed
+
+
+def test_unknown_stage_is_ignored():
+    view, changed = apply_order_event({}, 'OrderStageStarted', {'orderId': '1', 'stage': 'OTRA'})
+    assert view == {} and not changed
+
+
+def test_stage_durations_reported_once():
+    view, _ = _apply({}, _event('CREATED', '2024-05-01T10:00:00'))
+    before = copy.deepcopy(view['timeline'])
+    view, _ = _apply(view, _event('COOKING', '2024-05-01T10:05:00'))
+    assert new_stage_durations(before, view['timeline']) == {'CREATED': 300}
+
+    before = copy.deepcopy(view['timeline'])
+    view, _ = _apply(view, _event('COOKING', '2024-05-01T10:05:00'))
+    assert new_stage_durations(before, view['timeline']) == {}
+
+    for stage, timestamp in (('PACKAGING', '2024-05-01T10:20:00'), ('DELIVERY', '2024-05-01T10:30:00')):
+        view, _ = _apply(view, _event(stage, timestamp))
+    before = copy.deepcopy(view['timeline'])
+    view, _ = _apply(view, _event('DELIVERED', '2024-05-01T11:00:00'))
+    assert new_stage_durations(before, view['timeline']) == {'DELIVERY': 1800, 'TOTAL': 3600}
@@ -0,0 +1,76 @@
+import os
+
+import pytest
+
+pytest.importorskip('boto3')
+from botocore.exceptions import ClientError
+
+from cleanup import handler as cleanup
+from ms_restaurante import handler
+from shared.outbox import OUTBOX_SK_PREFIX, outbox_item
+
+ORDER_KEY = {'PK': 'TENANT#pardos#ORDER#1', 'SK': 'INFO'}
+
+
+def _outbox(db):
+    return [item for item in db.iter_scan(os.environ['STEPS_TABLE']) if item['SK'].startswith(OUTBOX_SK_PREFIX)]
+
+
+def _current_step(db):
+    return db.get_item(os.environ['ORDERS_TABLE'], ORDER_KEY)['Item']['currentStep']
+
+
+@pytest.fixture
+def order(dynamodb):
+    dynamodb.put_item(os.environ['ORDERS_TABLE'], {**ORDER_KEY, 'orderId': '1', 'currentStep': 'CREATED'})
+    return dynamodb
+
+
+def test_transition_publishes_and_clears_outbox(order, events_client):
+    result = handler.process_cooking({'orderId': '1', 'tenantId': 'pardos'}, None)
+
+    assert result['stage'] == 'COOKING'
+    assert _current_step(order) == 'COOKING'
+    assert events_client.detail_types() == ['OrderStageStarted']
+    assert _outbox(order) == []
+
+
+def test_publish_failure_leaves_event_for_relay(order, events_client):
+    events_client.fail = ClientError({'Error': {'Code': 'ThrottlingException', 'Message': 'lento'}}, 'PutEvents')
+
+    result = handler.process_cooking({'orderId': '1', 'tenantId': 'pardos'}, None)
+
+    assert result['stage'] == 'COOKING'
+    assert _current_step(order) == 'COOKING'
+    [pending] = _outbox(order)
+    assert pending['detailType'] == 'OrderStageStarted' and pending['status'] == 'OUTBOX_PENDING'
+
+
+def test_retried_transition_does_not_publish_again(order, events_client):
+    handler.process_cooking({'orderId': '1', 'tenantId': 'pardos'}, None)
+    handler.process_cooking({'orderId': '1', 'tenantId': 'pardos'}, None)
+
+    assert events_client.detail_types() == ['OrderStageStarted']
+
+
+def test_transition_from_wrong_stage_writes_nothing(order, events_client):
+    with pytest.raises(RuntimeError):
+        handler.process_packaging({'orderId': '1', 'tenantId': 'pardos'}, None)
+    assert _current_step(order) == 'CREATED'
+    assert _outbox(order) == [] and events_client.entries == []
+
+
+def test_relay_publishes_old_items_and_keeps_them_on_failure(dynamodb, events_client):
+    event = {'source': 'pardos.orders', 'detail_type': 'OrderStageStarted', 'detail': {'orderId': '2'}}
+    dynamodb.put_item(os.environ['STEPS_TABLE'], outbox_item('2', 'COOKING', event, '2024-05-01T10:00:00'))
+    # Recién escrito: todavía puede estar publicándolo la Lambda que lo creó
+    dynamodb.put_item(os.environ['STEPS_TABLE'], outbox_item('3', 'COOKING', event, '2999-01-01T00:00:00'))
+
+    events_client.fail = ClientError({'Error': {'Code': 'ThrottlingException', 'Message': 'lento'}}, 'PutEvents')
+    assert cleanup.relay_outbox({}, None)['statusCode'] == 500
+    assert len(_outbox(dynamodb)) == 2
+
+    events_client.fail = None
+    assert cleanup.relay_outbox({}, None)['statusCode'] == 200
+    assert events_client.detail_types() == ['OrderStageStarted']
+    assert [item['orderId'] for item in _outbox(dynamodb)] == ['3']
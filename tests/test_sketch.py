@@ -0,0 +1,53 @@
+from collections import Counter
+
+from shared.sketch import SKETCH_RELATIVE_ACCURACY, LatencySketch, sketch_increments
+
+
+def _exact_quantile(values, q):
+    ordered = sorted(values)
+    return ordered[int(q * (len(ordered) - 1))]
+
+
+def test_quantiles_within_relative_accuracy():
+    values = [1.5 * i for i in range(1, 2001)]
+    sketch = LatencySketch()
+    for value in values:
+        sketch.add(value)
+
+    for q in (0.5, 0.9, 0.99):
+        exact = _exact_quantile(values, q)
+        assert abs(sketch.quantile(q) - exact) <= SKETCH_RELATIVE_ACCURACY * exact
+    assert sketch.count == len(values)
+
+
+def test_empty_and_sub_second_values():
+    assert LatencySketch().quantile(0.5) is None
+    assert LatencySketch().mean() is None
+
+    sketch = LatencySketch().add(0.2).add(0.4).add(100)
+    assert sketch.quantile(0.5) == 0.0
+    assert sketch.quantile(1) > 0
+
+
+def test_stored_increments_rebuild_same_sketch():
+    values = [0.5, 3, 45, 45, 320, 1800]
+    stored = Counter()
+    for value in values:
+        stored.update(sketch_increments(value))
+    from_item = LatencySketch.from_item(dict(stored, PK='TENANT#pardos#LATENCY', SK='STAGE#COOKING'))
+
+    in_memory = LatencySketch()
+    for value in values:
+        in_memory.add(value)
+    assert from_item.buckets == in_memory.buckets
+    assert (from_item.zero, from_item.count, from_item.total) == (in_memory.zero, in_memory.count, in_memory.total)
+
+
+def test_merge_equals_single_sketch():
+    left, right, both = LatencySketch(), LatencySketch(), LatencySketch()
+    for value in range(1, 500):
+        (left if value % 2 else right).add(value)
+        both.add(value)
+    merged = left.merge(right)
+    assert merged.buckets == both.buckets
+    assert merged.quantile(0.95) == both.quantile(0.95)